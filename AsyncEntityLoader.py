@@ -0,0 +1,64 @@
+import asyncio
+from typing import Optional
+from concurrent.futures import Executor
+
+from EntityLoader import LoadBehaviour, LoadContext, LoadResult
+from loading import Loading, LoadingWriter, new_loading, insert_loading
+from main import UnitOfWork
+
+
+class AsyncLoadBehaviour(LoadBehaviour):
+    async def load(self, obj: LoadContext, loading: Loading) -> Optional[LoadResult]:
+        pass
+
+
+class AsyncEntityLoader(object):
+    def __init__(
+        self,
+        load_behaviour: AsyncLoadBehaviour,
+        db_executor: Executor = None,
+        loading_writer: Optional[LoadingWriter] = None,
+        store_resp_text: bool = True,
+        unit_of_work: Optional[UnitOfWork] = None
+    ):
+        assert load_behaviour
+        self._load_behaviour = load_behaviour
+        self._db_executor = db_executor
+        self._loading_writer = loading_writer
+        self._store_resp_text = store_resp_text
+        # without writer the loading is inserted once, on commit of the unit of work
+        self._unit_of_work = unit_of_work
+
+    async def load(self) -> Optional[LoadResult]:
+        loop = asyncio.get_event_loop()
+        current_load_context = self._load_behaviour.get_load_context()
+        load_result = None
+
+        if current_load_context:
+            _loading = (self._loading_writer.create if self._loading_writer else new_loading)(
+                current_load_context.url,
+                current_load_context.params,
+                current_load_context.headers
+            )
+            try:
+                self._load_behaviour.pre_load(current_load_context)
+                load_result = await self._load_behaviour.load(current_load_context, _loading)
+                if load_result:
+                    _loading.set_finish_data(
+                        load_result.resp_status,
+                        load_result.resp_headers,
+                        load_result.resp_raw_data,
+                        load_result.resp_text_data if self._store_resp_text else None
+                    )
+                self._load_behaviour.post_load(load_result)
+            except Exception as e:
+                _loading.error = str(e)
+                load_result = self._load_behaviour.handle_error(current_load_context, e, _loading)
+            finally:
+                if self._loading_writer:
+                    self._loading_writer.finish(_loading)
+                elif self._unit_of_work:
+                    self._unit_of_work.defer(lambda conn: insert_loading(_loading, conn))
+                else:
+                    await loop.run_in_executor(self._db_executor, insert_loading, _loading)
+        return load_result
@@ -0,0 +1,154 @@
+import asyncio
+import aiohttp
+from uuid import uuid4
+from typing import Set, Optional
+from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
+
+from AsyncEntityLoader import AsyncEntityLoader
+from AsyncSimplePageableBehaviour import AsyncSimplePageableBehaviour
+from SessionPool import CONNECT_TIMEOUT, READ_TIMEOUT
+from ObjectQueue import ObjectQueue, QueueEntry
+from LoadHandler import LoadHandler
+from LogPipeline import REQUEST
+
+from config import Config
+from main import UnitOfWork
+
+
+MAX_IN_FLIGHT = 1000
+DB_THREADS = 20
+POLL_SECS = 0.2
+
+
+class AsyncLoadHandler(object):
+    # http is awaited on the event loop, database work goes to db_executor
+    def __init__(self, load_handler: LoadHandler, logger, config: Config, db_executor: ThreadPoolExecutor):
+        self.__load_handler = load_handler
+        self.__logger = logger
+        self.__config = config  # type: Config
+        self.__db_executor = db_executor
+        self.__session = None  # type: Optional[aiohttp.ClientSession]
+
+    async def open(self, max_connections: int):
+        self.__session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=max_connections),
+            timeout=aiohttp.ClientTimeout(
+                connect=self.__config.gh_connect_timeout if self.__config.gh_connect_timeout else CONNECT_TIMEOUT,
+                sock_read=self.__config.gh_read_timeout if self.__config.gh_read_timeout else READ_TIMEOUT
+            )
+        )
+
+    async def close(self):
+        if self.__session:
+            await self.__session.close()
+
+    def __complete(self, current_obj: QueueEntry, load_result, cur_uuid, uow: UnitOfWork):
+        # loading row and completion are committed in one transaction, as in the threaded engine
+        with uow:
+            self.__load_handler.complete(current_obj, load_result, cur_uuid, uow)
+
+    def __fail(self, current_obj: QueueEntry, ex: Exception, cur_uuid, uow: UnitOfWork):
+        with uow:
+            self.__load_handler.fail(current_obj, ex, cur_uuid, uow)
+
+    async def handle_entry(self, current_obj: QueueEntry):
+        loop = asyncio.get_event_loop()
+        _cur_uuid = uuid4()
+        self.__logger.debug('AsyncLoadHandler.handle: start. uuid: %s', _cur_uuid)
+        try:
+            self.__logger.info('type: %s, token_id: %s, url: %s. uuid: %s',
+                current_obj.entry_type
+                , current_obj.token_id
+                , current_obj.url,
+                _cur_uuid,
+                extra=REQUEST
+            )
+            uow = UnitOfWork('AsyncLoadHandler.handle')
+            try:
+                load_result = await AsyncEntityLoader(AsyncSimplePageableBehaviour(
+                    current_obj.token,
+                    self.__config.gh_per_page if self.__config.gh_per_page else 100,
+                    self.__logger,
+                    current_obj.entry_type,
+                    current_obj.url,
+                    current_obj.headers,
+                    current_obj.params,
+                    current_obj.token_id,
+                    str(_cur_uuid),
+                    self.__session,
+                    self.__load_handler.conditional_cache,
+                    self.__load_handler.page_fanout_max,
+                    self.__db_executor
+                ), self.__db_executor, self.__load_handler.loading_writer, self.__load_handler.store_resp_text,
+                    uow).load()
+            except Exception as ex:
+                # failed request or response, the loading is written with the job's error
+                await loop.run_in_executor(self.__db_executor, self.__fail, current_obj, ex, _cur_uuid, uow)
+            else:
+                await loop.run_in_executor(
+                    self.__db_executor, self.__complete, current_obj, load_result, _cur_uuid, uow
+                )
+        except Exception as ex:
+            await loop.run_in_executor(
+                self.__db_executor, self.__load_handler.fail, current_obj, ex, _cur_uuid
+            )
+        self.__logger.debug('AsyncLoadHandler.handle: end. uuid: %s', _cur_uuid)
+
+
+class AsyncLoadEngine(object):
+    # replaces prepare_job and the worker threads when scheduler.sched_engine is 'async'
+    def __init__(self, queue: ObjectQueue, load_handler: LoadHandler, logger, config: Config):
+        self.__queue = queue
+        self.__logger = logger
+        self.__config = config  # type: Config
+        self.__max_in_flight = config.sched_async_max_in_flight \
+            if config.sched_async_max_in_flight else MAX_IN_FLIGHT
+        self.__db_executor = ThreadPoolExecutor(
+            config.db_max_connections if config.db_max_connections else DB_THREADS
+        )
+        self.__handler = AsyncLoadHandler(load_handler, logger, config, self.__db_executor)
+        self.__stopped = Event()
+        self.__thread = None  # type: Optional[Thread]
+
+    def start(self):
+        self.__stopped.clear()
+        self.__thread = Thread(target=self.__run_loop, name='async-engine', daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        if self.__thread:
+            self.__thread.join()
+        self.__db_executor.shutdown()
+
+    def __run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.__run())
+        finally:
+            loop.close()
+
+    async def __run(self):
+        loop = asyncio.get_event_loop()
+        tasks = set()  # type: Set[asyncio.Future]
+        await self.__handler.open(self.__max_in_flight)
+        try:
+            while not self.__stopped.is_set():
+                free_slots = self.__max_in_flight - len(tasks)
+                if free_slots > 0:
+                    try:
+                        entries = await loop.run_in_executor(self.__db_executor, self.__queue.claim_due, free_slots)
+                    except Exception as e:
+                        entries = []
+                        self.__logger.error('AsyncLoadEngine: claim error: %s', str(e))
+                    for entry in entries:
+                        task = asyncio.ensure_future(self.__handler.handle_entry(entry))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                await asyncio.sleep(POLL_SECS)
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            await self.__handler.close()
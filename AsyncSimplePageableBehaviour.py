@@ -0,0 +1,55 @@
+import asyncio
+import aiohttp
+import logging
+from typing import Dict, Optional
+from concurrent.futures import Executor
+
+from EntityLoader import LoadContext, Loading
+from AsyncEntityLoader import AsyncLoadBehaviour
+from SimplePageableBehaviour import SimplePageableBehaviour
+from ConditionalCache import ConditionalCache, CacheEntry
+
+
+class AsyncResponse(object):
+    # the part of requests.Response used to build load result
+    def __init__(self, status_code: int, headers: Dict[str, str], text: str):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+
+class AsyncSimplePageableBehaviour(SimplePageableBehaviour, AsyncLoadBehaviour):
+    def __init__(self,
+                 _token: str,
+                 per_page: int,
+                 _logger: logging.Logger,
+                 _loading_obj: str,
+                 _base_url: str,
+                 _headers: str,
+                 _params: str,
+                 _token_id: int,
+                 _proc_uuid: str,
+                 _session: aiohttp.ClientSession,
+                 _cache: ConditionalCache = None,
+                 _fanout_max: int = 0,
+                 _db_executor: Executor = None):
+        super().__init__(_token, per_page, _logger, _loading_obj, _base_url, _headers, _params, _token_id, _proc_uuid,
+                         _cache=_cache, _fanout_max=_fanout_max)
+        self._async_session = _session
+        # disk and postgres cache storages are not used on the event loop
+        self._db_executor = _db_executor
+
+    async def _run_cache(self, func, *args):
+        if self._cache.blocking:
+            return await asyncio.get_event_loop().run_in_executor(self._db_executor, func, *args)
+        return func(*args)
+
+    async def load(self, obj: LoadContext, loading: Loading):
+        url = self._get_request_url(obj, loading)
+        cached = await self._run_cache(self._get_cached, url) if self._cache else None  # type: Optional[CacheEntry]
+        async with self._async_session.get(url, headers=self._get_request_headers(obj, cached)) as resp:
+            text = await resp.text()
+        response = AsyncResponse(resp.status, resp.headers, text)
+        if self._cache:
+            await self._run_cache(self._store_cached, url, response, cached)
+        return self._get_load_result(obj, url, response, cached)
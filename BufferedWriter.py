@@ -0,0 +1,114 @@
+import atexit
+from time import time, sleep
+from threading import Thread, Lock
+from queue import Queue, Empty, Full
+from typing import List
+
+from main import get_logger
+
+
+BATCH_SIZE = 500
+FLUSH_MS = 200
+BUFFER_SIZE = 10000
+# a blocked put checks this often whether the writer thread is still running
+PUT_CHECK_SECS = 1.0
+FLUSH_RETRIES = 3
+FLUSH_RETRY_SECS = 1.0
+
+_STOP = object()
+
+
+class BufferedWriter(object):
+    # items are flushed by a background thread every batch_size items or flush_ms,
+    # put blocks while buffer_size items are waiting (backpressure)
+    # a failed flush is retried flush_retries times, then the batch is given to _flush_failed
+    flush_retries = 0
+
+    def __init__(self,
+                 name: str,
+                 batch_size: int = BATCH_SIZE,
+                 flush_ms: int = FLUSH_MS,
+                 buffer_size: int = BUFFER_SIZE):
+        self._logger = get_logger()
+        self.__name = name
+        self.__batch_size = batch_size
+        self.__flush_secs = flush_ms / 1000.0
+        self.__queue = Queue(buffer_size)
+        self.__thread = None  # type: Thread
+        self.__lock = Lock()
+
+    def start(self):
+        with self.__lock:
+            if self.__thread:
+                return
+            self.__thread = Thread(target=self.__run, name=self.__name, daemon=True)
+            self.__thread.start()
+        atexit.register(self.close)
+
+    def is_running(self) -> bool:
+        thread = self.__thread
+        return thread is not None and thread.is_alive()
+
+    def put(self, item, timeout: float = None) -> bool:
+        # refused when the writer is closed, its thread has died or the buffer stays full for timeout
+        deadline = time() + timeout if timeout is not None else None
+        while self.is_running():
+            try:
+                self.__queue.put(item, timeout=PUT_CHECK_SECS if deadline is None
+                                 else max(min(PUT_CHECK_SECS, deadline - time()), 0))
+                return True
+            except Full:
+                if deadline is not None and time() >= deadline:
+                    return False
+        self._logger.error('{}: writer is not running, item refused'.format(self.__name))
+        return False
+
+    def close(self):
+        # everything put before close is flushed
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread:
+            self.__queue.put(_STOP)
+            thread.join()
+
+    def _flush(self, items: List):
+        pass
+
+    def _flush_failed(self, items: List, error: Exception):
+        self._logger.error('{}: {} items are lost: {}'.format(self.__name, len(items), str(error)))
+
+    def __safe_flush(self, items: List):
+        error = None
+        for attempt in range(self.flush_retries + 1):
+            if attempt:
+                sleep(FLUSH_RETRY_SECS * 2 ** (attempt - 1))
+            try:
+                self._flush(items)
+                return
+            except Exception as e:
+                error = e
+                self._logger.error('{}: flush of {} items failed: {}'.format(self.__name, len(items), str(e)))
+        try:
+            self._flush_failed(items, error)
+        except Exception as e:
+            self._logger.error('{}: {} items are lost: {}'.format(self.__name, len(items), str(e)))
+
+    def __run(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            try:
+                item = self.__queue.get(timeout=max(deadline - time(), 0) if batch else None)
+            except Empty:
+                item = None
+            if item is _STOP:
+                if batch:
+                    self.__safe_flush(batch)
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time() + self.__flush_secs
+                batch.append(item)
+            if batch and (len(batch) >= self.__batch_size or time() >= deadline):
+                self.__safe_flush(batch)
+                batch = []
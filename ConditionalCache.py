@@ -0,0 +1,250 @@
+import os
+import json
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from main import transaction
+
+
+MAX_ENTRIES = 2000
+EVICT_EVERY = 100
+
+
+class CacheEntry(object):
+    def __init__(self, etag: Optional[str], last_modified: Optional[str], body: str):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class CacheStorage(object):
+    # get and put do file or database io
+    blocking = True
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        pass
+
+    def put(self, key: str, entry: CacheEntry):
+        pass
+
+
+class MemoryCacheStorage(CacheStorage):
+    blocking = False
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.__max_entries = max_entries
+        self.__entries = OrderedDict()  # type: OrderedDict
+        self.__lock = Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry:
+                self.__entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CacheEntry):
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+
+class DiskCacheStorage(CacheStorage):
+    # one json file per key, least recently written files are removed
+    def __init__(self, path: str, max_entries: int = MAX_ENTRIES):
+        self.__path = path
+        self.__max_entries = max_entries
+        self.__puts = 0
+        self.__lock = Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def __file_name(self, key: str) -> str:
+        return os.path.join(self.__path, '{}.json'.format(hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self.__file_name(key), 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(raw['etag'], raw['last_modified'], raw['body'])
+
+    def put(self, key: str, entry: CacheEntry):
+        file_name = self.__file_name(key)
+        tmp_name = '{}.tmp'.format(file_name)
+        with open(tmp_name, 'w', encoding='utf-8') as f:
+            json.dump({'etag': entry.etag, 'last_modified': entry.last_modified, 'body': entry.body}, f)
+        os.replace(tmp_name, file_name)
+        with self.__lock:
+            self.__puts += 1
+            if self.__puts % EVICT_EVERY:
+                return
+        self.__evict()
+
+    def __evict(self):
+        files = [os.path.join(self.__path, name) for name in os.listdir(self.__path) if name.endswith('.json')]
+        if len(files) <= self.__max_entries:
+            return
+        files.sort(key=lambda name: os.stat(name).st_mtime)
+        for name in files[:len(files) - self.__max_entries]:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+class PgCacheStorage(CacheStorage):
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.__max_entries = max_entries
+        self.__puts = 0
+        self.__lock = Lock()
+        self.create_table()
+
+    def create_table(self):
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create table if not exists stg.conditional_cache
+                    (
+                        key varchar(2048) not null primary key
+                        , etag varchar(256)
+                        , last_modified varchar(64)
+                        , body text
+                        , stored_at timestamp(3) with time zone not null default now()
+                    )
+                ''')
+                cur.execute('''
+                    create index if not exists ix_conditional_cache_stored_at
+                        on stg.conditional_cache (stored_at)
+                ''')
+                conn.commit()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    select
+                        etag
+                        , last_modified
+                        , body
+                    from
+                        stg.conditional_cache
+                    where
+                        key = %s
+                ''', (key,))
+                raw = cur.fetchone()
+        return CacheEntry(raw[0], raw[1], raw[2]) if raw else None
+
+    def put(self, key: str, entry: CacheEntry):
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    insert into
+                        stg.conditional_cache
+                    (
+                        key
+                        , etag
+                        , last_modified
+                        , body
+                    )
+                    values
+                    (
+                        %(key)s
+                        , %(etag)s
+                        , %(last_modified)s
+                        , %(body)s
+                    )
+                    on conflict (key) do update set
+                        etag = excluded.etag
+                        , last_modified = excluded.last_modified
+                        , body = excluded.body
+                        , stored_at = now()
+                ''', {'key': key, 'etag': entry.etag, 'last_modified': entry.last_modified, 'body': entry.body})
+                conn.commit()
+        with self.__lock:
+            self.__puts += 1
+            if self.__puts % EVICT_EVERY:
+                return
+        self.__evict()
+
+    def __evict(self):
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    delete from
+                        stg.conditional_cache
+                    where
+                        stored_at <
+                        (
+                            select
+                                stored_at
+                            from
+                                stg.conditional_cache
+                            order by
+                                stored_at desc
+                            offset %s
+                            limit 1
+                        )
+                ''', (self.__max_entries,))
+                conn.commit()
+
+
+class ConditionalCache(object):
+    # ETag / Last-Modified of loaded pages, 304 responses don't count against rate limit.
+    # Pages are kept per token, tokens may see different content (private repositories)
+    def __init__(self, storage: CacheStorage):
+        self.__storage = storage
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def blocking(self) -> bool:
+        return self.__storage.blocking
+
+    @staticmethod
+    def __key(token_id: int, url: str) -> str:
+        return '{}:{}'.format(token_id, url)
+
+    def get(self, token_id: int, url: str) -> Optional[CacheEntry]:
+        return self.__storage.get(self.__key(token_id, url))
+
+    def store(self, token_id: int, url: str, resp_status: int, resp_headers, body: str,
+              cached: Optional[CacheEntry]):
+        with self.__lock:
+            if resp_status == 304:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if resp_status != 200:
+            return
+        etag = resp_headers.get('ETag')
+        last_modified = resp_headers.get('Last-Modified')
+        if etag or last_modified:
+            self.__storage.put(self.__key(token_id, url), CacheEntry(etag, last_modified, body))
+
+    def stats(self) -> Dict[str, int]:
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_conditional_cache(storage: str, max_entries: int = MAX_ENTRIES, path: str = None) -> Optional[ConditionalCache]:
+    if storage == 'memory':
+        return ConditionalCache(MemoryCacheStorage(max_entries))
+    if storage == 'disk':
+        return ConditionalCache(DiskCacheStorage(path if path else os.path.join('cache', 'conditional'), max_entries))
+    if storage == 'postgres':
+        return ConditionalCache(PgCacheStorage(max_entries))
+    return None
@@ -0,0 +1,118 @@
+import heapq
+from time import time
+from itertools import count
+from typing import Callable, List, Optional
+from threading import Thread, Condition, Event
+
+from ObjectQueue import ObjectQueue, QueueEntry
+from main import get_logger
+
+
+LOOKAHEAD_SECS = 5.0
+REFRESH_SECS = 1.0
+
+
+class TimingDispatcher(object):
+    # entries for the next lookahead_secs are claimed in one go and fired from memory,
+    # so the database is touched on claim and completion only.
+    # Entries of a token paused after they were claimed are released instead of fired
+    def __init__(self,
+                 queue: ObjectQueue,
+                 fire: Callable[[QueueEntry], None],
+                 lookahead_secs: float = LOOKAHEAD_SECS,
+                 refresh_secs: float = REFRESH_SECS,
+                 is_paused: Optional[Callable[[int], bool]] = None):
+        self.__queue = queue
+        self.__fire = fire
+        self.__is_paused = is_paused
+        self.__lookahead_secs = lookahead_secs
+        self.__refresh_secs = refresh_secs
+        self.__polling_refresh_secs = refresh_secs
+        self.__logger = get_logger()
+        self.__heap = []  # type: List
+        self.__seq = count()
+        self.__heap_cond = Condition()
+        self.__refresh_event = Event()
+        self.__stopped = Event()
+        self.__threads = []  # type: List[Thread]
+
+    def start(self):
+        self.__stopped.clear()
+        self.__threads = [
+            Thread(target=self.__refresh_loop, name='dispatcher-refresh', daemon=True),
+            Thread(target=self.__fire_loop, name='dispatcher-fire', daemon=True)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__refresh_event.set()
+        with self.__heap_cond:
+            self.__heap_cond.notify_all()
+        for thread in self.__threads:
+            thread.join()
+        with self.__heap_cond:
+            unfired = [item[2] for item in self.__heap]
+            self.__heap = []
+        self.__queue.release(unfired)
+
+    def wake(self):
+        self.__refresh_event.set()
+
+    def set_event_driven(self, enabled: bool):
+        # with notifications a refresh is needed only for entries coming into the lookahead window
+        self.__refresh_secs = self.__lookahead_secs / 2 if enabled else self.__polling_refresh_secs
+
+    def notify(self, payloads: List[str]):
+        # payloads are epochs of the earliest scheduled execute_at
+        horizon = time() + self.__lookahead_secs
+        if any(float(payload) <= horizon for payload in payloads):
+            self.wake()
+
+    def __push(self, entries: List[QueueEntry]):
+        with self.__heap_cond:
+            for entry in entries:
+                heapq.heappush(self.__heap, (entry.execute_at.timestamp(), next(self.__seq), entry))
+            self.__heap_cond.notify()
+
+    def __refresh_loop(self):
+        while not self.__stopped.is_set():
+            try:
+                entries = self.__queue.claim_upcoming(self.__lookahead_secs)
+                if entries:
+                    self.__push(entries)
+                    self.__logger.debug('TimingDispatcher: claimed {} entries'.format(len(entries)))
+            except Exception as e:
+                self.__logger.error('TimingDispatcher: refresh error: {}'.format(str(e)))
+            self.__refresh_event.wait(self.__refresh_secs)
+            self.__refresh_event.clear()
+
+    def __pop_due(self) -> List[QueueEntry]:
+        due = []
+        with self.__heap_cond:
+            while not due and not self.__stopped.is_set():
+                now = time()
+                while self.__heap and self.__heap[0][0] <= now:
+                    due.append(heapq.heappop(self.__heap)[2])
+                if not due:
+                    self.__heap_cond.wait(self.__heap[0][0] - now if self.__heap else None)
+        return due
+
+    def __fire_loop(self):
+        while not self.__stopped.is_set():
+            held = []
+            for entry in self.__pop_due():
+                if self.__is_paused and self.__is_paused(entry.token_id):
+                    held.append(entry)
+                    continue
+                try:
+                    self.__fire(entry)
+                except Exception as e:
+                    self.__logger.error('TimingDispatcher: fire error, id: {}: {}'.format(entry.id, str(e)))
+            if held:
+                # claimed again once the pause is over
+                try:
+                    self.__queue.release(held)
+                except Exception as e:
+                    self.__logger.error('TimingDispatcher: release error: {}'.format(str(e)))
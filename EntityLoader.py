@@ -1,5 +1,6 @@
 from typing import List, Dict, Optional, Callable
-from loading import Loading, create_loading, finish_loading
+from loading import Loading, LoadingWriter, create_loading, finish_loading, new_loading, insert_loading
+from main import UnitOfWork
 
 
 class LoadContext:
@@ -68,6 +69,9 @@ class LoadResult:
         self.resp_raw_data = resp_raw_data
         self.resp_text_data = resp_text_data
         self.next_load_context = next_load_context  # type: Optional[LoadContext]
+        # pages enqueued at once, instead of next_load_context
+        self.fanout_load_contexts = []  # type: List[LoadContext]
+        self.is_last_page = next_load_context is None  # type: bool
 
     @staticmethod
     def get_end_load_result(obj: LoadContext):
@@ -99,10 +103,18 @@ class LoadBehaviour:
 class EntityLoader:
     def __init__(
         self,
-        load_behaviour: LoadBehaviour
+        load_behaviour: LoadBehaviour,
+        loading_writer: Optional[LoadingWriter] = None,
+        unit_of_work: Optional[UnitOfWork] = None,
+        store_resp_text: bool = True
     ):
         assert load_behaviour
         self._load_behaviour = load_behaviour
+        self._loading_writer = loading_writer
+        # without writer the loading is inserted once, on commit of the unit of work
+        self._unit_of_work = unit_of_work
+        # parsed results can go to a result sink instead
+        self._store_resp_text = store_resp_text
 
     def load(self) -> Optional[LoadResult]:
          return self.__load()
@@ -113,7 +125,13 @@ class EntityLoader:
         load_result = None
 
         if current_load_context:
-            _loading = create_loading(
+            if self._loading_writer:
+                _create = self._loading_writer.create
+            elif self._unit_of_work:
+                _create = new_loading
+            else:
+                _create = create_loading
+            _loading = _create(
                 current_load_context.url,
                 current_load_context.params,
                 current_load_context.headers
@@ -126,12 +144,17 @@ class EntityLoader:
                         load_result.resp_status,
                         load_result.resp_headers,
                         load_result.resp_raw_data,
-                        load_result.resp_text_data
+                        load_result.resp_text_data if self._store_resp_text else None
                     )
                 self._load_behaviour.post_load(load_result)
             except Exception as e:
                 _loading.error = str(e)
                 load_result = self._load_behaviour.handle_error(current_load_context, e, _loading)
             finally:
-                finish_loading(_loading)
+                if self._loading_writer:
+                    self._loading_writer.finish(_loading)
+                elif self._unit_of_work:
+                    self._unit_of_work.defer(lambda conn: insert_loading(_loading, conn))
+                else:
+                    finish_loading(_loading)
         return load_result
@@ -0,0 +1,55 @@
+from queue import Queue
+from threading import Thread
+from typing import Callable, List
+
+from main import get_logger
+
+
+WORKERS = 32
+QUEUE_SIZE = 1024
+
+
+class JobExecutor(object):
+    # one-shot jobs are kept in memory only, submit blocks while the queue is full
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE, name: str = 'load-worker'):
+        self.__queue = Queue(queue_size)
+        self.__workers = workers
+        self.__name = name
+        self.__threads = []  # type: List[Thread]
+        self.__logger = get_logger()
+
+    @property
+    def pending(self) -> int:
+        return self.__queue.qsize()
+
+    def start(self):
+        for i in range(self.__workers):
+            thread = Thread(target=self.__run, name='{}-{}'.format(self.__name, i), daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def submit(self, fn: Callable, *args, **kwargs):
+        self.__queue.put((fn, args, kwargs))
+
+    def shutdown(self, wait: bool = True):
+        # sentinels are queued after the jobs already submitted, so those are run first
+        for _ in self.__threads:
+            self.__queue.put(None)
+        if wait:
+            for thread in self.__threads:
+                thread.join()
+        self.__threads = []
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+            try:
+                if job is None:
+                    return
+                fn, args, kwargs = job
+                try:
+                    fn(*args, **kwargs)
+                except Exception as e:
+                    self.__logger.error('JobExecutor: job error: %s', str(e))
+            finally:
+                self.__queue.task_done()
@@ -0,0 +1,60 @@
+from threading import Lock
+
+from main import pool, get_logger
+
+
+# pg_advisory_lock key of the fill and cleanup leader
+LEADER_LOCK_KEY = 7340021
+
+
+class LeaderLock(object):
+    # session advisory lock on a dedicated pool connection, released by postgres when the
+    # holding process dies, so another process takes over on its next acquire.
+    # With scope (node id) there is one leader per scope
+    def __init__(self, key: int = LEADER_LOCK_KEY, scope: str = None):
+        self.__key = key
+        self.__scope = scope
+        self.__conn = None
+        self.__lock = Lock()
+        self.__logger = get_logger()
+        self.is_leader = False  # type: bool
+
+    def acquire(self) -> bool:
+        with self.__lock:
+            try:
+                if self.__conn is None:
+                    self.__conn = pool.getconn()
+                    self.__conn.set_session(autocommit=True)
+                with self.__conn.cursor() as cur:
+                    if self.is_leader:
+                        # a lost connection has lost the lock too
+                        cur.execute('select 1')
+                    else:
+                        if self.__scope:
+                            cur.execute('select pg_try_advisory_lock(%s, hashtext(%s))', (self.__key, self.__scope))
+                        else:
+                            cur.execute('select pg_try_advisory_lock(%s)', (self.__key,))
+                        self.__set_leader(cur.fetchone()[0])
+            except Exception as e:
+                self.__logger.error('LeaderLock: {}'.format(str(e)))
+                self.__close()
+        return self.is_leader
+
+    def release(self):
+        with self.__lock:
+            self.__close()
+
+    def __set_leader(self, is_leader: bool):
+        if is_leader != self.is_leader:
+            self.__logger.info('LeaderLock: {}'.format('leader' if is_leader else 'follower'))
+        self.is_leader = is_leader
+
+    def __close(self):
+        conn, self.__conn = self.__conn, None
+        self.__set_leader(False)
+        if conn is not None:
+            try:
+                # closing the session releases the lock
+                pool.putconn(conn, close=True)
+            except Exception:
+                pass
@@ -1,103 +1,378 @@
-from EntityLoader import EntityLoader, LoadResult
-from SimplePageableBehaviour import SimplePageableBehaviour
-from ObjectQueue import QueueRepository, ObjectHistoryRepository, ObjectQueue, QueueEntry, QueueState, MAX_RETRY_COUNT
+from EntityLoader import EntityLoader, LoadResult, LoadContext
+from SimplePageableBehaviour import SimplePageableBehaviour, PAGE_FANOUT_MAX
+from loading import LoadingWriter
+from ResultSink import ResultSink, get_result_sinks
+from BufferedWriter import BATCH_SIZE, FLUSH_MS, BUFFER_SIZE
+from ConditionalCache import ConditionalCache, get_conditional_cache, MAX_ENTRIES
+from SessionPool import SessionPool, POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES
+from TokenBudget import TokenBudgetTracker, get_budget_tracker
+from TokenRepository import TokenRegistry, get_token_registry
+from TokenSharding import TokenSharding, get_token_sharding
+from RetryPolicy import CircuitBreaker, ErrorClass, classify, classify_exception, backoff_secs, BACKOFF_BASE_SECS, BACKOFF_MAX_SECS, \
+    BREAKER_FAILURES, BREAKER_OPEN_SECS, BREAKER_MAX_OPEN_SECS
+from ObjectQueue import QueueRepository, ObjectHistoryRepository, ObjectQueue, QueueEntry, QueueState, MAX_RETRY_COUNT, \
+    CompletionCollector, COMPLETION_LATENCY_MS, COMPLETION_TIMEOUT_SECS
 
+from time import time
 from uuid import uuid4
 from json import dumps
-from copy import deepcopy
 from threading import local
+from typing import Optional, Dict, Tuple
 from datetime import datetime
 from tzlocal import get_localzone
 
 from config import Config
+from main import UnitOfWork
+from LogPipeline import REQUEST
+
+
+DRAIN_PAGES = 1
+DRAIN_SECS = 10.0
 
 
 class LoadHandler(object):
     def __init__(self, logger, config: Config = None):
-        self.__object_queue = ObjectQueue(config)
+        # before queue repositories, they share the registry
+        self.token_registry = get_token_registry(
+            config.gh_token_ttl_secs if config else None
+        )  # type: TokenRegistry
+        # pages are spread only over tokens of this node
+        self.token_sharding = get_token_sharding() if config and config.sched_sharding else None  # type: TokenSharding
+        self.completions = None  # type: CompletionCollector
+        if config and config.sched_group_commit:
+            self.completions = CompletionCollector(
+                config.sched_group_commit_size if config.sched_group_commit_size else BATCH_SIZE,
+                config.sched_group_commit_latency_ms if config.sched_group_commit_latency_ms
+                else COMPLETION_LATENCY_MS,
+                config.sched_group_commit_timeout_secs if config.sched_group_commit_timeout_secs
+                else COMPLETION_TIMEOUT_SECS
+            )
+            self.completions.start()
+        self.__object_queue = ObjectQueue(config, self.completions)
         self.__queue_repository = QueueRepository()  # type: QueueRepository
         self.__obj_history_repository = ObjectHistoryRepository()  # type: ObjectHistoryRepository
         self.__logger = logger
         self.__config = config  # type: Config
         self.__thread_local_store = local()
+        self.budget_tracker = get_budget_tracker(
+            config.gh_default_interval, config.gh_budget_reserve
+        ) if config else get_budget_tracker()  # type: TokenBudgetTracker
+        self.session_pool = SessionPool(
+            config.gh_pool_size if config and config.gh_pool_size else POOL_SIZE,
+            config.gh_connect_timeout if config and config.gh_connect_timeout else CONNECT_TIMEOUT,
+            config.gh_read_timeout if config and config.gh_read_timeout else READ_TIMEOUT,
+            config.gh_max_retries if config and config.gh_max_retries is not None else MAX_RETRIES
+        )  # type: SessionPool
+        self.conditional_cache = get_conditional_cache(
+            config.gh_cache_storage,
+            config.gh_cache_max_entries if config.gh_cache_max_entries else MAX_ENTRIES,
+            config.gh_cache_path
+        ) if config else None  # type: ConditionalCache
+        self.page_fanout_max = config.gh_page_fanout_max if config and config.gh_page_fanout_max is not None \
+            else PAGE_FANOUT_MAX  # type: int
+        # pages loaded by one job while the token has budget, 1 re-queues every next page
+        self.drain_pages = config.sched_drain_pages if config and config.sched_drain_pages else DRAIN_PAGES
+        self.drain_secs = config.sched_drain_secs if config and config.sched_drain_secs else DRAIN_SECS
+        self.backoff_base_secs = config.sched_backoff_base_secs if config and config.sched_backoff_base_secs \
+            else BACKOFF_BASE_SECS
+        self.backoff_max_secs = config.sched_backoff_max_secs if config and config.sched_backoff_max_secs \
+            else BACKOFF_MAX_SECS
+        self.circuit_breaker = CircuitBreaker(
+            config.sched_breaker_failures if config and config.sched_breaker_failures else BREAKER_FAILURES,
+            config.sched_breaker_open_secs if config and config.sched_breaker_open_secs else BREAKER_OPEN_SECS,
+            config.sched_breaker_max_open_secs if config and config.sched_breaker_max_open_secs
+            else BREAKER_MAX_OPEN_SECS
+        )  # type: CircuitBreaker
+        self.loading_writer = None  # type: LoadingWriter
+        if config and config.log_buffered:
+            self.loading_writer = LoadingWriter(
+                config.log_batch_size if config.log_batch_size else BATCH_SIZE,
+                config.log_flush_ms if config.log_flush_ms else FLUSH_MS,
+                config.log_buffer_size if config.log_buffer_size else BUFFER_SIZE
+            )
+            self.loading_writer.start()
+        self.result_sinks = {}  # type: Dict[str, ResultSink]
+        if config and config.sink_enabled:
+            self.result_sinks = get_result_sinks(
+                config.sink_batch_size if config.sink_batch_size else BATCH_SIZE,
+                config.sink_flush_ms if config.sink_flush_ms else FLUSH_MS,
+                config.sink_buffer_size if config.sink_buffer_size else BUFFER_SIZE
+            )
+        self.store_resp_text = config.log_resp_text if config and config.log_resp_text is not None else True
 
-    def _handle_ok(self, queue_object: QueueEntry, load_result: LoadResult):
+    def close(self):
+        if self.completions:
+            self.completions.close()
+        for sink in self.result_sinks.values():
+            sink.close()
+        if self.loading_writer:
+            self.loading_writer.close()
+        self.session_pool.close()
+
+    def _handle_ok(self, queue_object: QueueEntry, load_result: LoadResult, uow: UnitOfWork):
         cur_uuid = self.__thread_local_store.cur_uuid
-        self.__logger.debug('LoadHandler._handle_ok: start. uuid: {}'.format(cur_uuid))
+        self.__logger.debug('LoadHandler._handle_ok: start. uuid: %s', cur_uuid)
         queue_object.updated_at = datetime.now(get_localzone())
         queue_object.closed_at = datetime.now(get_localzone())
         queue_object.state = QueueState.PROCESSED.value
-        self.__object_queue.enqueue_ok(queue_object)
+        _watermark = self.__watermark(load_result)
+        if load_result.next_load_context or load_result.fanout_load_contexts:
+            # the entry is removed together with its next pages, never without them
+            self.__object_queue.enqueue_ok(queue_object, uow.conn, _watermark)
+        else:
+            self.__complete_entry(uow, self.__object_queue.enqueue_ok, queue_object, watermark=_watermark)
+        self.__put_result(queue_object, load_result)
         if load_result.next_load_context:
-            _new_entry = deepcopy(queue_object)
-            _headers = deepcopy(load_result.next_load_context.headers)
-            del _headers['Authorization']
-            _new_entry.headers = dumps(_headers)
-            _new_entry.params = dumps(load_result.next_load_context.params)
-            _new_entry.url = load_result.next_load_context.url
-            self.__queue_repository.add_entry(_new_entry)
-            self.__logger.debug('LoadHandler._handle_ok: added next page. uuid: {}'.format(cur_uuid))
-        self.__logger.debug('LoadHandler._handle_ok: enqueue done. uuid: {}'.format(cur_uuid))
-
-    def _handle_error(self, queue_object: QueueEntry, load_result: LoadResult, error_text: str):
+            _new_entry = self.__page_entry(queue_object, load_result.next_load_context)
+            self.__queue_repository.add_entry(
+                _new_entry, self.budget_tracker.interval(_new_entry.token_id), uow.conn
+            )
+            self.__logger.debug('LoadHandler._handle_ok: added next page. uuid: %s', cur_uuid)
+        if load_result.fanout_load_contexts:
+            # remaining pages at once, spread over tokens with budget
+            _token_ids = [
+                _token_id if self.token_registry.is_enabled(_token_id)
+                and (not self.token_sharding or self.token_sharding.owns(_token_id)) else queue_object.token_id
+                for _token_id in self.budget_tracker.spread(queue_object.token_id, len(load_result.fanout_load_contexts))
+            ]
+            _new_entries = [
+                self.__page_entry(queue_object, _context, _token_id)
+                for _token_id, _context in zip(_token_ids, load_result.fanout_load_contexts)
+            ]
+            self.__queue_repository.add_entries(
+                _new_entries, [self.budget_tracker.interval(e.token_id) for e in _new_entries], uow.conn
+            )
+            self.__logger.debug('LoadHandler._handle_ok: added %s pages. uuid: %s', len(_new_entries), cur_uuid)
+        self.__logger.debug('LoadHandler._handle_ok: enqueue done. uuid: %s', cur_uuid)
+
+    def __complete_entry(self, uow: UnitOfWork, enqueue, *args, **kwargs):
+        # a group committed completion is written once the job's transaction is committed, so a failed
+        # transaction leaves the entry for fail() and the job holds no connection while waiting
+        if self.completions:
+            uow.after_commit(lambda: enqueue(*args, **kwargs))
+        else:
+            enqueue(*args, conn=uow.conn, **kwargs)
+
+    def __put_result(self, queue_object: QueueEntry, load_result: LoadResult):
+        # every successfully loaded page, drained ones included
+        _sink = self.result_sinks.get(queue_object.entry_type)
+        if _sink:
+            _sink.put_result(queue_object.base_url, load_result)
+
+    @staticmethod
+    def __watermark(load_result: LoadResult) -> Tuple[Optional[str], bool]:
+        # newest comment of the page, written with the page's completion
+        _updated_at = [
+            obj['updated_at'] for obj in (load_result.result or []) if isinstance(obj, dict) and obj.get('updated_at')
+        ]
+        return max(_updated_at) if _updated_at else None, load_result.is_last_page
+
+    def __handle_page(self, queue_object: QueueEntry, load_result: LoadResult, uow: UnitOfWork):
+        # drained page completed within the entry's job, its watermark is written at the job's commit,
+        # so no connection is held while the next pages load
+        self.__put_result(queue_object, load_result)
+        _updated_at, _is_last_page = self.__watermark(load_result)
+        uow.defer(lambda conn: self.__queue_repository.save_comment_watermark(
+            queue_object.base_url, _updated_at, _is_last_page, queue_object.id, conn
+        ))
+
+    def __page_entry(self, queue_object: QueueEntry, context: LoadContext, token_id: int = None) -> QueueEntry:
+        _headers = dict(context.headers)
+        del _headers['Authorization']
+        _token_id = token_id if token_id else queue_object.token_id
+        return queue_object.with_changes(
+            token_id=_token_id,
+            token=self.token_registry.value(_token_id) if _token_id != queue_object.token_id else queue_object.token,
+            headers=dumps(_headers),
+            params=dumps(context.params),
+            url=context.url
+        )
+
+    def _handle_error(self, queue_object: QueueEntry, load_result: LoadResult, error_text: str, uow: UnitOfWork,
+                      error_class: ErrorClass = None):
         cur_uuid = self.__thread_local_store.cur_uuid
-        # TODO: use transaction
-        self.__logger.debug('LoadHandler._handle_error: start. uuid: {}'.format(cur_uuid))
+        self.__logger.debug('LoadHandler._handle_error: start. uuid: %s', cur_uuid)
+        if not error_class:
+            error_class = classify(load_result.resp_status if load_result else None)
         queue_object.state = QueueState.UNPROCESSED.value
         queue_object.updated_at = datetime.now(get_localzone())
         queue_object.error = error_text
         queue_object.retry_count += 1
-        if queue_object.retry_count >= MAX_RETRY_COUNT:
+        if error_class == ErrorClass.PERMANENT or queue_object.retry_count >= MAX_RETRY_COUNT:
             queue_object.closed_at = datetime.now(get_localzone())
-            self.__object_queue.enqueue_with_error(queue_object)
-            self.__logger.debug('LoadHandler._handle_error: enqueued with error. uuid: {}'.format(cur_uuid))
+            self.__complete_entry(uow, self.__object_queue.enqueue_with_error, queue_object)
+            self.__logger.debug('LoadHandler._handle_error: enqueued with error. uuid: %s', cur_uuid)
+        elif error_class == ErrorClass.TRANSIENT:
+            _delay = backoff_secs(queue_object.retry_count, self.backoff_base_secs, self.backoff_max_secs)
+            self.__complete_entry(uow, self.__object_queue.backoff_with_error, queue_object, _delay)
+            self.__logger.debug('LoadHandler._handle_error: retry in %.1f s. uuid: %s', _delay, cur_uuid)
         else:
-            self.__object_queue.move_to_end_with_error(queue_object)
-            self.__logger.debug('LoadHandler._handle_error: moved to end with error. uuid: {}'.format(cur_uuid))
-        if load_result and load_result.resp_status in (403, 429):
-            self.__queue_repository.shift_by_token(queue_object.token_id)
-            self.__logger.debug('LoadHandler._handle_error: token_id: {}, object shifted. uuid: {}'.format(
+            self.__complete_entry(uow, self.__object_queue.move_to_end_with_error, queue_object)
+            self.__logger.debug('LoadHandler._handle_error: moved to end with error. uuid: %s', cur_uuid)
+        if error_class == ErrorClass.TRANSIENT:
+            open_until = self.circuit_breaker.record_failure(queue_object.token_id)
+            if open_until:
+                # only this token's entries wait, others keep loading
+                self.__queue_repository.pause_token(
+                    queue_object.token_id, datetime.fromtimestamp(open_until, get_localzone()), uow.conn,
+                    self.budget_tracker.resume_interval(queue_object.token_id)
+                )
+                self.__logger.info('token_id: %s circuit open until %s',
+                    queue_object.token_id, datetime.fromtimestamp(open_until, get_localzone())
+                )
+        if error_class == ErrorClass.RATE_LIMIT \
+                and not self.budget_tracker.paused_until(queue_object.token_id):
+            # no rate limit headers, blind shift
+            self.__queue_repository.shift_by_token(
+                queue_object.token_id, conn=uow.conn,
+                interval_secs=self.budget_tracker.resume_interval(queue_object.token_id)
+            )
+            self.__logger.debug('LoadHandler._handle_error: token_id: %s, token paused. uuid: %s',
                 queue_object.token_id, cur_uuid
-            ))
+            )
+
+    def _handle_budget(self, queue_object: QueueEntry, load_result: Optional[LoadResult], uow: UnitOfWork):
+        if not load_result:
+            return
+        paused_until = self.budget_tracker.take_pause(queue_object.token_id)
+        if paused_until:
+            self.__queue_repository.pause_token(
+                queue_object.token_id, datetime.fromtimestamp(paused_until, get_localzone()), uow.conn,
+                self.budget_tracker.resume_interval(queue_object.token_id)
+            )
+            self.__logger.info('token_id: %s paused until %s',
+                queue_object.token_id, datetime.fromtimestamp(paused_until, get_localzone())
+            )
+
+    def is_paused(self, token_id: int) -> bool:
+        # rate limit pause or open circuit of the token, as seen by this process
+        return bool(self.budget_tracker.paused_until(token_id)) or self.circuit_breaker.is_open(token_id)
+
+    def __is_stale(self, entry: QueueEntry) -> bool:
+        max_age = self.__config.sched_entry_max_age if self.__config else None
+        if not max_age or not entry.updated_at:
+            return False
+        return (datetime.now(get_localzone()) - entry.updated_at).total_seconds() > max_age
 
     def handle(self, object_queue_id: int):
-        self.__thread_local_store.cur_uuid = uuid4()
-        _cur_uuid = self.__thread_local_store.cur_uuid
-        self.__logger.debug('LoadHandler.handle: start. uuid: {}'.format(_cur_uuid))
         current_obj = self.__queue_repository.by_id(object_queue_id)
         if current_obj:
-            try:
-                self.__logger.info('type: {}, token_id: {}, url: {}. uuid: {}'.format(
-                    current_obj.entry_type
-                    , current_obj.token_id
-                    , current_obj.url,
-                    _cur_uuid)
-                )
-                load_result = EntityLoader(SimplePageableBehaviour(
-                    current_obj.token,
-                    self.__config.gh_per_page if self.__config else 100,
-                    self.__logger,
-                    current_obj.entry_type,
-                    current_obj.url,
-                    current_obj.headers,
-                    current_obj.params,
-                    current_obj.token_id,
-                    str(_cur_uuid)
-                )).load()
-                self.__logger.debug('LoadHandler.handle: loaded. uuid: {}'.format(_cur_uuid))
-
-                if load_result:
-                    if load_result.resp_status < 400:
-                        self._handle_ok(current_obj, load_result)
-                    elif load_result.resp_status >= 400:
-                        self._handle_error(current_obj, load_result, load_result.resp_text_data)
+            self.handle_entry(current_obj)
+        else:
+            self.__logger.warn('there is no object in object_queue with object_id: %s', object_queue_id)
 
+    def handle_entry(self, current_obj: QueueEntry):
+        self.__thread_local_store.cur_uuid = uuid4()
+        _cur_uuid = self.__thread_local_store.cur_uuid
+        self.__logger.debug('LoadHandler.handle: start. uuid: %s', _cur_uuid)
+        if self.__is_stale(current_obj) \
+                and not self.__queue_repository.is_claimed(current_obj.id, str(current_obj.uuid)):
+            # released while waiting and possibly claimed by another worker
+            self.__logger.warn('object_queue entry %s is not held by its claim any more', current_obj.id)
+            return
+        try:
+            self.__logger.info('type: %s, token_id: %s, url: %s. uuid: %s',
+                current_obj.entry_type
+                , current_obj.token_id
+                , current_obj.url,
+                _cur_uuid,
+                extra=REQUEST
+            )
+            with UnitOfWork('LoadHandler.handle') as uow:
+                try:
+                    load_result = self.__load(current_obj, _cur_uuid, uow)
+                except Exception as ex:
+                    # failed request or response, the loading is written with the job's error
+                    self.fail(current_obj, ex, uow=uow)
+                else:
+                    self.__logger.debug('LoadHandler.handle: loaded. uuid: %s', _cur_uuid)
+                    if self.drain_pages > 1:
+                        load_result = self.__drain(current_obj, load_result, _cur_uuid, uow)
+                    self.complete(current_obj, load_result, uow=uow)
+        except Exception as ex:
+            self.fail(current_obj, ex)
+        self.__logger.debug('LoadHandler.handle: end. uuid: %s', _cur_uuid)
+
+    def __load(self, entry: QueueEntry, cur_uuid, uow: UnitOfWork) -> Optional[LoadResult]:
+        return EntityLoader(SimplePageableBehaviour(
+            entry.token,
+            self.__config.gh_per_page if self.__config else 100,
+            self.__logger,
+            entry.entry_type,
+            entry.url,
+            entry.headers,
+            entry.params,
+            entry.token_id,
+            str(cur_uuid),
+            self.session_pool.get(entry.token_id),
+            self.session_pool.timeout,
+            self.conditional_cache,
+            self.page_fanout_max
+        ), self.loading_writer, uow, self.store_resp_text).load()
+
+    def __drain(self, current_obj: QueueEntry, load_result: Optional[LoadResult], cur_uuid,
+                uow: UnitOfWork) -> Optional[LoadResult]:
+        # next pages are loaded by this job while the token has budget and the time slice lasts.
+        # The last successful result is completed for the entry: its next page, if any, is re-queued,
+        # so a failed page is retried as a regular entry
+        started = time()
+        pages = 1
+        page_obj = current_obj
+        while load_result and load_result.resp_status < 400 and load_result.next_load_context \
+                and pages < self.drain_pages and time() - started < self.drain_secs:
+            self.budget_tracker.update(current_obj.token_id, load_result.resp_status, load_result.resp_headers)
+            if not self.budget_tracker.has_budget(current_obj.token_id):
+                break
+            next_obj = self.__page_entry(page_obj, load_result.next_load_context)
+            try:
+                next_result = self.__load(next_obj, cur_uuid, uow)
             except Exception as ex:
-                self._handle_error(current_obj, None, str(ex))
-                self.__logger.error('type: {}, url: {}, error: {}. uuid: {}'\
-                                    .format(current_obj.entry_type, current_obj.url, str(ex), _cur_uuid)
-                                    )
+                # the page is retried as a regular entry
+                self.__logger.debug('LoadHandler.handle: drain stopped at %s: %s. uuid: %s', next_obj.params, ex,
+                                    cur_uuid)
+                break
+            pages += 1
+            if not next_result or next_result.resp_status >= 400:
+                if next_result:
+                    self.budget_tracker.update(current_obj.token_id, next_result.resp_status, next_result.resp_headers)
+                self.__logger.debug('LoadHandler.handle: drain stopped at %s. uuid: %s', next_obj.params, cur_uuid)
+                break
+            # the previous page is done, the last one is completed for the entry
+            self.__handle_page(page_obj, load_result, uow)
+            page_obj, load_result = next_obj, next_result
+        self.__logger.debug('LoadHandler.handle: drained pages: %s. uuid: %s', pages, cur_uuid)
+        return load_result
+
+    def complete(self, current_obj: QueueEntry, load_result: Optional[LoadResult], cur_uuid=None,
+                 uow: UnitOfWork = None):
+        if cur_uuid:
+            self.__thread_local_store.cur_uuid = cur_uuid
+        if not uow:
+            with UnitOfWork('LoadHandler.complete') as uow:
+                self.complete(current_obj, load_result, uow=uow)
+            return
+        if load_result:
+            self.budget_tracker.update(current_obj.token_id, load_result.resp_status, load_result.resp_headers)
+            if load_result.resp_status < 500:
+                self.circuit_breaker.record_success(current_obj.token_id)
+            if load_result.resp_status < 400:
+                self._handle_ok(current_obj, load_result, uow)
+            elif load_result.resp_status >= 400:
+                self._handle_error(current_obj, load_result, load_result.resp_text_data, uow)
         else:
-            self.__logger.warn('there is no object in object_queue with object_id: {}'.format(object_queue_id))
-        self.__logger.debug('LoadHandler.handle: end. uuid: {}'.format(_cur_uuid))
+            # failed requests are raised to the job, the behaviour gave no result
+            self._handle_error(current_obj, None, 'no result', uow, ErrorClass.OTHER)
+        self._handle_budget(current_obj, load_result, uow)
 
+    def fail(self, current_obj: QueueEntry, ex: Exception, cur_uuid=None, uow: UnitOfWork = None):
+        if cur_uuid:
+            self.__thread_local_store.cur_uuid = cur_uuid
+        if not uow:
+            with UnitOfWork('LoadHandler.fail') as uow:
+                self.fail(current_obj, ex, uow=uow)
+            return
+        self._handle_error(current_obj, None, str(ex), uow, classify_exception(ex))
+        self.__logger.error('type: %s, url: %s, error: %s. uuid: %s',
+                            current_obj.entry_type, current_obj.url, str(ex),
+                            self.__thread_local_store.cur_uuid
+                            )
@@ -0,0 +1,120 @@
+import json
+import queue
+import atexit
+import logging
+from threading import Lock
+from typing import Dict, List, Optional
+
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_QUEUE_SIZE = 10000
+# warnings and errors wait this long for a full queue before they are dropped
+BLOCK_SECS = 1.0
+LOG_FORMAT = '%(asctime)s - %(name)s:%(threadName)s - %(levelname)s - %(message)s'
+
+# extra of sampled log lines: one per job and one per loaded page
+REQUEST = {'category': 'request'}
+PAGE = {'category': 'page'}
+
+
+class DroppingQueueHandler(QueueHandler):
+    # worker threads only merge the message and put the record, a full queue drops info and debug ones
+    def __init__(self, log_queue: queue.Queue, block_secs: float = BLOCK_SECS):
+        super().__init__(log_queue)
+        self.__block_secs = block_secs
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # args may be changed by the caller after the call returns
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=self.__block_secs)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PipelineListener(QueueListener):
+    # the writer thread of the pipeline, stop waits for the records left in a full queue
+    def __init__(self, log_queue: queue.Queue, queue_handler: DroppingQueueHandler, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+
+    @property
+    def dropped(self) -> int:
+        return self.queue_handler.dropped
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        # also called at exit
+        if self._thread:
+            super().stop()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage()
+        }
+        category = getattr(record, 'category', None)
+        if category:
+            line['category'] = category
+        if record.exc_info:
+            line['exc'] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    # keeps rate part of the records of a category, records without category pass
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.__rates = rates
+        self.__counts = {}  # type: Dict[str, int]
+        self.__lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, 'category', None)
+        rate = self.__rates.get(category) if category else None
+        # warnings and errors are never sampled
+        if rate is None or rate >= 1 or record.levelno > logging.INFO:
+            return True
+        if rate <= 0:
+            return False
+        with self.__lock:
+            count = self.__counts.get(category, 0) + 1
+            self.__counts[category] = count
+        # every 1 / rate record
+        return int(count * rate) != int((count - 1) * rate)
+
+
+def get_formatter(as_json: bool = False) -> logging.Formatter:
+    return JsonFormatter() if as_json else logging.Formatter(LOG_FORMAT)
+
+
+def start_pipeline(logger: logging.Logger,
+                   handlers: List[logging.Handler],
+                   queue_size: int = LOG_QUEUE_SIZE,
+                   sample_rates: Optional[Dict[str, float]] = None) -> PipelineListener:
+    # handlers are called by one writer thread, the logger gets a non-blocking queue handler
+    log_queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    listener = PipelineListener(log_queue, queue_handler, *handlers)
+    logger.addHandler(queue_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
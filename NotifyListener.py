@@ -0,0 +1,108 @@
+import select
+from threading import Thread, Event, Lock
+from typing import Callable, Dict, List
+
+from main import pool, get_logger
+
+
+POLL_SECS = 5.0
+RECONNECT_SECS = 5.0
+
+
+class NotifyListener(object):
+    # LISTEN on a dedicated connection of main.pool, payloads of one wakeup are passed to
+    # the channel handler together. on_state(False) is called when the connection is lost,
+    # so callers can fall back to polling until on_state(True)
+    def __init__(self,
+                 handlers: Dict[str, Callable[[List[str]], None]],
+                 on_state: Callable[[bool], None] = None,
+                 reconnect_secs: float = RECONNECT_SECS):
+        self.__handlers = handlers
+        self.__on_state = on_state
+        self.__reconnect_secs = reconnect_secs
+        self.__logger = get_logger()
+        self.__stopped = Event()
+        self.__thread = None  # type: Thread
+        self.__lock = Lock()
+        self.connected = False  # type: bool
+
+    def start(self):
+        with self.__lock:
+            if self.__thread:
+                return
+            self.__stopped.clear()
+            self.__thread = Thread(target=self.__run, name='notify-listener', daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        self.__stopped.set()
+        if thread:
+            thread.join()
+
+    def __connect(self):
+        conn = pool.getconn()
+        try:
+            conn.set_session(autocommit=True)
+            with conn.cursor() as cur:
+                for channel in self.__handlers.keys():
+                    cur.execute('listen {}'.format(channel))
+        except Exception:
+            pool.putconn(conn, close=True)
+            raise
+        return conn
+
+    def __set_connected(self, connected: bool):
+        if self.connected == connected:
+            return
+        self.connected = connected
+        self.__logger.info('NotifyListener: {}'.format('listening' if connected else 'disconnected, polling'))
+        if self.__on_state:
+            try:
+                self.__on_state(connected)
+            except Exception as e:
+                self.__logger.error('NotifyListener: state handler error: {}'.format(str(e)))
+
+    def __dispatch(self, notifies: List):
+        payloads = {}  # type: Dict[str, List[str]]
+        for notify in notifies:
+            payloads.setdefault(notify.channel, []).append(notify.payload)
+        for channel, channel_payloads in payloads.items():
+            handler = self.__handlers.get(channel)
+            if not handler:
+                continue
+            try:
+                handler(channel_payloads)
+            except Exception as e:
+                self.__logger.error('NotifyListener: {} handler error: {}'.format(channel, str(e)))
+
+    def __listen(self, conn):
+        while not self.__stopped.is_set():
+            if select.select([conn], [], [], POLL_SECS) == ([], [], []):
+                # a dropped connection is not readable, check it explicitly
+                with conn.cursor() as cur:
+                    cur.execute('select 1')
+            conn.poll()
+            if conn.notifies:
+                notifies = list(conn.notifies)
+                del conn.notifies[:]
+                self.__dispatch(notifies)
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            conn = None
+            try:
+                conn = self.__connect()
+                self.__set_connected(True)
+                self.__listen(conn)
+            except Exception as e:
+                self.__logger.error('NotifyListener: connection error: {}'.format(str(e)))
+            finally:
+                if conn:
+                    try:
+                        pool.putconn(conn, close=True)
+                    except Exception:
+                        pass
+                self.__set_connected(False)
+            self.__stopped.wait(self.__reconnect_secs)
@@ -1,14 +1,19 @@
 from enum import Enum
 from uuid import uuid4
-from typing import List
-from datetime import datetime
-from threading import Lock
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timedelta
+from threading import Lock, Event
 
 from tzlocal import get_localzone
-from psycopg2.extras import DictCursor, RealDictCursor
+from psycopg2.extras import execute_values
 
 from config import Config
-from main import get_logger, transaction
+from main import get_logger, transaction, join_transaction
+from QueueEntry import QueueEntry, QUEUE_ENTRY_COLUMNS_COUNT
+from TokenRepository import TokenRegistry, get_token_registry
+from TokenSharding import TokenSharding, get_token_sharding
+from TokenBudget import get_budget_tracker, DEFAULT_INTERVAL
+from BufferedWriter import BufferedWriter, BATCH_SIZE
 
 
 class QueueState(Enum):
@@ -21,155 +26,32 @@ OBJECTS_PER_TOKEN = 150
 QUEUE_THRESHOLD = 50
 MAX_RETRY_COUNT = 10
 MU = 0.1
-
-
-class QueueEntry(object):
-    def __init__(self, **kwargs):
-        self.__entry_type = None  # type: str
-        self.__id = None  # type: int
-        self.__url = None  # type: str
-        self.__token_id = None  # type: int
-        self.__token = None  # type: str
-        self.__uuid = None  # type: str
-        self.__execute_at = None  # type: datetime
-        self.__base_url = None  # type: str
-        self.__closed_at = None  # type: datetime
-        self.__state = None  # type: str
-        self.__retry_count = None  # type: int
-        self.__created_at = None  # type: datetime
-        self.__updated_at = None  # type: datetime
-        self.__execute_at = None  # type: datetime
-        self.__headers = None  # type: str
-        self.__params = None  # type: str
-        self.__error = None  # type: str
-
-    @property
-    def entry_type(self) -> str:
-        return self.__entry_type
-
-    @entry_type.setter
-    def entry_type(self, value: str):
-        self.__entry_type = value
-
-    @property
-    def url(self) -> str:
-        return self.__url
-
-    @url.setter
-    def url(self, value: str):
-        self.__url = value
-
-    @property
-    def id(self) -> int:
-        return self.__id
-
-    @id.setter
-    def id(self, value: int):
-        self.__id = value
-
-    @property
-    def token_id(self) -> int:
-        return self.__token_id
-
-    @token_id.setter
-    def token_id(self, value: int):
-        self.__token_id = value
-
-    @property
-    def base_url(self) -> str:
-        return self.__base_url
-
-    @base_url.setter
-    def base_url(self, value: str):
-        self.__base_url = value
-
-    @property
-    def closed_at(self) -> datetime:
-        return self.__closed_at
-
-    @closed_at.setter
-    def closed_at(self, value: datetime):
-        self.__closed_at = value
-
-    @property
-    def state(self) -> str:
-        return self.__state
-
-    @state.setter
-    def state(self, value: str):
-        self.__state = value
-
-    @property
-    def retry_count(self) -> int:
-        return self.__retry_count
-
-    @retry_count.setter
-    def retry_count(self, value: int):
-        self.__retry_count = value
-
-    @property
-    def created_at(self) -> datetime:
-        return self.__created_at
-
-    @created_at.setter
-    def created_at(self, value: datetime):
-        self.__created_at = value
-
-    @property
-    def updated_at(self) -> datetime:
-        return self.__updated_at
-
-    @updated_at.setter
-    def updated_at(self, value: datetime):
-        self.__updated_at = value
-
-    @property
-    def uuid(self) -> str:
-        return self.__uuid
-
-    @uuid.setter
-    def uuid(self, value: str):
-        self.__uuid = value
-
-    @property
-    def execute_at(self) -> datetime:
-        return self.__execute_at
-
-    @execute_at.setter
-    def execute_at(self, value: datetime):
-        self.__execute_at = value
-
-    @property
-    def headers(self) -> str:
-        return self.__headers
-
-    @headers.setter
-    def headers(self, value: str):
-        self.__headers = value
-
-    @property
-    def params(self) -> str:
-        return self.__params
-
-    @params.setter
-    def params(self, value: str):
-        self.__params = value
-
-    @property
-    def token(self) -> str:
-        return self.__token
-
-    @token.setter
-    def token(self, value: str):
-        self.__token = value
-
-    @property
-    def error(self) -> str:
-        return self.__error
-
-    @error.setter
-    def error(self, value: str):
-        self.__error = value
+CLAIM_LIMIT = 500
+COMPLETION_LATENCY_MS = 20
+# a job waits this long for the collector, then writes its completion itself
+COMPLETION_TIMEOUT_SECS = 10.0
+# claimed entries not completed within lease after execute_at are given back by the leader
+LEASE_SECS = 300
+# pg_advisory_xact_lock key, fills of all nodes are serialized
+FILL_LOCK_KEY = 7340025
+# queue entry columns read from stg.object_queue, token value is the last one
+QUEUE_ENTRY_DB_COLUMNS_COUNT = QUEUE_ENTRY_COLUMNS_COUNT - 1
+
+# priority lanes of stg.object_queue: incremental refresh of loaded issues, first pages of new ones,
+# next pages of both. LANES: name -> (weight in claim, max claimed entries of the lane, 0 - no cap)
+LANE_REFRESH = 'refresh'
+LANE_BACKFILL = 'backfill'
+LANE_PAGES = 'pages'
+LANES = {
+    LANE_REFRESH: (8.0, 0),
+    LANE_BACKFILL: (4.0, 0),
+    LANE_PAGES: (2.0, 0)
+}
+
+# LISTEN/NOTIFY channels, payloads: earliest execute_at epoch, token_id, first TO_DO url
+QUEUE_CHANNEL = 'object_queue'
+DRAIN_CHANNEL = 'object_queue_drain'
+ISSUE_CHANNEL = 'issue_loading'
 
 
 class ObjectHistoryRepository(object):
@@ -179,140 +61,362 @@ class ObjectHistoryRepository(object):
     def __get_connection(self):
         return transaction()
 
-    def save_history(self, obj: QueueEntry):
-        with self.__get_connection() as conn:
-            conn.set_session(autocommit=False)
-            self.save_history_traned(obj, conn)
+    def save_history(self, obj: QueueEntry, conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    insert into
+                        stg.object_history
+                    (
+                        base_object_url
+                        , object_url
+                        , object_type
+                        , created_at
+                        , updated_at
+                        , closed_at
+                        , state
+                        , retry_count
+                        , headers
+                        , params
+                        , token_id
+                    )
+                    values
+                    (
+                        %(base_object_url)s
+                        , %(url)s
+                        , %(object_type)s
+                        , %(created_at)s
+                        , %(updated_at)s
+                        , %(closed_at)s
+                        , %(state)s
+                        , %(retry_count)s + 1
+                        , %(headers)s
+                        , %(params)s
+                        , %(token_id)s
+                    )
+                '''
+                cur.execute(query, {
+                    'base_object_url': obj.base_url,
+                    'url': obj.url,
+                    'object_type': obj.entry_type,
+                    'created_at': obj.created_at,
+                    'updated_at': obj.updated_at,
+                    'closed_at': obj.closed_at,
+                    'state': obj.state,
+                    'retry_count': obj.retry_count,
+                    'headers': obj.headers,
+                    'params': obj.params,
+                    'token_id': obj.token_id
+                })
 
-    def save_history_traned(self, obj: QueueEntry, conn):
-        with conn.cursor() as cur:
-            query = '''
-                insert into
-                    stg.object_history
-                (
-                    base_object_url
-                    , object_url
-                    , object_type
-                    , created_at
-                    , updated_at
-                    , closed_at
-                    , state
-                    , retry_count
-                    , headers
-                    , params
-                    , token_id
-                )
-                values
-                (
-                    %(base_object_url)s
-                    , %(url)s
-                    , %(object_type)s
-                    , %(created_at)s
-                    , %(updated_at)s
-                    , %(closed_at)s
-                    , %(state)s
-                    , %(retry_count)s + 1
-                    , %(headers)s
-                    , %(params)s
-                    , %(token_id)s
-                )
-            '''
-            cur.execute(query, {
-                'base_object_url': obj.base_url,
-                'url': obj.url,
-                'object_type': obj.entry_type,
-                'created_at': obj.created_at,
-                'updated_at': obj.updated_at,
-                'closed_at': obj.closed_at,
-                'state': obj.state,
-                'retry_count': obj.retry_count,
-                'headers': obj.headers,
-                'params': obj.params,
-                'token_id': obj.token_id
-            })
+
+    def save_history_batch(self, objs: List[QueueEntry], conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    insert into
+                        stg.object_history
+                    (
+                        base_object_url
+                        , object_url
+                        , object_type
+                        , created_at
+                        , updated_at
+                        , closed_at
+                        , state
+                        , retry_count
+                        , headers
+                        , params
+                        , token_id
+                    )
+                    values %s
+                '''
+                execute_values(cur, query, [(
+                    obj.base_url,
+                    obj.url,
+                    obj.entry_type,
+                    obj.created_at,
+                    obj.updated_at,
+                    obj.closed_at,
+                    obj.state,
+                    obj.retry_count + 1,
+                    obj.headers,
+                    obj.params,
+                    obj.token_id
+                ) for obj in objs], page_size=len(objs))
 
 
 class QueueRepository(object):
-    def __init__(self):
-        pass
+    def __init__(self, token_registry: TokenRegistry = None):
+        self.__token_registry = token_registry if token_registry else get_token_registry()
 
     def __get_connection(self):
         return transaction()
 
-    def remove_by_id_traned(self, _id: int, conn):
-        with conn.cursor() as cur:
-            query = '''
-                delete from
-                    stg.object_queue
-                where
-                    id = %s
-            '''
-            cur.execute(query, (_id,))
+    def __entry(self, raw) -> QueueEntry:
+        # token value is not selected, it comes from the process wide registry
+        return QueueEntry.from_row(
+            raw[:QUEUE_ENTRY_DB_COLUMNS_COUNT] + (self.__token_registry.value(raw[1]),)
+        )
 
-    def mark_issues_done_traned(self, url: str, conn):
-        with conn.cursor() as cur:
-            query = '''
-            update
-                stg.issue_loading
-            set
-                comment_state = 'DONE'
-            where
-                url = %s
-            '''
-            cur.execute(query, (url,))
+    def remove_by_id(self, _id: int, conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    delete from
+                        stg.object_queue
+                    where
+                        id = %s
+                '''
+                cur.execute(query, (_id,))
 
-    def __shift_by_token(self, token_id: int, conn, shift_seconds: int = 7):
-        with conn.cursor() as cur:
-            query = '''
+    def mark_issues_done(self, url: str, conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
                 update
-                    stg.object_queue
+                    stg.issue_loading
                 set
-                    execute_at = execute_at + interval '1 second' * %(shift_secs)s
+                    comment_state = 'DONE'
                 where
-                    token_id = %(token_id)s
-                    '''
-            cur.execute(query, {'shift_secs': shift_seconds, 'token_id': token_id})
+                    url = %s
+                '''
+                cur.execute(query, (url,))
 
-    def move_entry_to_end_traned(self, entry: QueueEntry, conn):
-        with conn.cursor() as cur:
-            query = '''
+    def remove_by_ids(self, ids: List[int], conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    delete from
+                        stg.object_queue
+                    where
+                        id = any(%s)
+                '''
+                cur.execute(query, (ids,))
+
+    def mark_issues_done_batch(self, urls: List[str], conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
                 update
-                    stg.object_queue
+                    stg.issue_loading
                 set
-                    execute_at =
+                    comment_state = 'DONE'
+                where
+                    url = any(%s)
+                '''
+                cur.execute(query, (urls,))
+
+    def move_entries_to_end(self, entries: List[QueueEntry], intervals: List[float], conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    with moved as
                     (
                         select
-                            max(execute_at) + interval '1 second' * 0.72
+                            m.*
+                            , row_number() over (partition by m.token_id order by m.id) rn
                         from
-                            stg.object_queue
-                        where
-                            token_id = %(token_id)s
+                            unnest(
+                                %(ids)s::bigint[]
+                                , %(token_ids)s::int[]
+                                , %(retry_counts)s::int[]
+                                , %(intervals)s::float8[]
+                            ) m(id, token_id, retry_count, interval_secs)
                     )
-                    , uuid = null
-                    , retry_count = %(retry_count)s
-                    , state = %(state)s
-                where
-                    id = %(entry_id)s
-                    '''
-            cur.execute(query, {
-                'token_id': entry.token_id,
-                'entry_id': entry.id,
-                'retry_count': entry.retry_count,
-                'state': QueueState.UNPROCESSED.value
-            })
-
-    def shift_by_token(self, token_id: int, shift_seconds: int = 7):
-        # проблема: обновляем время у всех объектов.
-        # параллельно обновляется время у объекта этого же токена
-        # одно из изменений теряем. Если теряем массовое изменение -
-        # все объекты сдвинутся ещё на n секунд
-        with self.__get_connection() as conn:
-            self.__shift_by_token(token_id, conn, shift_seconds)
+                    , token_span as
+                    (
+                        select
+                            token_id
+                            , interval '1 second' * max(interval_secs) * count(1) span
+                        from
+                            moved
+                        group by
+                            token_id
+                    )
+                    , slot as
+                    (
+                        /*
+                            reserve count(1) slots per token,
+                            excluded.next_slot - now() is the span of reserved slots
+                        */
+                        insert into
+                            stg.token_schedule as ts
+                        (
+                            token_id
+                            , next_slot
+                        )
+                        select
+                            token_id
+                            , now()::timestamptz(3) + span
+                        from
+                            token_span
+                        on conflict (token_id) do update set
+                            next_slot = greatest(ts.next_slot, ts.paused_until, now()::timestamptz(3))
+                                + (excluded.next_slot - now()::timestamptz(3))
+                        returning
+                            ts.token_id
+                            , ts.next_slot
+                    )
+                    update
+                        stg.object_queue obj
+                    set
+                        execute_at = sl.next_slot - sp.span + interval '1 second' * m.interval_secs * m.rn
+                        , uuid = null
+                        , retry_count = m.retry_count
+                        , state = %(state)s
+                    from
+                        moved m
 
-    def add_entry(self, entry: QueueEntry):
-        with self.__get_connection() as conn:
+                        inner join token_span sp on
+                            sp.token_id = m.token_id
+
+                        inner join slot sl on
+                            sl.token_id = m.token_id
+                    where
+                        obj.id = m.id
+                '''
+                cur.execute(query, {
+                    'ids': [entry.id for entry in entries],
+                    'token_ids': [entry.token_id for entry in entries],
+                    'retry_counts': [entry.retry_count for entry in entries],
+                    'intervals': intervals,
+                    'state': QueueState.UNPROCESSED.value
+                })
+
+    def move_entry_to_end(self, entry: QueueEntry, interval_secs: float = DEFAULT_INTERVAL, conn=None):
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    with slot as
+                    (
+                        insert into
+                            stg.token_schedule as ts
+                        (
+                            token_id
+                            , next_slot
+                        )
+                        values
+                        (
+                            %(token_id)s
+                            , now()::timestamptz(3) + interval '1 second' * %(interval_secs)s
+                        )
+                        on conflict (token_id) do update set
+                            next_slot = greatest(ts.next_slot, ts.paused_until, now()::timestamptz(3))
+                                + interval '1 second' * %(interval_secs)s
+                        returning
+                            ts.next_slot
+                    )
+                    update
+                        stg.object_queue
+                    set
+                        execute_at = (select next_slot from slot)
+                        , uuid = null
+                        , retry_count = %(retry_count)s
+                        , state = %(state)s
+                    where
+                        id = %(entry_id)s
+                        '''
+                cur.execute(query, {
+                    'token_id': entry.token_id,
+                    'entry_id': entry.id,
+                    'retry_count': entry.retry_count,
+                    'state': QueueState.UNPROCESSED.value,
+                    'interval_secs': interval_secs
+                })
+
+    def retry_entries_after(self, entries: List[QueueEntry], delays: List[float], conn=None):
+        # backoff keeps no slot in the token's schedule, the entry is due after its own delay
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    update
+                        stg.object_queue obj
+                    set
+                        execute_at = now()::timestamptz(3) + interval '1 second' * r.delay_secs
+                        , uuid = null
+                        , retry_count = r.retry_count
+                        , state = %(state)s
+                    from
+                        unnest(
+                            %(ids)s::bigint[]
+                            , %(retry_counts)s::int[]
+                            , %(delays)s::float8[]
+                        ) r(id, retry_count, delay_secs)
+                    where
+                        obj.id = r.id
+                '''
+                cur.execute(query, {
+                    'ids': [entry.id for entry in entries],
+                    'retry_counts': [entry.retry_count for entry in entries],
+                    'delays': delays,
+                    'state': QueueState.UNPROCESSED.value
+                })
+
+    def shift_by_token(self, token_id: int, shift_seconds: int = 7, conn=None,
+                       interval_secs: float = DEFAULT_INTERVAL):
+        self.pause_token(
+            token_id, datetime.now(get_localzone()) + timedelta(seconds=shift_seconds), conn, interval_secs
+        )
+
+    def pause_token(self, token_id: int, until: datetime, conn=None, interval_secs: float = DEFAULT_INTERVAL) -> int:
+        # claim skips token's entries until then and takes the held ones one per interval after it,
+        # new slots are given after the held entries
+        query = '''
+            insert into
+                stg.token_schedule as ts
+            (
+                token_id
+                , next_slot
+                , paused_until
+                , resume_interval_secs
+            )
+            select
+                %(token_id)s
+                , %(until)s::timestamptz + interval '1 second' * %(interval_secs)s * count(1)
+                , %(until)s::timestamptz
+                , %(interval_secs)s
+            from
+                stg.object_queue q
+            where
+                q.token_id = %(token_id)s
+                and
+                q.execute_at < %(until)s::timestamptz
+            on conflict (token_id) do update set
+                paused_until = greatest(ts.paused_until, excluded.paused_until)
+                , next_slot = greatest(ts.next_slot, excluded.next_slot)
+                , resume_interval_secs = excluded.resume_interval_secs
+        '''
+        affected = 0
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {'token_id': token_id, 'until': until, 'interval_secs': interval_secs})
+                affected = cur.rowcount
+        return affected
+
+    def add_entry(self, entry: QueueEntry, interval_secs: float = DEFAULT_INTERVAL, conn=None, lane: str = LANE_PAGES):
+        with join_transaction(conn) as conn:
             with conn.cursor() as cur:
                 query = '''
+                    with slot as
+                    (
+                        insert into
+                            stg.token_schedule as ts
+                        (
+                            token_id
+                            , next_slot
+                        )
+                        values
+                        (
+                            %(_token_id)s
+                            , now()::timestamptz(3) + interval '1 second' * %(_interval_secs)s
+                        )
+                        on conflict (token_id) do update set
+                            next_slot = greatest(ts.next_slot, ts.paused_until, now()::timestamptz(3))
+                                + interval '1 second' * %(_interval_secs)s
+                        returning
+                            ts.next_slot
+                    )
                     insert into
                         stg.object_queue
                     (
@@ -327,6 +431,7 @@ class QueueRepository(object):
                         , state
                         , headers
                         , params
+                        , lane
                     )
                     values
                     (
@@ -337,10 +442,11 @@ class QueueRepository(object):
                         , now()::timestamptz(3)
                         , 0
                         , %(_obj_type)s
-                        , (select coalesce(max(execute_at), now()::timestamptz(3)) + interval '1 second' * 0.72 from stg.object_queue where token_id = %(_token_id)s)
+                        , (select next_slot from slot)
                         , %(_state)s
                         , %(_headers)s
                         , %(_params)s
+                        , %(_lane)s
                     )
                 '''
                 cur.execute(query, {
@@ -350,23 +456,381 @@ class QueueRepository(object):
                     '_obj_type': entry.entry_type,
                     '_state': QueueState.UNPROCESSED.value,
                     '_headers': entry.headers,
-                    '_params': entry.params
+                    '_params': entry.params,
+                    '_interval_secs': interval_secs,
+                    '_lane': lane
                 })
-                conn.commit()
 
-    def remove_by_id(self, _id: int):
-        with self.__get_connection() as conn:
-            self.remove_by_id_traned(conn)
+    def save_comment_watermark(self,
+                               base_url: str,
+                               updated_at: Optional[str],
+                               is_last_page: bool,
+                               entry_id: int,
+                               conn=None):
+        # since is moved once every page of the load is completed (no other entry of the issue is queued,
+        # the last page is loaded, none was dropped), an interrupted load doesn't skip comments of the rest
+        query = '''
+            insert into
+                stg.issue_comment_watermark as w
+            (
+                base_object_url
+                , pending_updated_at
+                , last_page_loaded
+            )
+            values
+            (
+                %(base_url)s
+                , %(updated_at)s::timestamptz
+                , %(is_last)s
+            )
+            on conflict (base_object_url) do update set
+                pending_updated_at = greatest(w.pending_updated_at, excluded.pending_updated_at)
+                , last_page_loaded = w.last_page_loaded or excluded.last_page_loaded
+        '''
+        promote_query = '''
+            /*
+                completions of the last pages are serialized by the lock of the watermark row,
+                the later one sees entries removed by the earlier one
+            */
+            update
+                stg.issue_comment_watermark w
+            set
+                since_updated_at = greatest(w.since_updated_at, w.pending_updated_at)
+            where
+                w.base_object_url = %(base_url)s
+                and
+                w.last_page_loaded
+                and
+                not w.pages_dropped
+                and
+                not exists
+                (
+                    select
+                        1
+                    from
+                        stg.object_queue q
+                    where
+                        q.base_object_url = w.base_object_url
+                        and
+                        q.id <> %(entry_id)s
+                )
+        '''
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {'base_url': base_url, 'updated_at': updated_at, 'is_last': is_last_page})
+                cur.execute(promote_query, {'base_url': base_url, 'entry_id': entry_id})
+
+    def mark_comment_pages_dropped(self, base_urls: List[str], conn=None):
+        # a page removed without being loaded keeps since of its load where it was
+        query = '''
+            insert into
+                stg.issue_comment_watermark as w
+            (
+                base_object_url
+                , pages_dropped
+            )
+            select distinct
+                unnest(%(base_urls)s::varchar[])
+                , true
+            on conflict (base_object_url) do update set
+                pages_dropped = true
+        '''
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {'base_urls': base_urls})
 
-    def mark_issues_done(self, url: str):
+    def reload_comments(self, base_urls: List[str], conn=None):
+        # comments of the issues are lost after their load: the issues are loaded again in full,
+        # since of a load in progress is not moved
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    insert into
+                        stg.issue_comment_watermark as w
+                    (
+                        base_object_url
+                        , pages_dropped
+                    )
+                    select distinct
+                        unnest(%(base_urls)s::varchar[])
+                        , true
+                    on conflict (base_object_url) do update set
+                        since_updated_at = null
+                        , pages_dropped = true
+                ''', {'base_urls': base_urls})
+                cur.execute('''
+                    update
+                        stg.issue_loading
+                    set
+                        comment_state = 'TO_DO'
+                    where
+                        url = any(%(base_urls)s)
+                ''', {'base_urls': base_urls})
+
+    def add_entries(self, entries: List[QueueEntry], intervals: List[float], conn=None, lane: str = LANE_PAGES):
+        # slots of all entries of a token are reserved by one upsert
+        spans = {}  # type: Dict[int, float]
+        offsets = []
+        for entry, interval_secs in zip(entries, intervals):
+            spans[entry.token_id] = spans.get(entry.token_id, 0.0) + interval_secs
+            offsets.append(spans[entry.token_id])
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    insert into
+                        stg.token_schedule as ts
+                    (
+                        token_id
+                        , next_slot
+                    )
+                    select
+                        token_id
+                        , now()::timestamptz(3) + interval '1 second' * span_secs
+                    from
+                        unnest(%(token_ids)s::int[], %(spans)s::float8[]) s(token_id, span_secs)
+                    on conflict (token_id) do update set
+                        next_slot = greatest(ts.next_slot, ts.paused_until, now()::timestamptz(3))
+                            + (excluded.next_slot - now()::timestamptz(3))
+                    returning
+                        ts.token_id
+                        , ts.next_slot
+                ''', {'token_ids': list(spans.keys()), 'spans': list(spans.values())})
+                first_slots = {
+                    token_id: next_slot - timedelta(seconds=spans[token_id]) for token_id, next_slot in cur.fetchall()
+                }
+                query = '''
+                    insert into
+                        stg.object_queue
+                    (
+                        token_id
+                        , url
+                        , base_object_url
+                        , created_at
+                        , updated_at
+                        , retry_count
+                        , object_type
+                        , execute_at
+                        , state
+                        , headers
+                        , params
+                        , lane
+                    )
+                    values %s
+                '''
+                execute_values(cur, query, [(
+                    entry.token_id,
+                    entry.url,
+                    entry.base_url,
+                    entry.entry_type,
+                    first_slots[entry.token_id] + timedelta(seconds=offset),
+                    QueueState.UNPROCESSED.value,
+                    entry.headers,
+                    entry.params,
+                    lane
+                ) for entry, offset in zip(entries, offsets)],
+                    template='(%s, %s, %s, now()::timestamptz(3), now()::timestamptz(3), 0, %s, %s, %s, %s, %s, %s)',
+                    page_size=len(entries))
+
+    def create_schema(self):
         with self.__get_connection() as conn:
-            self.mark_issues_done_traned(url, conn)
+            with conn.cursor() as cur:
+                # virtual clock of a token: last given slot and pause
+                cur.execute('''
+                    create table if not exists stg.token_schedule
+                    (
+                        token_id int not null primary key
+                        , next_slot timestamp(3) with time zone not null
+                        , paused_until timestamp(3) with time zone
+                    )
+                ''')
+                # entries held by a pause are claimed one per resume interval, resumed_at - the last of them
+                cur.execute('''
+                    alter table stg.token_schedule
+                        add column if not exists resume_interval_secs float8 not null default 0
+                        , add column if not exists resumed_at timestamp(3) with time zone
+                ''')
+                # newest comment updated_at seen by the current and the last complete load of an issue
+                cur.execute('''
+                    create table if not exists stg.issue_comment_watermark
+                    (
+                        base_object_url varchar(1024) not null primary key
+                        , pending_updated_at timestamp(0) with time zone
+                        , since_updated_at timestamp(0) with time zone
+                    )
+                ''')
+                # progress of the current load: its last page is loaded, some page was removed unloaded
+                cur.execute('''
+                    alter table stg.issue_comment_watermark
+                        add column if not exists last_page_loaded boolean not null default false
+                        , add column if not exists pages_dropped boolean not null default false
+                ''')
+                cur.execute('''
+                    alter table stg.object_queue
+                        add column if not exists lane varchar(32) not null default %s
+                ''', (LANE_BACKFILL,))
+                cur.execute('''
+                    alter table stg.object_queue
+                        add column if not exists lease_until timestamp(3) with time zone
+                ''')
+                # keyset scan of TO_DO issues in fill
+                cur.execute('''
+                    create index if not exists ix_issue_loading_todo_url
+                        on stg.issue_loading (url)
+                        where comment_state = 'TO_DO'
+                ''')
+                # anti-join of fill candidates
+                cur.execute('''
+                    create index if not exists ix_object_queue_base_object_url
+                        on stg.object_queue (base_object_url)
+                ''')
+                # queued entries count of a token
+                cur.execute('''
+                    create index if not exists ix_object_queue_token_id
+                        on stg.object_queue (token_id)
+                ''')
+                # claim of due rows
+                cur.execute('''
+                    create index if not exists ix_object_queue_unclaimed_execute_at
+                        on stg.object_queue (execute_at)
+                        where uuid is null
+                ''')
+                # the oldest entry held by a pause of a token
+                cur.execute('''
+                    create index if not exists ix_object_queue_unclaimed_token_id_execute_at
+                        on stg.object_queue (token_id, execute_at, id)
+                        where uuid is null
+                ''')
+                # claim of due rows of a lane
+                cur.execute('''
+                    create index if not exists ix_object_queue_unclaimed_lane_execute_at
+                        on stg.object_queue (lane, execute_at)
+                        where uuid is null
+                ''')
+                # expired leases of claimed entries
+                cur.execute('''
+                    create index if not exists ix_object_queue_claimed_lease_until
+                        on stg.object_queue (lease_until)
+                        where uuid is not null
+                ''')
+                # claimed entries count of a lane
+                cur.execute('''
+                    create index if not exists ix_object_queue_claimed_lane
+                        on stg.object_queue (lane)
+                        where uuid is not null
+                ''')
+                conn.commit()
 
-    def move_entry_to_end(self, entry: QueueEntry):
+    def create_notify_triggers(self, queue_threshold: int):
+        # statement level triggers, one notification per statement and channel
         with self.__get_connection() as conn:
-            self.move_entry_to_end_traned(entry, conn)
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create or replace function stg.object_queue_notify_scheduled() returns trigger as $$
+                    declare
+                        first_execute_at timestamp with time zone;
+                    begin
+                        select
+                            min(execute_at)
+                        into
+                            first_execute_at
+                        from
+                            new_rows
+                        where
+                            uuid is null;
+                        if first_execute_at is not null then
+                            perform pg_notify(%(queue_channel)s, extract(epoch from first_execute_at)::text);
+                        end if;
+                        return null;
+                    end
+                    $$ language plpgsql
+                ''', {'queue_channel': QUEUE_CHANNEL})
+                cur.execute('''
+                    create or replace function stg.object_queue_notify_drain() returns trigger as $$
+                    begin
+                        /*
+                            token's queue has just dropped to threshold
+                        */
+                        perform
+                            pg_notify(%(drain_channel)s, d.token_id::text)
+                        from
+                        (
+                            select
+                                token_id
+                                , count(1) deleted
+                            from
+                                old_rows
+                            group by
+                                token_id
+                        ) d
+
+                            cross join lateral
+                            (
+                                select
+                                    count(1) queued
+                                from
+                                    stg.object_queue q
+                                where
+                                    q.token_id = d.token_id
+                            ) q
+                        where
+                            q.queued <= TG_ARGV[0]::int
+                            and
+                            q.queued + d.deleted > TG_ARGV[0]::int;
+                        return null;
+                    end
+                    $$ language plpgsql
+                ''', {'drain_channel': DRAIN_CHANNEL})
+                cur.execute('''
+                    create or replace function stg.issue_loading_notify_todo() returns trigger as $$
+                    declare
+                        first_url text;
+                    begin
+                        select
+                            min(url)
+                        into
+                            first_url
+                        from
+                            new_rows
+                        where
+                            comment_state = 'TO_DO';
+                        if first_url is not null then
+                            perform pg_notify(%(issue_channel)s, first_url);
+                        end if;
+                        return null;
+                    end
+                    $$ language plpgsql
+                ''', {'issue_channel': ISSUE_CHANNEL})
+                for table, name, event, transition, function, args in (
+                    ('stg.object_queue', 'tr_object_queue_notify_insert', 'insert', 'new table as new_rows',
+                     'stg.object_queue_notify_scheduled', ''),
+                    ('stg.object_queue', 'tr_object_queue_notify_update', 'update', 'new table as new_rows',
+                     'stg.object_queue_notify_scheduled', ''),
+                    ('stg.object_queue', 'tr_object_queue_notify_drain', 'delete', 'old table as old_rows',
+                     'stg.object_queue_notify_drain', str(int(queue_threshold))),
+                    ('stg.issue_loading', 'tr_issue_loading_notify_insert', 'insert', 'new table as new_rows',
+                     'stg.issue_loading_notify_todo', ''),
+                    ('stg.issue_loading', 'tr_issue_loading_notify_update', 'update', 'new table as new_rows',
+                     'stg.issue_loading_notify_todo', '')
+                ):
+                    cur.execute('drop trigger if exists {} on {}'.format(name, table))
+                    cur.execute('''
+                        create trigger {}
+                            after {} on {}
+                            referencing {}
+                            for each statement
+                            execute procedure {}({})
+                    '''.format(name, event, table, transition, function, args))
+                conn.commit()
 
-    def fill(self, queue_threshold: int, objects_per_token: int) -> int:
+    def fill(self,
+             queue_threshold: int,
+             objects_per_token: int,
+             intervals: Dict[int, float],
+             watermark: str = '',
+             node_id: Optional[str] = None) -> Tuple[int, Optional[str], int, int]:
+        # enqueues next TO_DO issues after watermark url for enabled tokens (intervals keys),
+        # node_id limits them to tokens leased by the node, None - no token sharding,
+        # returns inserted rows, last scanned url, scanned and requested candidates count
         query = '''
             with token_to_enqueue as
             (
@@ -376,19 +840,34 @@ class QueueRepository(object):
                 */
     
                 select
-                    tkn.id token_id
-                    , coalesce(max(q.execute_at), (now() + interval '1 second' * 3)::timestamp(3) with time zone) last_execute
+                    tkn.token_id
+                    , tkn.interval_secs
                 from
-                    log.token tkn
+                    unnest(%(token_ids)s::int[], %(intervals)s::float8[]) tkn(token_id, interval_secs)
     
                     left join stg.object_queue q on
-                        q.token_id = tkn.id
+                        q.token_id = tkn.token_id
                 where
-                    tkn.is_enable = 1::bit
+                    %(node_id)s::varchar is null
+                    or
+                    exists
+                    (
+                        select
+                            1
+                        from
+                            stg.token_lease tl
+                        where
+                            tl.token_id = tkn.token_id
+                            and
+                            tl.node_id = %(node_id)s
+                            and
+                            tl.lease_until > now()
+                    )
                 group by
-                    tkn.id
+                    tkn.token_id
+                    , tkn.interval_secs
                 having
-                    count(1) <= %(queue_threshold)s
+                    count(q.id) <= %(queue_threshold)s
             )
             , numbered_token as
             (
@@ -398,37 +877,56 @@ class QueueRepository(object):
                 from
                     token_to_enqueue
             )
+            , candidate as
+            (
+                /*
+                    next objects_per_token TO_DO issues per token after watermark,
+                    index range scan on ix_issue_loading_todo_url
+                */
+                select
+                    is_load.url
+                from
+                    stg.issue_loading is_load
+                where
+                    is_load.comment_state = 'TO_DO'
+                    and
+                    is_load.url > %(watermark)s
+                order by
+                    is_load.url
+                limit (select count(1) * %(objects_per_token)s from token_to_enqueue)
+            )
             , numbered as
             (
                 /*
-                    find objects neither in object_queue nor in object_history
+                    candidates which are not in object_queue yet
                 */
                 select
-                    is_load.url base_obj_url
-                    , is_load.url || '/comments' url
+                    c.url base_obj_url
+                    , c.url || '/comments' url
                     , now()::timestamp(3) with time zone created_at
                     , now()::timestamp(3) with time zone updated_at
                     , null::timestamp(3) with time zone closed_at
                     , 0 retry_count
                     , 'comments' object_type
-                    , row_number() over (order by is_load.url asc) rn
+                    , row_number() over (order by c.url asc) rn
                 from
-                    stg.issue_loading is_load
-                    
-                    left join stg.object_queue oq on
-                        oq.base_object_url = is_load.url
-    
+                    candidate c
                 where
-                    is_load.comment_state = 'TO_DO'
-                    and
-                    oq.base_object_url is null
-                limit (select count(1) * %(objects_per_token)s * 2 from token_to_enqueue)
+                    not exists
+                    (
+                        select
+                            1
+                        from
+                            stg.object_queue oq
+                        where
+                            oq.base_object_url = c.url
+                    )
             )
             , joint_object as
             (
                 select
                     n_tkn.token_id
-                    , n_tkn.last_execute
+                    , n_tkn.interval_secs
                     , obj.base_obj_url
                     , obj.url
                     , obj.created_at
@@ -440,55 +938,140 @@ class QueueRepository(object):
                 from
                     numbered obj
     
-                    -- loosing first record
                     inner join numbered_token n_tkn on
-                        n_tkn.rn = (obj.rn / %(objects_per_token)s + 1) 
-                where
-                    obj.rn <= (select count(1)  * %(objects_per_token)s from token_to_enqueue)
+                        n_tkn.rn = ((obj.rn - 1) / %(objects_per_token)s + 1)
             )
-            insert into
-                stg.object_queue
+            , token_span as
             (
-                token_id
-                , base_object_url
-                , url
-                , created_at
-                , updated_at
-                , closed_at
-                , retry_count
-                , object_type
-                , execute_at
-                , state
-                , headers
-                , params
+                select
+                    token_id
+                    , interval '1 second' * max(interval_secs) * count(1) span
+                from
+                    joint_object
+                group by
+                    token_id
+            )
+            , slot as
+            (
+                /*
+                    reserve count(1) slots per token,
+                    excluded.next_slot - now() is the span of reserved slots
+                */
+                insert into
+                    stg.token_schedule as ts
+                (
+                    token_id
+                    , next_slot
+                )
+                select
+                    token_id
+                    , now()::timestamptz(3) + span
+                from
+                    token_span
+                on conflict (token_id) do update set
+                    next_slot = greatest(ts.next_slot, ts.paused_until, now()::timestamptz(3))
+                        + (excluded.next_slot - now()::timestamptz(3))
+                returning
+                    ts.token_id
+                    , ts.next_slot
+            )
+            , inserted as
+            (
+                insert into
+                    stg.object_queue
+                (
+                    token_id
+                    , base_object_url
+                    , url
+                    , created_at
+                    , updated_at
+                    , closed_at
+                    , retry_count
+                    , object_type
+                    , execute_at
+                    , state
+                    , headers
+                    , params
+                    , lane
+                )
+                select
+                    obj.token_id
+                    , obj.base_obj_url
+                    , obj.url
+                    , obj.created_at
+                    , obj.updated_at
+                    , obj.closed_at
+                    , obj.retry_count
+                    , obj.object_type
+                    , sl.next_slot - sp.span + (obj.rn * interval '1 second' * obj.interval_secs) execute_at
+                    , %(start_status)s
+                    , \'{}\'
+                    , case
+                        when w.since_updated_at is null then \'{"per_page": 100, "page": 1}\'
+                        /*
+                            only comments created or edited since the last complete load
+                        */
+                        else json_build_object(
+                            'per_page', 100
+                            , 'page', 1
+                            , 'since', to_char(w.since_updated_at at time zone 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                        )::text
+                    end
+                    , case when w.since_updated_at is null then %(backfill_lane)s else %(refresh_lane)s end
+                from
+                    joint_object obj
+
+                    inner join token_span sp on
+                        sp.token_id = obj.token_id
+
+                    inner join slot sl on
+                        sl.token_id = obj.token_id
+
+                    left join stg.issue_comment_watermark w on
+                        w.base_object_url = obj.base_obj_url
+                returning
+                    base_object_url
+            )
+            , load_progress as
+            (
+                /*
+                    a new load of the issue starts without progress of the previous one
+                */
+                update
+                    stg.issue_comment_watermark w
+                set
+                    pending_updated_at = null
+                    , last_page_loaded = false
+                    , pages_dropped = false
+                from
+                    inserted i
+                where
+                    w.base_object_url = i.base_object_url
             )
             select
-                token_id
-                , base_obj_url
-                , url
-                , created_at
-                , updated_at
-                , closed_at
-                , retry_count
-                , object_type
-                , last_execute + (rn * interval '1 second' * 0.72) execute_at
-                , %(start_status)s
-                , \'{}\'
-                , \'{"per_page": 100, "page": 1}\'
-            from
-                joint_object
+                (select count(1) from inserted)
+                , (select max(url) from candidate)
+                , (select count(1) from candidate)
+                , (select count(1) * %(objects_per_token)s from token_to_enqueue)
         '''
-        affected = 0
         with self.__get_connection() as conn:
             with conn.cursor() as cur:
+                # candidates of concurrent fills would pass the anti-join both
+                cur.execute('select pg_advisory_xact_lock(%s)', (FILL_LOCK_KEY,))
                 cur.execute(query, {
                     'queue_threshold': queue_threshold,
                     'objects_per_token': objects_per_token,
-                    'start_status': QueueState.UNPROCESSED.value
+                    'start_status': QueueState.UNPROCESSED.value,
+                    'backfill_lane': LANE_BACKFILL,
+                    'refresh_lane': LANE_REFRESH,
+                    'token_ids': list(intervals.keys()),
+                    'intervals': list(intervals.values()),
+                    'watermark': watermark,
+                    'node_id': node_id
                 })
-                affected = cur.rowcount
+                affected, last_url, scanned, requested = cur.fetchone()
                 conn.commit()
-        return affected
+        return affected, last_url, scanned, requested
 
     def mark_objects(self,
                      _uuid: str,
@@ -525,10 +1108,314 @@ class QueueRepository(object):
                 conn.commit()
         return affected
 
-    def by_id(self, id: int) -> QueueEntry:
-        result = None
+    def claim(self,
+              _uuid: str,
+              limit: int,
+              horizon_secs: float = 0,
+              lanes: Dict[str, Tuple[float, int]] = None,
+              lease_secs: float = LEASE_SECS,
+              node_id: Optional[str] = None) -> Tuple[List[QueueEntry], float]:
+        # node_id limits the claim to tokens leased by the node, None - all tokens
+        _lanes = lanes if lanes else LANES
+        query = '''
+            with lane as
+            (
+                /*
+                    entries a lane may claim: limit, or what is left of its cap
+                */
+                select
+                    l.name
+                    , l.weight
+                    , case
+                        when l.cap > 0 then least(greatest(l.cap - f.claimed, 0), %(limit)s)
+                        else %(limit)s
+                    end quota
+                from
+                    unnest(%(lanes)s::varchar[], %(weights)s::float8[], %(caps)s::int[]) l(name, weight, cap)
+
+                    cross join lateral
+                    (
+                        select
+                            count(1) claimed
+                        from
+                            stg.object_queue q
+                        where
+                            q.lane = l.name
+                            and
+                            q.uuid is not null
+                    ) f
+            )
+            , due as
+            (
+                /*
+                    rows of every lane due up to now (missed slots included),
+                    rows locked by concurrent claim are skipped
+                */
+                select
+                    d.*
+                    , l.weight
+                from
+                    lane l
+
+                    cross join lateral
+                    (
+                        select
+                            q.id
+                            , q.lane
+                            , q.object_type
+                            , q.token_id
+                            , q.execute_at
+                        from
+                            stg.object_queue q
+                        where
+                            q.lane = l.name
+                            and
+                            (
+                                %(node_id)s::varchar is null
+                                or
+                                exists
+                                (
+                                    select
+                                        1
+                                    from
+                                        stg.token_lease tl
+                                    where
+                                        tl.token_id = q.token_id
+                                        and
+                                        tl.node_id = %(node_id)s
+                                        and
+                                        tl.lease_until > now()
+                                )
+                            )
+                            and
+                            q.execute_at <= now() + interval '1 second' * %(horizon)s
+                            and
+                            q.state = %(from_state)s
+                            and
+                            q.uuid is null
+                            and
+                            not exists
+                            (
+                                select
+                                    1
+                                from
+                                    stg.token_schedule ts
+                                where
+                                    ts.token_id = q.token_id
+                                    and
+                                    ts.paused_until > greatest(q.execute_at, now())
+                            )
+                            and
+                            not exists
+                            (
+                                /*
+                                    entries held by a pause are claimed after it one per interval, oldest first
+                                */
+                                select
+                                    1
+                                from
+                                    stg.token_schedule ts
+                                where
+                                    ts.token_id = q.token_id
+                                    and
+                                    q.execute_at < ts.paused_until
+                                    and
+                                    (
+                                        ts.resumed_at > now() - interval '1 second' * ts.resume_interval_secs
+                                        or
+                                        exists
+                                        (
+                                            select
+                                                1
+                                            from
+                                                stg.object_queue h
+                                            where
+                                                h.token_id = q.token_id
+                                                and
+                                                h.uuid is null
+                                                and
+                                                (h.execute_at, h.id) < (q.execute_at, q.id)
+                                        )
+                                    )
+                            )
+                        order by
+                            q.execute_at
+                        limit l.quota
+                        for update skip locked
+                    ) d
+            )
+            , picked as
+            (
+                /*
+                    round robin over object types and tokens within a lane,
+                    lanes share the claim in proportion to their weight,
+                    due rows which are not picked are unlocked on commit
+                */
+                select
+                    r.id
+                from
+                (
+                    select
+                        t.id
+                        , t.execute_at
+                        , row_number() over (partition by t.lane order by t.token_rn, t.execute_at) / t.weight vtime
+                    from
+                    (
+                        select
+                            d.*
+                            , row_number() over (partition by d.lane, d.object_type, d.token_id order by d.execute_at) token_rn
+                        from
+                            due d
+                    ) t
+                ) r
+                order by
+                    r.vtime
+                    , r.execute_at
+                limit %(limit)s
+            )
+            , claimed as
+            (
+                update
+                    stg.object_queue obj
+                set
+                    updated_at = now()::timestamp(3) with time zone
+                    , state = %(to_state)s
+                    , uuid = %(uuid)s
+                    , lease_until = greatest(obj.execute_at, now()::timestamptz(3)) + interval '1 second' * %(lease)s
+                from
+                    picked
+                where
+                    obj.id = picked.id
+                returning
+                    obj.*
+            )
+            , resumed as
+            (
+                update
+                    stg.token_schedule ts
+                set
+                    resumed_at = now()::timestamptz(3)
+                from
+                    claimed c
+                where
+                    ts.token_id = c.token_id
+                    and
+                    c.execute_at < ts.paused_until
+            )
+            select
+                obj.id
+                , obj.token_id
+                , obj.url
+                , obj.object_type
+                , obj.base_object_url
+                , obj.retry_count
+                , obj.created_at
+                , obj.updated_at
+                , obj.closed_at
+                , obj.state
+                , obj.uuid
+                , obj.execute_at
+                , obj.headers
+                , obj.params
+                , extract(epoch from clock_timestamp() - obj.execute_at) as lag_secs
+            from
+                claimed obj
+            order by
+                obj.execute_at
+        '''
+        res = []
+        max_lag = 0.0
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {
+                    'uuid': _uuid,
+                    'limit': limit,
+                    'horizon': horizon_secs,
+                    'lease': lease_secs,
+                    'node_id': node_id,
+                    'lanes': list(_lanes.keys()),
+                    'weights': [float(weight) for weight, _ in _lanes.values()],
+                    'caps': [int(cap) for _, cap in _lanes.values()],
+                    'from_state': QueueState.UNPROCESSED.value,
+                    'to_state': QueueState.TO_PROCESS.value
+                })
+                for raw in cur.fetchall():
+                    res.append(self.__entry(raw))
+                    max_lag = max(max_lag, float(raw[QUEUE_ENTRY_DB_COLUMNS_COUNT]))
+                conn.commit()
+        return res, max_lag
+
+    def release_expired_leases(self, node_id: Optional[str] = None) -> int:
+        # entries of a claim whose process died are claimed again,
+        # node_id limits them to tokens leased by the node, None - no token sharding
+        query = '''
+            update
+                stg.object_queue q
+            set
+                updated_at = now()::timestamp(3) with time zone
+                , state = %(to_state)s
+                , uuid = null
+                , lease_until = null
+            where
+                q.uuid is not null
+                and
+                q.lease_until < now()
+                and
+                (
+                    %(node_id)s::varchar is null
+                    or
+                    exists
+                    (
+                        select
+                            1
+                        from
+                            stg.token_lease tl
+                        where
+                            tl.token_id = q.token_id
+                            and
+                            tl.node_id = %(node_id)s
+                            and
+                            tl.lease_until > now()
+                    )
+                )
+        '''
+        affected = 0
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {'to_state': QueueState.UNPROCESSED.value, 'node_id': node_id})
+                affected = cur.rowcount
+                conn.commit()
+        return affected
+
+    def unmark_objects(self, ids: List[int]) -> int:
+        query = '''
+            update
+                stg.object_queue
+            set
+                updated_at = now()::timestamp(3) with time zone
+                , state = %(to_state)s
+                , uuid = null
+            where
+                id = any(%(ids)s)
+                and
+                state = %(from_state)s
+        '''
+        affected = 0
         with self.__get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with conn.cursor() as cur:
+                cur.execute(query, {
+                    'ids': ids,
+                    'from_state': QueueState.TO_PROCESS.value,
+                    'to_state': QueueState.UNPROCESSED.value
+                })
+                affected = cur.rowcount
+                conn.commit()
+        return affected
+
+    def by_id(self, id: int, conn=None) -> QueueEntry:
+        result = None
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
                 query = '''
                     select
                         obj.id
@@ -545,13 +1432,8 @@ class QueueRepository(object):
                         , obj.execute_at
                         , obj.headers
                         , obj.params
-                        , tkn.value as token
                     from
                         stg.object_queue obj
-                        
-                        inner join log.token tkn on
-                            tkn.id = obj.token_id
-                        
                     where
                         obj.id = %s
                 '''
@@ -559,22 +1441,28 @@ class QueueRepository(object):
 
                 raw = cur.fetchone()
                 if raw:
-                    result = QueueEntry()
-                    result.id = raw['id']
-                    result.token_id = raw['token_id']
-                    result.url = raw['url']
-                    result.entry_type = raw['object_type']
-                    result.base_url = raw['base_object_url']
-                    result.retry_count = raw['retry_count']
-                    result.created_at = raw['created_at']
-                    result.updated_at = raw['updated_at']
-                    result.closed_at = raw['closed_at']
-                    result.uuid = raw['uuid']
-                    result.headers = raw['headers']
-                    result.params = raw['params']
-                    result.token = raw['token']
+                    result = self.__entry(raw)
         return result
 
+    def is_claimed(self, _id: int, _uuid: str, conn=None) -> bool:
+        # the entry is still held by the claim: not released by lease expiry nor claimed by another worker
+        query = '''
+            select
+                1
+            from
+                stg.object_queue obj
+            where
+                obj.id = %(id)s
+                and
+                obj.uuid = %(uuid)s
+                and
+                (obj.lease_until is null or obj.lease_until > now())
+        '''
+        with join_transaction(conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, {'id': _id, 'uuid': _uuid})
+                return cur.fetchone() is not None
+
     def by_uuid(self, _uuid: str) -> List[QueueEntry]:
         query = '''
             select
@@ -592,70 +1480,239 @@ class QueueRepository(object):
                 , obj.execute_at
                 , obj.headers
                 , obj.params
-                , tkn.value as token
             from
                 stg.object_queue obj
-                
-                inner join log.token tkn on
-                    tkn.id = obj.token_id
             where
                 obj.uuid = %s
         '''
         res = []
         with self.__get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with conn.cursor() as cur:
                 cur.execute(query, (_uuid, ))
-                for raw in cur.fetchall():
-                    result = QueueEntry()
-                    result.id = raw['id']
-                    result.token_id = raw['token_id']
-                    result.url = raw['url']
-                    result.entry_type = raw['object_type']
-                    result.base_url = raw['base_object_url']
-                    result.retry_count = raw['retry_count']
-                    result.created_at = raw['created_at']
-                    result.updated_at = raw['updated_at']
-                    result.closed_at = raw['closed_at']
-                    result.uuid = raw['uuid']
-                    result.headers = raw['headers']
-                    result.params = raw['params']
-                    result.token = raw['token']
-                    res.append(result)
+                res = [self.__entry(raw) for raw in cur.fetchall()]
         return res
 
     def clear(self) -> int:
         affected = 0
         with self.__get_connection() as conn:
             with conn.cursor() as cur:
-                query = 'truncate table stg.object_queue'
+                query = 'truncate table stg.object_queue, stg.token_schedule'
                 cur.execute(query)
                 affected = cur.rowcount
                 conn.commit()
         return affected
 
-    def delete_ancient_entries(self, depth_secs: int) -> int:
+    def delete_ancient_entries(self, depth_secs: int, node_id: Optional[str] = None) -> int:
+        # node_id limits them to tokens leased by the node, None - no token sharding
         affected = 0
         with self.__get_connection() as conn:
             with conn.cursor() as cur:
+                # entries held by a pause are aged from its end or from the last of them claimed
                 query = '''
-                    delete from
-                        stg.object_queue
-                    where
-                        execute_at < now()::timestamptz(3) - interval '1 second' * %(depth)s
-                            '''
-                cur.execute(query, {'depth': depth_secs})
-                affected = cur.rowcount
+                    with deleted as
+                    (
+                        delete from
+                            stg.object_queue q
+                        where
+                            q.execute_at < now()::timestamptz(3) - interval '1 second' * %(depth)s
+                            and
+                            not exists
+                            (
+                                select
+                                    1
+                                from
+                                    stg.token_schedule ts
+                                where
+                                    ts.token_id = q.token_id
+                                    and
+                                    greatest(ts.paused_until, ts.resumed_at)
+                                        >= now()::timestamptz(3) - interval '1 second' * %(depth)s
+                            )
+                            and
+                            (
+                                %(node_id)s::varchar is null
+                                or
+                                exists
+                                (
+                                    select
+                                        1
+                                    from
+                                        stg.token_lease tl
+                                    where
+                                        tl.token_id = q.token_id
+                                        and
+                                        tl.node_id = %(node_id)s
+                                        and
+                                        tl.lease_until > now()
+                                )
+                            )
+                        returning
+                            q.base_object_url
+                    )
+                    , dropped as
+                    (
+                        /*
+                            pages removed unloaded, since of their loads is not moved
+                        */
+                        insert into
+                            stg.issue_comment_watermark as w
+                        (
+                            base_object_url
+                            , pages_dropped
+                        )
+                        select distinct
+                            base_object_url
+                            , true
+                        from
+                            deleted
+                        on conflict (base_object_url) do update set
+                            pages_dropped = true
+                    )
+                    select
+                        count(1)
+                    from
+                        deleted
+                '''
+                cur.execute(query, {'depth': depth_secs, 'node_id': node_id})
+                affected = cur.fetchone()[0]
                 conn.commit()
         return affected
 
 
-class ObjectQueue(object):
-    def __init__(self, config: Config):
+class Completion(object):
+    OK = 'ok'
+    ERROR = 'error'
+    RETRY = 'retry'
+    BACKOFF = 'backoff'
+
+    def __init__(self, kind: str, entry: QueueEntry, interval_secs: float = DEFAULT_INTERVAL):
+        self.kind = kind
+        self.entry = entry
+        # slot interval for RETRY, delay for BACKOFF
+        self.interval_secs = interval_secs
+        # comment watermark of an OK page: newest updated_at, is last page
+        self.watermark = None  # type: Optional[Tuple[Optional[str], bool]]
+        self.error = None  # type: Optional[Exception]
+        self.__done = Event()
+        self.__lock = Lock()
+        self.__taken = False
+        self.__cancelled = False
+
+    def take(self) -> bool:
+        # by the collector, a completion its job has given up is not written
+        with self.__lock:
+            if not self.__cancelled:
+                self.__taken = True
+            return self.__taken
+
+    def cancel(self) -> bool:
+        # by the job, False when a flush has already taken the completion
+        with self.__lock:
+            if not self.__taken:
+                self.__cancelled = True
+            return self.__cancelled
+
+    def set_done(self, error: Exception = None):
+        self.error = error
+        self.__done.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        if not self.__done.wait(timeout):
+            return False
+        if self.error:
+            raise self.error
+        return True
+
+
+class CompletionCollector(BufferedWriter):
+    # completions of many jobs are committed in one transaction,
+    # every job waits for its own completion to be committed
+    def __init__(self,
+                 batch_size: int = BATCH_SIZE,
+                 max_latency_ms: int = COMPLETION_LATENCY_MS,
+                 timeout_secs: float = COMPLETION_TIMEOUT_SECS):
+        super().__init__('completion-collector', batch_size, max_latency_ms, batch_size * 4)
+        self.__timeout_secs = timeout_secs
         self.__queue_repository = QueueRepository()  # type: QueueRepository
         self.__obj_hst_repository = ObjectHistoryRepository()  # type: ObjectHistoryRepository
+
+    def complete(self, completion: Completion) -> bool:
+        # False when the collector is closed, dead or stuck: the caller writes the completion itself
+        if not self.put(completion, self.__timeout_secs):
+            return False
+        if completion.wait(self.__timeout_secs):
+            return True
+        if completion.cancel():
+            self._logger.error('completion-collector: entry {} not committed in {} s, written by its job'.format(
+                completion.entry.id, self.__timeout_secs
+            ))
+            return False
+        # taken by a flush in progress, its commit decides
+        if completion.wait(self.__timeout_secs):
+            return True
+        raise TimeoutError('completion of entry {} is not committed'.format(completion.entry.id))
+
+    def _flush(self, items: List[Completion]):
+        items = [c for c in items if c.take()]
+        if not items:
+            return
+        try:
+            with transaction() as conn:
+                conn.set_session(autocommit=False)
+                self.__obj_hst_repository.save_history_batch([c.entry for c in items], conn)
+                done = [c.entry for c in items if c.kind in (Completion.OK, Completion.ERROR)]
+                if done:
+                    self.__queue_repository.mark_issues_done_batch(list({e.base_url for e in done}), conn)
+                    self.__queue_repository.remove_by_ids([e.id for e in done], conn)
+                errors = [c.entry for c in items if c.kind == Completion.ERROR]
+                if errors:
+                    self.__queue_repository.mark_comment_pages_dropped(list({e.base_url for e in errors}), conn)
+                # after removal of the batch's entries, last pages of a load completed together see each other
+                for c in items:
+                    if c.watermark:
+                        self.__queue_repository.save_comment_watermark(
+                            c.entry.base_url, c.watermark[0], c.watermark[1], c.entry.id, conn
+                        )
+                retries = [c for c in items if c.kind == Completion.RETRY]
+                if retries:
+                    self.__queue_repository.move_entries_to_end(
+                        [c.entry for c in retries], [c.interval_secs for c in retries], conn
+                    )
+                backoffs = [c for c in items if c.kind == Completion.BACKOFF]
+                if backoffs:
+                    self.__queue_repository.retry_entries_after(
+                        [c.entry for c in backoffs], [c.interval_secs for c in backoffs], conn
+                    )
+        except Exception as e:
+            for completion in items:
+                completion.set_done(e)
+            raise
+        for completion in items:
+            completion.set_done()
+
+
+class ObjectQueue(object):
+    # completions are written in the caller's transaction when given, otherwise group committed
+    # by the collector, if any, or in their own transaction
+    def __init__(self, config: Config, completions: CompletionCollector = None):
+        self.__token_registry = get_token_registry(config.gh_token_ttl_secs if config else None)
+        self.__queue_repository = QueueRepository(self.__token_registry)  # type: QueueRepository
+        self.__obj_hst_repository = ObjectHistoryRepository()  # type: ObjectHistoryRepository
         self.__get_executing_lock = Lock()
         self.__logger = get_logger()
         self.__config = config
+        self.__budget_tracker = get_budget_tracker(
+            config.gh_default_interval, config.gh_budget_reserve
+        ) if config else get_budget_tracker()
+        self.scheduling_lag = 0.0  # type: float
+        self.__completions = completions
+        self.__fill_watermark = ''  # type: str
+        self.__lanes = dict(LANES)  # type: Dict[str, Tuple[float, int]]
+        # fill and claim only tokens leased by this node
+        self.__sharding = get_token_sharding() if config and config.sched_sharding else None  # type: TokenSharding
+        for name, lane in ((config.lanes if config else None) or {}).items():
+            weight, cap = self.__lanes.get(name, LANES[LANE_BACKFILL])
+            self.__lanes[name] = (lane.get('weight', weight), lane.get('cap', cap))
 
     def __get_connection(self):
         return transaction()
@@ -664,16 +1721,49 @@ class ObjectQueue(object):
         self.__queue_repository.clear()
 
     def delete_ancient_entries(self, depth_secs: int = 120):
-        affected = self.__queue_repository.delete_ancient_entries(depth_secs)
+        affected = self.__queue_repository.delete_ancient_entries(
+            depth_secs, self.__sharding.node_id if self.__sharding else None
+        )
         self.__logger.info('removing ancient records: {}'.format(affected))
 
+    def release_expired_leases(self):
+        affected = self.__queue_repository.release_expired_leases(
+            self.__sharding.node_id if self.__sharding else None
+        )
+        if affected:
+            self.__logger.info('released expired leases: {}'.format(affected))
+
+    def create_schema(self):
+        self.__queue_repository.create_schema()
+
+    def create_notify_triggers(self):
+        self.__queue_repository.create_notify_triggers(
+            self.__config.sched_queue_threshold if self.__config.sched_queue_threshold else QUEUE_THRESHOLD
+        )
+
+    def rewind_fill(self, urls: List[str]):
+        # TO_DO issues behind the watermark are not seen until the scan wraps
+        if self.__fill_watermark and any(url <= self.__fill_watermark for url in urls):
+            self.__fill_watermark = ''
+
     def fill(self):
         _cur_uuid = uuid4()
-        self.__logger.debug('ObjectQueue.fill: start. uuid: {}'.format(_cur_uuid))
-        affected = self.__queue_repository.fill(
+        self.__logger.debug('ObjectQueue.fill: start. watermark: {}. uuid: {}'.format(self.__fill_watermark, _cur_uuid))
+        affected, last_url, scanned, requested = self.__queue_repository.fill(
             self.__config.sched_queue_threshold if self.__config.sched_queue_threshold else QUEUE_THRESHOLD,
-            self.__config.sched_object_per_token if self.__config.sched_object_per_token else OBJECTS_PER_TOKEN
+            self.__config.sched_object_per_token if self.__config.sched_object_per_token else OBJECTS_PER_TOKEN,
+            {
+                _id: self.__budget_tracker.interval(_id) for _id in self.__token_registry.enabled_ids()
+                if not self.__sharding or self.__sharding.owns(_id)
+            },
+            self.__fill_watermark,
+            self.__sharding.node_id if self.__sharding else None
         )
+        if scanned < requested:
+            # end of TO_DO issues, next scan starts from the beginning to pick up re-marked ones
+            self.__fill_watermark = ''
+        elif last_url:
+            self.__fill_watermark = last_url
         self.__logger.debug('ObjectQueue.fill: end. affected rows: {}. uuid: {}'.format(affected, _cur_uuid))
 
     def next_entries_by_current_timestamp(self) -> List[QueueEntry]:
@@ -687,22 +1777,72 @@ class ObjectQueue(object):
             self.__logger.debug('ObjectQueue.next_entries_by_current_timestamp: marked. uuid: {}'.format(_cur_uuid))
         return self.__queue_repository.by_uuid(_cur_uuid)
 
-    def move_to_end_with_error(self, entry: QueueEntry):
-        with self.__get_connection() as conn:
-            conn.set_session(autocommit=False)
-            self.__obj_hst_repository.save_history_traned(entry, conn)
-            self.__queue_repository.move_entry_to_end_traned(entry, conn)
+    def claim_due(self, limit: Optional[int] = None) -> List[QueueEntry]:
+        return self.__claim(limit if limit else self.__claim_limit(), 0)
 
-    def enqueue_with_error(self, entry: QueueEntry):
-        with self.__get_connection() as conn:
-            conn.set_session(autocommit=False)
-            self.__obj_hst_repository.save_history_traned(entry, conn)
-            self.__queue_repository.remove_by_id_traned(entry.id, conn)
-            self.__queue_repository.mark_issues_done_traned(entry.base_url, conn)
+    def claim_upcoming(self, horizon_secs: float) -> List[QueueEntry]:
+        return self.__claim(self.__claim_limit(), horizon_secs)
 
-    def enqueue_ok(self, queue_object: QueueEntry):
-        with self.__get_connection() as conn:
-            conn.set_session(autocommit=False)
-            self.__obj_hst_repository.save_history_traned(queue_object, conn)
-            self.__queue_repository.mark_issues_done_traned(queue_object.base_url, conn)
-            self.__queue_repository.remove_by_id_traned(queue_object.id, conn)
+    def __claim_limit(self) -> int:
+        return self.__config.sched_claim_limit if self.__config.sched_claim_limit else CLAIM_LIMIT
+
+    def __claim(self, limit: int, horizon_secs: float) -> List[QueueEntry]:
+        _cur_uuid = str(uuid4())
+        self.__logger.debug('ObjectQueue.claim: start. uuid: {}'.format(_cur_uuid))
+        entries, lag = self.__queue_repository.claim(
+            _cur_uuid, limit, horizon_secs, self.__lanes,
+            self.__config.sched_lease_secs if self.__config.sched_lease_secs else LEASE_SECS,
+            self.__sharding.node_id if self.__sharding else None
+        )
+        self.scheduling_lag = lag
+        if entries:
+            self.__logger.info('claimed entries: {}, scheduling lag: {:.3f}s. uuid: {}'.format(
+                len(entries), lag, _cur_uuid
+            ))
+        return entries
+
+    def release(self, entries: List[QueueEntry]):
+        if entries:
+            affected = self.__queue_repository.unmark_objects([entry.id for entry in entries])
+            self.__logger.info('released unfired entries: {}'.format(affected))
+
+    def move_to_end_with_error(self, entry: QueueEntry, conn=None):
+        completion = Completion(Completion.RETRY, entry, self.__budget_tracker.interval(entry.token_id))
+        if conn is None and self.__completions and self.__completions.complete(completion):
+            return
+        with join_transaction(conn) as conn:
+            self.__obj_hst_repository.save_history(entry, conn)
+            self.__queue_repository.move_entry_to_end(
+                entry, self.__budget_tracker.interval(entry.token_id), conn
+            )
+
+    def backoff_with_error(self, entry: QueueEntry, delay_secs: float, conn=None):
+        if conn is None and self.__completions and self.__completions.complete(
+                Completion(Completion.BACKOFF, entry, delay_secs)):
+            return
+        with join_transaction(conn) as conn:
+            self.__obj_hst_repository.save_history(entry, conn)
+            self.__queue_repository.retry_entries_after([entry], [delay_secs], conn)
+
+    def enqueue_with_error(self, entry: QueueEntry, conn=None):
+        if conn is None and self.__completions and self.__completions.complete(Completion(Completion.ERROR, entry)):
+            return
+        with join_transaction(conn) as conn:
+            self.__obj_hst_repository.save_history(entry, conn)
+            self.__queue_repository.remove_by_id(entry.id, conn)
+            self.__queue_repository.mark_issues_done(entry.base_url, conn)
+            self.__queue_repository.mark_comment_pages_dropped([entry.base_url], conn)
+
+    def enqueue_ok(self, queue_object: QueueEntry, conn=None, watermark: Optional[Tuple[Optional[str], bool]] = None):
+        completion = Completion(Completion.OK, queue_object)
+        completion.watermark = watermark
+        if conn is None and self.__completions and self.__completions.complete(completion):
+            return
+        with join_transaction(conn) as conn:
+            self.__obj_hst_repository.save_history(queue_object, conn)
+            self.__queue_repository.mark_issues_done(queue_object.base_url, conn)
+            self.__queue_repository.remove_by_id(queue_object.id, conn)
+            if watermark:
+                self.__queue_repository.save_comment_watermark(
+                    queue_object.base_url, watermark[0], watermark[1], queue_object.id, conn
+                )
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+
+# from_row expects columns in the order of __slots__ without error:
+# id, token_id, url, object_type, base_object_url, retry_count, created_at, updated_at,
+# closed_at, state, uuid, execute_at, headers, params, token
+QUEUE_ENTRY_COLUMNS_COUNT = 15
+
+
+class QueueEntry(object):
+    __slots__ = (
+        'id',
+        'token_id',
+        'url',
+        'entry_type',
+        'base_url',
+        'retry_count',
+        'created_at',
+        'updated_at',
+        'closed_at',
+        'state',
+        'uuid',
+        'execute_at',
+        'headers',
+        'params',
+        'token',
+        'error'
+    )
+
+    def __init__(self, **kwargs):
+        self.id = kwargs.get('id')  # type: int
+        self.token_id = kwargs.get('token_id')  # type: int
+        self.url = kwargs.get('url')  # type: str
+        self.entry_type = kwargs.get('entry_type')  # type: str
+        self.base_url = kwargs.get('base_url')  # type: str
+        self.retry_count = kwargs.get('retry_count')  # type: int
+        self.created_at = kwargs.get('created_at')  # type: datetime
+        self.updated_at = kwargs.get('updated_at')  # type: datetime
+        self.closed_at = kwargs.get('closed_at')  # type: datetime
+        self.state = kwargs.get('state')  # type: str
+        self.uuid = kwargs.get('uuid')  # type: str
+        self.execute_at = kwargs.get('execute_at')  # type: datetime
+        self.headers = kwargs.get('headers')  # type: str
+        self.params = kwargs.get('params')  # type: str
+        self.token = kwargs.get('token')  # type: str
+        self.error = kwargs.get('error')  # type: str
+
+    @classmethod
+    def from_row(cls, row) -> 'QueueEntry':
+        entry = object.__new__(cls)
+        (
+            entry.id,
+            entry.token_id,
+            entry.url,
+            entry.entry_type,
+            entry.base_url,
+            entry.retry_count,
+            entry.created_at,
+            entry.updated_at,
+            entry.closed_at,
+            entry.state,
+            entry.uuid,
+            entry.execute_at,
+            entry.headers,
+            entry.params,
+            entry.token
+        ) = row
+        entry.error = None
+        return entry
+
+    def with_changes(self, **changes) -> 'QueueEntry':
+        entry = QueueEntry.from_row((
+            self.id,
+            self.token_id,
+            self.url,
+            self.entry_type,
+            self.base_url,
+            self.retry_count,
+            self.created_at,
+            self.updated_at,
+            self.closed_at,
+            self.state,
+            self.uuid,
+            self.execute_at,
+            self.headers,
+            self.params,
+            self.token
+        ))
+        entry.error = self.error
+        for name, value in changes.items():
+            setattr(entry, name, value)
+        return entry
@@ -0,0 +1,168 @@
+import io
+import csv
+from typing import Dict, List, Tuple
+
+from main import transaction
+from EntityLoader import LoadResult
+from ObjectQueue import QueueRepository
+from BufferedWriter import BufferedWriter, BATCH_SIZE, FLUSH_MS, BUFFER_SIZE, FLUSH_RETRIES
+
+
+class ResultSink(BufferedWriter):
+    # parsed objects of a page are flattened to typed rows and merged into a table,
+    # rows of many jobs are merged together by one COPY into a staging table.
+    # Items are (base_url, row), objects of a batch which can't be merged are loaded again
+    name = None  # type: str
+    columns = ()  # type: tuple
+    flush_retries = FLUSH_RETRIES
+
+    def __init__(self,
+                 batch_size: int = BATCH_SIZE,
+                 flush_ms: int = FLUSH_MS,
+                 buffer_size: int = BUFFER_SIZE):
+        super().__init__('{}-sink'.format(self.name), batch_size, flush_ms, buffer_size)
+
+    def create_table(self):
+        pass
+
+    def _rows(self, base_url: str, obj: Dict) -> List[tuple]:
+        pass
+
+    def _merge_sql(self, staging_table: str) -> str:
+        pass
+
+    def _reload(self, base_urls: List[str]):
+        pass
+
+    def put_result(self, base_url: str, load_result: LoadResult):
+        # not modified pages were merged when they were loaded
+        if not load_result.result or load_result.resp_status == 304:
+            return
+        for obj in load_result.result:
+            if isinstance(obj, dict):
+                for row in self._rows(base_url, obj):
+                    self.put((base_url, row))
+
+    def _flush_failed(self, items: List[Tuple[str, tuple]], error: Exception):
+        base_urls = sorted({base_url for base_url, _ in items})
+        self._reload(base_urls)
+        self._logger.error('{}-sink: {} rows not merged: {}, objects of {} are loaded again'.format(
+            self.name, len(items), str(error), len(base_urls)
+        ))
+
+    def _flush(self, items: List[Tuple[str, tuple]]):
+        buf = io.StringIO()
+        # None is written unquoted and read as NULL, empty strings stay quoted
+        csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC).writerows([row for _, row in items])
+        buf.seek(0)
+        staging_table = 'tmp_{}_sink'.format(self.name)
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create temp table if not exists {} ({}) on commit delete rows
+                '''.format(staging_table, ', '.join(self.columns)))
+                cur.copy_expert('copy {} from stdin with (format csv)'.format(staging_table), buf)
+                cur.execute(self._merge_sql(staging_table))
+                conn.commit()
+
+
+class CommentSink(ResultSink):
+    name = 'comment'
+    columns = (
+        'id bigint',
+        'issue_url varchar(1024)',
+        'user_login varchar(256)',
+        'created_at timestamp(0) with time zone',
+        'updated_at timestamp(0) with time zone',
+        'body text'
+    )
+
+    def create_table(self):
+        with transaction() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create table if not exists stg.issue_comment
+                    (
+                        id bigint not null primary key
+                        , issue_url varchar(1024) not null
+                        , user_login varchar(256)
+                        , created_at timestamp(0) with time zone
+                        , updated_at timestamp(0) with time zone
+                        , body text
+                        , loaded_at timestamp(3) with time zone not null default now()
+                    )
+                ''')
+                cur.execute('''
+                    create index if not exists ix_issue_comment_issue_url
+                        on stg.issue_comment (issue_url)
+                ''')
+                conn.commit()
+
+    def _reload(self, base_urls: List[str]):
+        QueueRepository().reload_comments(base_urls)
+
+    def _rows(self, base_url: str, obj: Dict) -> List[tuple]:
+        user = obj.get('user') or {}
+        return [(
+            obj.get('id'),
+            obj.get('issue_url') or base_url,
+            user.get('login'),
+            obj.get('created_at'),
+            obj.get('updated_at'),
+            obj.get('body')
+        )]
+
+    def _merge_sql(self, staging_table: str) -> str:
+        return '''
+            insert into
+                stg.issue_comment as c
+            (
+                id
+                , issue_url
+                , user_login
+                , created_at
+                , updated_at
+                , body
+            )
+            select distinct on (id)
+                id
+                , issue_url
+                , user_login
+                , created_at
+                , updated_at
+                , body
+            from
+                {}
+            order by
+                id
+                , updated_at desc
+            on conflict (id) do update set
+                issue_url = excluded.issue_url
+                , user_login = excluded.user_login
+                , created_at = excluded.created_at
+                , updated_at = excluded.updated_at
+                , body = excluded.body
+                , loaded_at = now()
+            where
+                c.updated_at is null
+                or
+                excluded.updated_at >= c.updated_at
+        '''.format(staging_table)
+
+
+SINKS = {
+    'comments': CommentSink
+}
+
+
+def get_result_sinks(batch_size: int = BATCH_SIZE,
+                     flush_ms: int = FLUSH_MS,
+                     buffer_size: int = BUFFER_SIZE) -> Dict[str, ResultSink]:
+    # one started sink per entry type
+    sinks = {}
+    for entry_type, sink_class in SINKS.items():
+        sink = sink_class(batch_size, flush_ms, buffer_size)
+        sink.create_table()
+        sink.start()
+        sinks[entry_type] = sink
+    return sinks
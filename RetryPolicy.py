@@ -0,0 +1,111 @@
+import random
+import asyncio
+from enum import Enum
+from time import time
+from threading import Lock
+from typing import Dict, Optional
+
+from requests.exceptions import Timeout, ConnectionError as RequestsConnectionError
+
+
+BACKOFF_BASE_SECS = 2.0
+BACKOFF_MAX_SECS = 600.0
+BREAKER_FAILURES = 5
+BREAKER_OPEN_SECS = 60.0
+BREAKER_MAX_OPEN_SECS = 900.0
+
+# failures of the request itself, other exceptions of a job are local faults
+TRANSIENT_EXCEPTIONS = (Timeout, RequestsConnectionError, asyncio.TimeoutError)
+try:
+    from aiohttp import ClientConnectionError
+    TRANSIENT_EXCEPTIONS += (ClientConnectionError,)
+except ImportError:
+    # async engine is not used
+    pass
+
+
+class ErrorClass(Enum):
+    # the entry can't be loaded, it is finished with error at once
+    PERMANENT = 'permanent'
+    # 5xx, timeout, connection error: retried with backoff, counted by the circuit breaker
+    TRANSIENT = 'transient'
+    # 403 / 429, the token is paused by its budget
+    RATE_LIMIT = 'rate_limit'
+    # other 4xx and local faults of a job, retried at the end of the token's queue
+    OTHER = 'other'
+
+
+def classify(resp_status: Optional[int]) -> ErrorClass:
+    if resp_status is None:
+        return ErrorClass.TRANSIENT
+    if resp_status in (404, 410):
+        return ErrorClass.PERMANENT
+    if resp_status in (403, 429):
+        return ErrorClass.RATE_LIMIT
+    if resp_status >= 500:
+        return ErrorClass.TRANSIENT
+    return ErrorClass.OTHER
+
+
+def classify_exception(ex: Exception) -> ErrorClass:
+    # a database error or a bug is retried at the end of the token's queue without counting against the token
+    return ErrorClass.TRANSIENT if isinstance(ex, TRANSIENT_EXCEPTIONS) else ErrorClass.OTHER
+
+
+def backoff_secs(retry_count: int,
+                 base_secs: float = BACKOFF_BASE_SECS,
+                 max_secs: float = BACKOFF_MAX_SECS) -> float:
+    # full jitter: retries of entries failed together are spread over the whole window
+    return random.uniform(0, min(max_secs, base_secs * 2 ** max(retry_count - 1, 0)))
+
+
+class TokenBreaker(object):
+    def __init__(self):
+        self.failures = 0  # type: int
+        self.opens = 0  # type: int
+        self.open_until = 0.0  # type: float
+
+
+class CircuitBreaker(object):
+    # consecutive transient failures per token; at threshold the token is paused for open_secs,
+    # a failure after the pause opens it again for twice as long, a success closes it
+    def __init__(self,
+                 failures: int = BREAKER_FAILURES,
+                 open_secs: float = BREAKER_OPEN_SECS,
+                 max_open_secs: float = BREAKER_MAX_OPEN_SECS):
+        self.__failures = failures
+        self.__open_secs = open_secs
+        self.__max_open_secs = max_open_secs
+        self.__breakers = {}  # type: Dict[int, TokenBreaker]
+        self.__lock = Lock()
+        self.opened = 0
+
+    def record_success(self, token_id: int):
+        with self.__lock:
+            self.__breakers.pop(token_id, None)
+
+    def record_failure(self, token_id: int) -> Optional[float]:
+        # epoch the token is paused until, when the breaker opens
+        now = time()
+        with self.__lock:
+            breaker = self.__breakers.get(token_id)
+            if not breaker:
+                breaker = TokenBreaker()
+                self.__breakers[token_id] = breaker
+            breaker.failures += 1
+            if breaker.failures < self.__failures or breaker.open_until > now:
+                return None
+            breaker.open_until = now + min(self.__max_open_secs, self.__open_secs * 2 ** breaker.opens)
+            breaker.opens += 1
+            self.opened += 1
+            return breaker.open_until
+
+    def is_open(self, token_id: int) -> bool:
+        breaker = self.__breakers.get(token_id)
+        return breaker is not None and breaker.open_until > time()
+
+    def stats(self) -> Dict[str, int]:
+        now = time()
+        with self.__lock:
+            open_count = len([b for b in self.__breakers.values() if b.open_until > now])
+        return {'open': open_count, 'opened': self.opened}
@@ -0,0 +1,85 @@
+import requests
+from threading import Lock
+from typing import Dict, Tuple
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+POOL_SIZE = 4
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+MAX_RETRIES = 3
+
+
+class SessionPool(object):
+    # one keep-alive session per token, shared by all jobs of this token
+    def __init__(self,
+                 pool_size: int = POOL_SIZE,
+                 connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT,
+                 max_retries: int = MAX_RETRIES):
+        self.__pool_size = pool_size
+        self.__timeout = (connect_timeout, read_timeout)
+        self.__max_retries = max_retries
+        self.__sessions = {}  # type: Dict[int, requests.Session]
+        self.__lock = Lock()
+
+    @property
+    def timeout(self) -> Tuple[float, float]:
+        return self.__timeout
+
+    def get(self, token_id: int) -> requests.Session:
+        session = self.__sessions.get(token_id)
+        if session is None:
+            with self.__lock:
+                session = self.__sessions.get(token_id)
+                if session is None:
+                    session = self.__create_session()
+                    self.__sessions[token_id] = session
+        return session
+
+    def __create_session(self) -> requests.Session:
+        # reset of an idle keep-alive connection is retried, http statuses are not
+        retry = Retry(
+            total=self.__max_retries,
+            connect=self.__max_retries,
+            read=self.__max_retries,
+            status=0,
+            backoff_factor=0.2
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.__pool_size,
+            max_retries=retry
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def stats(self) -> Dict[str, float]:
+        requests_count = 0
+        connections_count = 0
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool:
+                        requests_count += pool.num_requests
+                        connections_count += pool.num_connections
+        return {
+            'sessions': len(sessions),
+            'requests': requests_count,
+            'connections': connections_count,
+            'reuse': 1 - connections_count / requests_count if requests_count else 0.0
+        }
+
+    def close(self):
+        with self.__lock:
+            sessions = list(self.__sessions.values())
+            self.__sessions = {}
+        for session in sessions:
+            session.close()
@@ -1,9 +1,17 @@
 import json
 import logging
 import requests
+from typing import Optional, List
 
-from EntityLoader import LoadContext, Loading
+from EntityLoader import LoadContext, LoadResult, Loading
 from github_loading import GithubLoadBehaviour
+from ConditionalCache import ConditionalCache, CacheEntry
+from LogPipeline import PAGE
+
+
+PAGE_FANOUT_MAX = 50
+# marks pages enqueued by fan-out, they don't enqueue further pages
+FANOUT_PARAM = 'fanout'
 
 
 class SimplePageableBehaviour(GithubLoadBehaviour):
@@ -16,7 +24,11 @@ class SimplePageableBehaviour(GithubLoadBehaviour):
                  _headers: str,
                  _params: str,
                  _token_id: int,
-                 _proc_uuid: str):
+                 _proc_uuid: str,
+                 _session: requests.Session = None,
+                 _timeout=None,
+                 _cache: ConditionalCache = None,
+                 _fanout_max: int = 0):
         super().__init__(_token, per_page, _logger)
         self._loading_obj_name = _loading_obj
         self._base_url = _base_url
@@ -24,23 +36,34 @@ class SimplePageableBehaviour(GithubLoadBehaviour):
         self._params = _params
         self._token_id = _token_id
         self._proc_uuid = _proc_uuid
+        self._session = _session
+        self._timeout = _timeout
+        self._cache = _cache
+        self._fanout_max = _fanout_max
+        self._is_fanout_page = bool(json.loads(_params).get(FANOUT_PARAM))
 
     def _build_url(self) -> str:
         return self._base_url
 
     def handle_error(self, obj: LoadContext, e: Exception, loading: Loading):
-        self._logger.error('url: {}, loading_id: {}, error with message: {}'.format(obj.url, loading.id, str(e)))
+        self._logger.error('url: %s, loading_id: %s, error with message: %s', obj.url, loading.id, str(e))
+        # the job classifies it: a failed request is retried with backoff, a bad response or a bug is not
+        raise e
 
     def get_load_context(self):
+        params = self._get_params(None)
         return LoadContext(
             self._build_url(),
-            params=self._get_params(None),
+            params=params,
             headers=self._get_headers(),
-            obj={'page': 1, 'remaining': -1, 'token_id': self._token_id, 'proc_uuid': self._proc_uuid}
+            # next and fanned out pages are entries of their own, the page is in their params
+            obj={'page': int(params.get('page', 1)), 'remaining': -1, 'token_id': self._token_id,
+                 'proc_uuid': self._proc_uuid}
         )
 
     def _get_params(self, page: int) -> dict:
         _prms = json.loads(self._params)
+        _prms.pop(FANOUT_PARAM, None)
         if page:
             _prms['page'] = page
         return _prms
@@ -50,41 +73,91 @@ class SimplePageableBehaviour(GithubLoadBehaviour):
         _hdrs['Authorization'] = 'token {}'.format(self._token)
         return _hdrs
 
+    def _get_request_url(self, obj: LoadContext, loading: Loading) -> str:
+        return '{}{}'.format(loading.url, self._get_url_params(obj.params))
+
+    def _get_cached(self, url: str) -> Optional[CacheEntry]:
+        return self._cache.get(self._token_id, url) if self._cache else None
+
+    def _store_cached(self, url: str, resp, cached: Optional[CacheEntry]):
+        if self._cache:
+            self._cache.store(self._token_id, url, int(resp.status_code), resp.headers, resp.text, cached)
+
+    def _get_request_headers(self, obj: LoadContext, cached: Optional[CacheEntry]) -> dict:
+        if not cached:
+            return obj.headers
+        _hdrs = dict(obj.headers)
+        _hdrs.update(cached.conditional_headers())
+        return _hdrs
+
     def load(self, obj: LoadContext, loading: Loading):
+        url = self._get_request_url(obj, loading)
+        cached = self._get_cached(url)
+        resp = (self._session if self._session else requests).get(
+            url, headers=self._get_request_headers(obj, cached), timeout=self._timeout
+        )
+        self._store_cached(url, resp, cached)
+        return self._get_load_result(obj, url, resp, cached)
+
+    def _get_page_context(self, page: int, fanout: bool = False) -> LoadContext:
+        params = self._get_params(page)
+        if fanout:
+            params[FANOUT_PARAM] = 1
+        return LoadContext(
+            self._build_url(),
+            params=params,
+            headers=self._get_headers(),
+            obj={'page': page, 'remaining': -1}
+        )
+
+    def _get_fanout_contexts(self, first_page: int, last_page: int) -> List[LoadContext]:
+        # the last page of a capped fan-out is a regular one and fans out the rest
+        end_page = min(last_page, first_page + self._fanout_max - 1)
+        return [
+            self._get_page_context(page, fanout=not (page == end_page and end_page < last_page))
+            for page in range(first_page, end_page + 1)
+        ]
+
+    def _get_load_result(self, obj: LoadContext, url: str, resp, cached: Optional[CacheEntry] = None) -> LoadResult:
         current_page = obj.obj['page']
         _token_id = obj.obj.get('token_id', None)
         _proc_uuid = obj.obj.get('proc_uuid', None)
-        url = '{}{}'.format(loading.url, self._get_url_params(obj.params))
-
-        resp = requests.get(url, headers=obj.headers)
 
         resp_status = int(resp.status_code)
         remaining_limit = self._get_remaining_limit(resp)
 
         next_page = self._get_next_page(current_page, resp)
 
+        # not modified: previous page content is served
+        resp_text = cached.body if resp_status == 304 and cached else resp.text
+
         rv_objs = []
-        if resp_status < 400:
-            rv_objs = json.loads(resp.text)
+        if resp_status < 400 and resp_text:
+            rv_objs = json.loads(resp_text)
 
-        self._logger.info('token_id: {}, proc_uuid: {}, type: {}, state: {}, page: {}, count: {}, limit: {}, url: {}'.format(
+        self._logger.info('token_id: %s, proc_uuid: %s, type: %s, state: %s, page: %s, count: %s, limit: %s, url: %s',
             _token_id, _proc_uuid,
             self._loading_obj_name, resp.status_code, current_page,
-            len(rv_objs), remaining_limit, url
-        ))
+            len(rv_objs), remaining_limit, url,
+            extra=PAGE
+        )
 
         if int(remaining_limit if remaining_limit else 1) <= 0:
-            self._logger.warn('token_id {} is expired'.format(_token_id))
-
-        load_result = obj.get_simplified_load_result(
-            rv_objs,
-            LoadContext(
-                self._build_url(),
-                params=self._get_params(next_page),
-                headers=self._get_headers(),
-                obj={'page': next_page, 'remaining': -1}
-            ) if not self._is_last_page(len(rv_objs), resp) else None
-        )
+            self._logger.warn('token_id %s is expired', _token_id)
+
+        next_load_context = None
+        fanout_load_contexts = []
+        is_last_page = self._is_last_page(len(rv_objs), resp)
+        if not self._is_fanout_page and not is_last_page:
+            last_page = self._get_last_page(resp) if resp_status < 400 else None
+            if self._fanout_max and last_page and last_page > next_page:
+                fanout_load_contexts = self._get_fanout_contexts(next_page, last_page)
+            else:
+                next_load_context = self._get_page_context(next_page)
+
+        load_result = obj.get_simplified_load_result(rv_objs, next_load_context)
+        load_result.fanout_load_contexts = fanout_load_contexts
+        load_result.is_last_page = is_last_page
         load_result.resp_headers = dict(resp.headers)
         load_result.resp_text_data = resp.text
         load_result.resp_status = resp_status
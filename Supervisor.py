@@ -0,0 +1,78 @@
+import os
+import signal
+import multiprocessing
+from time import time
+from threading import Event
+from typing import Dict
+
+from main import get_logger
+from config import get_config
+from LeaderLock import LeaderLock
+from Worker import Worker, init_sharding
+
+
+CHECK_SECS = 1.0
+RESTART_SECS = 5.0
+STOP_SECS = 30.0
+
+
+def run_worker(index: int, node_id: str = None):
+    # entry of a spawned process, it opens its own db pool and http sessions on import
+    config = get_config()
+    logger = get_logger('worker-{}.log'.format(index))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if node_id:
+        # workers of a node share its tokens, one of them is the node leader
+        init_sharding(config, node_id)
+    Worker(config, logger, LeaderLock(scope=node_id)).run()
+
+
+class Supervisor(object):
+    # keeps worker processes running, a dead one is started again after restart_secs
+    def __init__(self, processes: int, node_id: str = None, restart_secs: float = RESTART_SECS):
+        self.__processes = processes
+        self.__node_id = node_id
+        self.__restart_secs = restart_secs
+        # forked children would share connections of main.pool
+        self.__context = multiprocessing.get_context('spawn')
+        self.__workers = {}  # type: Dict[int, multiprocessing.Process]
+        self.__started_at = {}  # type: Dict[int, float]
+        self.__stopped = Event()
+        self.__logger = get_logger()
+
+    def __start(self, index: int):
+        process = self.__context.Process(target=run_worker, args=(index, self.__node_id), name='worker-{}'.format(index))
+        process.start()
+        self.__workers[index] = process
+        self.__started_at[index] = time()
+        self.__logger.info('Supervisor: worker {} started, pid: {}'.format(index, process.pid))
+
+    def stop(self, *args):
+        self.__stopped.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        try:
+            for index in range(self.__processes):
+                self.__start(index)
+            while not self.__stopped.wait(CHECK_SECS):
+                for index, process in list(self.__workers.items()):
+                    if process.is_alive() or time() - self.__started_at[index] < self.__restart_secs:
+                        continue
+                    self.__logger.error('Supervisor: worker {} exited with code {}'.format(index, process.exitcode))
+                    self.__start(index)
+        finally:
+            self.__shutdown()
+
+    def __shutdown(self):
+        for process in self.__workers.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time() + STOP_SECS
+        for index, process in self.__workers.items():
+            process.join(max(deadline - time(), 0))
+            if process.is_alive():
+                self.__logger.error('Supervisor: worker {} killed'.format(index))
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
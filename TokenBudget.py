@@ -0,0 +1,155 @@
+import heapq
+from time import time
+from threading import Lock
+from typing import Dict, List, Optional
+
+
+DEFAULT_INTERVAL = 0.72
+MIN_INTERVAL = 0.05
+BUDGET_RESERVE = 10
+RATE_LIMIT_WINDOW = 3600
+
+budget_tracker = None
+
+
+class TokenBudget(object):
+    def __init__(self):
+        self.limit = None  # type: Optional[int]
+        self.remaining = None  # type: Optional[int]
+        self.reset_at = 0.0  # type: float
+        self.paused_until = 0.0  # type: float
+        self.pause_applied = 0.0  # type: float
+
+
+class TokenBudgetTracker(object):
+    # per token budget from X-RateLimit-* and Retry-After response headers
+    def __init__(self,
+                 default_interval: float = DEFAULT_INTERVAL,
+                 reserve: int = BUDGET_RESERVE,
+                 min_interval: float = MIN_INTERVAL):
+        self.__default_interval = default_interval
+        self.__reserve = reserve
+        self.__min_interval = min_interval
+        self.__budgets = {}  # type: Dict[int, TokenBudget]
+        self.__lock = Lock()
+
+    @property
+    def default_interval(self) -> float:
+        return self.__default_interval
+
+    def update(self, token_id: int, resp_status: Optional[int], resp_headers: Optional[Dict[str, str]]):
+        if not resp_headers:
+            return
+        _hdrs = {k.lower(): v for k, v in resp_headers.items()}
+        limit = _hdrs.get('x-ratelimit-limit')
+        remaining = _hdrs.get('x-ratelimit-remaining')
+        reset = _hdrs.get('x-ratelimit-reset')
+        retry_after = _hdrs.get('retry-after')
+        now = time()
+        with self.__lock:
+            budget = self.__budgets.setdefault(token_id, TokenBudget())
+            if limit:
+                budget.limit = int(limit)
+            if remaining:
+                budget.remaining = int(remaining)
+            if reset:
+                budget.reset_at = float(reset)
+            if retry_after and resp_status in (403, 429):
+                budget.paused_until = max(budget.paused_until, now + float(retry_after))
+            elif budget.remaining is not None and budget.remaining <= self.__reserve and budget.reset_at > now:
+                budget.paused_until = max(budget.paused_until, budget.reset_at)
+
+    def paused_until(self, token_id: int) -> float:
+        budget = self.__budgets.get(token_id)
+        if budget and budget.paused_until > time():
+            return budget.paused_until
+        return 0.0
+
+    def has_budget(self, token_id: int) -> bool:
+        budget = self.__budgets.get(token_id)
+        if not budget:
+            return True
+        now = time()
+        if budget.paused_until > now:
+            return False
+        if budget.remaining is None or budget.reset_at <= now:
+            return True
+        return budget.remaining > self.__reserve
+
+    def take_pause(self, token_id: int) -> float:
+        # pause which is not yet applied to the token's queue
+        with self.__lock:
+            budget = self.__budgets.get(token_id)
+            if not budget or budget.paused_until <= time() or budget.paused_until <= budget.pause_applied:
+                return 0.0
+            budget.pause_applied = budget.paused_until
+            return budget.paused_until
+
+    def interval(self, token_id: int) -> float:
+        budget = self.__budgets.get(token_id)
+        if not budget:
+            return self.__default_interval
+        now = time()
+        if budget.reset_at <= now or budget.remaining is None:
+            # a new window starts with the full limit
+            if budget.limit:
+                return max(self.__min_interval, RATE_LIMIT_WINDOW / float(budget.limit))
+            return self.__default_interval
+        usable = budget.remaining - self.__reserve
+        if usable <= 0:
+            return max(self.__default_interval, budget.reset_at - now)
+        return max(self.__min_interval, (budget.reset_at - now) / usable)
+
+    def resume_interval(self, token_id: int) -> float:
+        # spacing of the token's requests when its pause is over: budget left in the window,
+        # or the full limit of the next one
+        budget = self.__budgets.get(token_id)
+        if not budget:
+            return self.__default_interval
+        start = max(budget.paused_until, time())
+        if budget.remaining is not None and budget.reset_at > start and budget.remaining > self.__reserve:
+            return max(self.__min_interval, (budget.reset_at - start) / (budget.remaining - self.__reserve))
+        if budget.limit:
+            return max(self.__min_interval, RATE_LIMIT_WINDOW / float(budget.limit))
+        return self.__default_interval
+
+    def spread(self, token_id: int, count: int) -> List[int]:
+        # tokens for count requests in proportion to budget left in their windows,
+        # the given token when no other budget is known
+        now = time()
+        usable = []
+        with self.__lock:
+            for _id, budget in self.__budgets.items():
+                if budget.paused_until > now:
+                    continue
+                if budget.reset_at <= now or budget.remaining is None:
+                    left = budget.limit if budget.limit else 0
+                else:
+                    left = budget.remaining - self.__reserve
+                if left > 0:
+                    usable.append((-left, _id))
+        if not usable:
+            return [token_id] * count
+        heapq.heapify(usable)
+        token_ids = []
+        for _ in range(count):
+            left, _id = heapq.heappop(usable)
+            token_ids.append(_id)
+            heapq.heappush(usable, (left + 1, _id))
+        return token_ids
+
+    def intervals(self) -> Dict[int, float]:
+        with self.__lock:
+            token_ids = list(self.__budgets.keys())
+        return {token_id: self.interval(token_id) for token_id in token_ids}
+
+
+def get_budget_tracker(default_interval: float = None, reserve: int = None) -> TokenBudgetTracker:
+    global budget_tracker
+    if budget_tracker:
+        return budget_tracker
+    budget_tracker = TokenBudgetTracker(
+        default_interval if default_interval else DEFAULT_INTERVAL,
+        reserve if reserve is not None else BUDGET_RESERVE
+    )
+    return budget_tracker
@@ -1,6 +1,18 @@
+from time import time
+from threading import Lock
+from typing import Dict, List, Optional
+
 from main import transaction
 
 
+TOKEN_TTL_SECS = 300
+MIN_RELOAD_SECS = 1.0
+# NOTIFY channel of log.token changes
+TOKEN_CHANNEL = 'token'
+
+token_registry = None
+
+
 class TokenRepository(object):
     def __init__(self):
         pass
@@ -23,3 +35,97 @@ class TokenRepository(object):
                 cur.execute(query, (id,))
                 result = cur.fetchone()[0]
         return result
+
+    def all(self) -> Dict[int, tuple]:
+        # id -> (value, is enabled)
+        with self.__get_db_connection() as conn:
+            with conn.cursor() as cur:
+                query = '''
+                    select
+                        id
+                        , value
+                        , is_enable = 1::bit
+                    from
+                        log.token
+                '''
+                cur.execute(query)
+                return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+
+    def create_notify_trigger(self):
+        with self.__get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create or replace function log.token_notify_changed() returns trigger as $$
+                    begin
+                        perform pg_notify(%(channel)s, '');
+                        return null;
+                    end
+                    $$ language plpgsql
+                ''', {'channel': TOKEN_CHANNEL})
+                cur.execute('drop trigger if exists tr_token_notify_changed on log.token')
+                cur.execute('''
+                    create trigger tr_token_notify_changed
+                        after insert or update or delete or truncate on log.token
+                        for each statement
+                        execute procedure log.token_notify_changed()
+                ''')
+                conn.commit()
+
+
+class TokenRegistry(object):
+    # process wide copy of log.token, reloaded after ttl_secs, on invalidate (NOTIFY)
+    # and on lookup of an unknown id
+    def __init__(self, ttl_secs: float = TOKEN_TTL_SECS, repository: TokenRepository = None):
+        self.__ttl_secs = ttl_secs
+        self.__repository = repository if repository else TokenRepository()
+        self.__tokens = {}  # type: Dict[int, tuple]
+        self.__loaded_at = 0.0
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def invalidate(self, *args):
+        self.__loaded_at = 0.0
+
+    def __reload(self, force: bool = False):
+        with self.__lock:
+            now = time()
+            if now - self.__loaded_at < (MIN_RELOAD_SECS if force else self.__ttl_secs):
+                return
+            self.__tokens = self.__repository.all()
+            self.__loaded_at = now
+            self.reloads += 1
+
+    def __current(self) -> Dict[int, tuple]:
+        if time() - self.__loaded_at >= self.__ttl_secs:
+            self.__reload()
+        return self.__tokens
+
+    def value(self, token_id: int) -> Optional[str]:
+        token = self.__current().get(token_id)
+        if token:
+            self.hits += 1
+            return token[0]
+        self.misses += 1
+        self.__reload(force=True)
+        token = self.__tokens.get(token_id)
+        return token[0] if token else None
+
+    def is_enabled(self, token_id: int) -> bool:
+        token = self.__current().get(token_id)
+        return bool(token and token[1])
+
+    def enabled_ids(self) -> List[int]:
+        return sorted(token_id for token_id, token in self.__current().items() if token[1])
+
+    def stats(self) -> Dict[str, int]:
+        return {'tokens': len(self.__tokens), 'hits': self.hits, 'misses': self.misses, 'reloads': self.reloads}
+
+
+def get_token_registry(ttl_secs: float = None) -> TokenRegistry:
+    global token_registry
+    if token_registry:
+        return token_registry
+    token_registry = TokenRegistry(ttl_secs if ttl_secs else TOKEN_TTL_SECS)
+    return token_registry
@@ -0,0 +1,242 @@
+import os
+import socket
+import hashlib
+from time import time
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+from main import transaction, get_logger
+from TokenRepository import TokenRegistry, get_token_registry
+
+
+HEARTBEAT_SECS = 5
+TOKEN_LEASE_SECS = 30
+NODE_TIMEOUT_SECS = 30
+# nodes silent this many timeouts are removed
+NODE_FORGET_TIMEOUTS = 10
+
+token_sharding = None
+
+
+def default_node_id() -> str:
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+def owner(token_id: int, nodes: List[str]) -> str:
+    # rendezvous hashing, a joined or dead node moves only the tokens it gets or had
+    return max(nodes, key=lambda node: hashlib.md5('{}:{}'.format(node, token_id).encode('utf-8')).hexdigest())
+
+
+class TokenLeaseRepository(object):
+    def __init__(self):
+        pass
+
+    def __get_connection(self):
+        return transaction()
+
+    def create_schema(self):
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    create table if not exists stg.scheduler_node
+                    (
+                        node_id varchar(256) not null primary key
+                        , started_at timestamp(3) with time zone not null default now()
+                        , heartbeat_at timestamp(3) with time zone not null
+                    )
+                ''')
+                cur.execute('''
+                    create table if not exists stg.token_lease
+                    (
+                        token_id int not null primary key
+                        , node_id varchar(256) not null
+                        , lease_until timestamp(3) with time zone not null
+                    )
+                ''')
+                cur.execute('''
+                    create index if not exists ix_token_lease_node_id
+                        on stg.token_lease (node_id)
+                ''')
+                conn.commit()
+
+    def heartbeat(self, node_id: str, node_timeout_secs: float) -> List[str]:
+        # live nodes, this one included
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    insert into
+                        stg.scheduler_node as n
+                    (
+                        node_id
+                        , heartbeat_at
+                    )
+                    values
+                    (
+                        %(node_id)s
+                        , now()
+                    )
+                    on conflict (node_id) do update set
+                        heartbeat_at = excluded.heartbeat_at
+                ''', {'node_id': node_id})
+                cur.execute('''
+                    delete from
+                        stg.scheduler_node
+                    where
+                        heartbeat_at < now() - interval '1 second' * %(forget)s
+                ''', {'forget': node_timeout_secs * NODE_FORGET_TIMEOUTS})
+                cur.execute('''
+                    select
+                        node_id
+                    from
+                        stg.scheduler_node
+                    where
+                        heartbeat_at >= now() - interval '1 second' * %(timeout)s
+                    order by
+                        node_id
+                ''', {'timeout': node_timeout_secs})
+                nodes = [row[0] for row in cur.fetchall()]
+                conn.commit()
+        return nodes
+
+    def renew(self, node_id: str, token_ids: List[int], lease_secs: float) -> List[int]:
+        # tokens not assigned any more are released, assigned ones are taken when free or expired,
+        # returns tokens owned by the node
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    delete from
+                        stg.token_lease
+                    where
+                        node_id = %(node_id)s
+                        and
+                        token_id <> all(%(token_ids)s::int[])
+                ''', {'node_id': node_id, 'token_ids': token_ids})
+                cur.execute('''
+                    insert into
+                        stg.token_lease as tl
+                    (
+                        token_id
+                        , node_id
+                        , lease_until
+                    )
+                    select
+                        token_id
+                        , %(node_id)s
+                        , now() + interval '1 second' * %(lease)s
+                    from
+                        unnest(%(token_ids)s::int[]) t(token_id)
+                    on conflict (token_id) do update set
+                        node_id = excluded.node_id
+                        , lease_until = excluded.lease_until
+                    where
+                        tl.node_id = excluded.node_id
+                        or
+                        tl.lease_until < now()
+                    returning
+                        tl.token_id
+                ''', {'node_id': node_id, 'token_ids': token_ids, 'lease': lease_secs})
+                owned = [row[0] for row in cur.fetchall()]
+                conn.commit()
+        return owned
+
+    def owned(self, node_id: str) -> Tuple[List[int], float]:
+        # tokens owned by the node and seconds until the first of their leases ends
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('''
+                    select
+                        token_id
+                        , extract(epoch from lease_until - now())
+                    from
+                        stg.token_lease
+                    where
+                        node_id = %s
+                        and
+                        lease_until > now()
+                ''', (node_id,))
+                rows = cur.fetchall()
+                return [row[0] for row in rows], min([float(row[1]) for row in rows], default=0.0)
+
+    def leave(self, node_id: str):
+        with self.__get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('delete from stg.token_lease where node_id = %s', (node_id,))
+                cur.execute('delete from stg.scheduler_node where node_id = %s', (node_id,))
+                conn.commit()
+
+
+class TokenSharding(object):
+    # enabled tokens of log.token split between live nodes. The writer (node leader) heartbeats
+    # and renews leases, other processes of the node only read what the node owns
+    def __init__(self,
+                 node_id: str,
+                 registry: TokenRegistry = None,
+                 lease_secs: float = TOKEN_LEASE_SECS,
+                 node_timeout_secs: float = NODE_TIMEOUT_SECS):
+        self.node_id = node_id
+        self.__registry = registry if registry else get_token_registry()
+        self.__lease_secs = lease_secs
+        self.__node_timeout_secs = node_timeout_secs
+        self.__repository = TokenLeaseRepository()
+        self.__owned = set()  # type: Set[int]
+        # owned tokens are not used after their leases end without a renewal
+        self.__lease_deadline = 0.0
+        self.__nodes = []  # type: List[str]
+        self.__lock = Lock()
+        self.__logger = get_logger()
+
+    def create_schema(self):
+        self.__repository.create_schema()
+
+    def refresh(self, write: bool):
+        started_at = time()
+        if write:
+            nodes = self.__repository.heartbeat(self.node_id, self.__node_timeout_secs)
+            assigned = [
+                token_id for token_id in self.__registry.enabled_ids() if owner(token_id, nodes) == self.node_id
+            ]
+            owned = self.__repository.renew(self.node_id, assigned, self.__lease_secs)
+            lease_secs = self.__lease_secs
+        else:
+            nodes = self.__nodes
+            owned, lease_secs = self.__repository.owned(self.node_id)
+        with self.__lock:
+            changed = set(owned) != self.__owned or nodes != self.__nodes
+            self.__owned = set(owned)
+            self.__lease_deadline = started_at + lease_secs
+            self.__nodes = nodes
+        if changed:
+            self.__logger.info('TokenSharding: node {} owns {} tokens, live nodes: {}'.format(
+                self.node_id, len(owned), len(nodes)
+            ))
+
+    def __current(self) -> Set[int]:
+        if time() >= self.__lease_deadline:
+            return set()
+        return self.__owned
+
+    def owns(self, token_id: int) -> bool:
+        return token_id in self.__current()
+
+    def leave(self):
+        self.__repository.leave(self.node_id)
+        with self.__lock:
+            self.__owned = set()
+
+    def stats(self) -> Dict[str, int]:
+        return {'owned': len(self.__current()), 'nodes': len(self.__nodes)}
+
+
+def get_token_sharding(node_id: str = None,
+                       lease_secs: float = None,
+                       node_timeout_secs: float = None) -> TokenSharding:
+    global token_sharding
+    if token_sharding:
+        return token_sharding
+    token_sharding = TokenSharding(
+        node_id if node_id else default_node_id(),
+        get_token_registry(),
+        lease_secs if lease_secs else TOKEN_LEASE_SECS,
+        node_timeout_secs if node_timeout_secs else NODE_TIMEOUT_SECS
+    )
+    return token_sharding
@@ -0,0 +1,211 @@
+import signal
+from datetime import datetime
+from threading import current_thread, main_thread
+from tzlocal import get_localzone
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BlockingScheduler
+from apscheduler.jobstores.memory import MemoryJobStore
+
+from LoadHandler import LoadHandler
+from LeaderLock import LeaderLock
+from JobExecutor import JobExecutor, WORKERS, QUEUE_SIZE
+from Dispatcher import TimingDispatcher, LOOKAHEAD_SECS, REFRESH_SECS
+from NotifyListener import NotifyListener
+from TokenRepository import TokenRepository, TOKEN_CHANNEL, get_token_registry
+from TokenSharding import TokenSharding, get_token_sharding, default_node_id, HEARTBEAT_SECS
+from ObjectQueue import ObjectQueue, QueueEntry, QUEUE_CHANNEL, DRAIN_CHANNEL, ISSUE_CHANNEL
+
+from config import Config
+
+
+FILL_SECS = 30
+NOTIFY_FILL_SECS = 300
+CLEANUP_SECS = 120
+LEASE_CHECK_SECS = 60
+
+
+def init_sharding(config: Config, node_id: str = None) -> TokenSharding:
+    # before queues and handlers of the process are created
+    get_token_registry(config.gh_token_ttl_secs)
+    return get_token_sharding(
+        node_id if node_id else (config.sched_node_id if config.sched_node_id else default_node_id()),
+        config.sched_token_lease_secs,
+        config.sched_node_timeout_secs
+    )
+
+
+def prepare_database(config: Config):
+    # once per start, before any worker claims
+    queue = ObjectQueue(config)
+    queue.create_schema()
+    if config.sched_sharding:
+        # queues of other nodes are kept, claims of a previous run are given back by lease expiry
+        get_token_sharding().create_schema()
+    else:
+        queue.clear()
+    if config.sched_notify:
+        queue.create_notify_triggers()
+        TokenRepository().create_notify_trigger()
+
+
+class Worker(object):
+    # loading of one process: claim loop, load jobs and periodic jobs.
+    # With a leader lock fill and cleanup run only in the process holding it
+    def __init__(self, config: Config, logger, leader_lock: LeaderLock = None):
+        self.__config = config
+        self.__logger = logger
+        self.__leader_lock = leader_lock
+        self.queue = ObjectQueue(config)
+        self.load_handler = LoadHandler(logger, config)
+        self.sharding = get_token_sharding() if config.sched_sharding else None  # type: TokenSharding
+
+        # periodic jobs only, one-shot loads go to job_executor. They call methods of the worker,
+        # can't be pickled and are added on every start, processes must not run jobs of each other
+        self.scheduler = BlockingScheduler(
+            jobstores={'default': MemoryJobStore()},
+            executors={'default': ThreadPoolExecutor(4)}
+        )
+        self.job_executor = JobExecutor(
+            config.sched_workers if config.sched_workers else WORKERS,
+            config.sched_worker_queue_size if config.sched_worker_queue_size else QUEUE_SIZE
+        )
+
+        self.dispatcher = None  # type: TimingDispatcher
+        self.async_engine = None
+        if config.sched_engine == 'async':
+            from AsyncLoadHandler import AsyncLoadEngine
+            self.async_engine = AsyncLoadEngine(self.queue, self.load_handler, logger, config)
+        elif config.sched_dispatcher == 'wheel':
+            self.dispatcher = TimingDispatcher(
+                self.queue,
+                self.fire_job,
+                config.sched_dispatch_lookahead if config.sched_dispatch_lookahead else LOOKAHEAD_SECS,
+                config.sched_dispatch_refresh if config.sched_dispatch_refresh else REFRESH_SECS,
+                self.load_handler.is_paused
+            )
+        else:
+            self.__add_periodic(self.prepare_job, 'prepare_job', milliseconds=200)
+        self.__add_periodic(self.fill_queue, 'fill_queue',
+                            seconds=config.sched_fill_secs if config.sched_fill_secs else FILL_SECS)
+        self.__add_periodic(self.delete_ancient_entries, 'delete_ancient_entries', seconds=CLEANUP_SECS)
+        self.__add_periodic(self.release_expired_leases, 'release_expired_leases', seconds=LEASE_CHECK_SECS)
+        self.__add_periodic(self.report_stats, 'report_stats', seconds=60)
+        if self.sharding:
+            self.__add_periodic(self.refresh_tokens, 'refresh_tokens',
+                                seconds=config.sched_heartbeat_secs if config.sched_heartbeat_secs
+                                else HEARTBEAT_SECS)
+
+        self.notify_listener = None  # type: NotifyListener
+        if config.sched_notify:
+            notify_handlers = {
+                DRAIN_CHANNEL: self.wake_fill,
+                ISSUE_CHANNEL: self.on_new_issues,
+                TOKEN_CHANNEL: self.load_handler.token_registry.invalidate
+            }
+            if self.dispatcher:
+                notify_handlers[QUEUE_CHANNEL] = self.dispatcher.notify
+            self.notify_listener = NotifyListener(notify_handlers, self.on_notify_state)
+
+    def __add_periodic(self, func, job_id: str, **interval):
+        self.scheduler.add_job(func, 'interval', id=job_id, replace_existing=True, **interval)
+
+    def is_leader(self) -> bool:
+        return self.__leader_lock.acquire() if self.__leader_lock else True
+
+    def refresh_tokens(self):
+        # the node leader heartbeats and renews token leases, other processes of the node read them
+        self.sharding.refresh(self.is_leader())
+
+    def delete_ancient_entries(self):
+        if self.is_leader():
+            self.queue.delete_ancient_entries()
+
+    def release_expired_leases(self):
+        if self.is_leader():
+            self.queue.release_expired_leases()
+
+    def fill_queue(self):
+        if not self.is_leader():
+            return
+        self.queue.fill()
+        self.__logger.info('fill_queue')
+
+    def report_stats(self):
+        self.__logger.info('http sessions: {}'.format(self.load_handler.session_pool.stats()))
+        if self.load_handler.conditional_cache:
+            self.__logger.info('conditional cache: {}'.format(self.load_handler.conditional_cache.stats()))
+        self.__logger.info('token registry: {}'.format(self.load_handler.token_registry.stats()))
+        self.__logger.info('circuit breaker: {}'.format(self.load_handler.circuit_breaker.stats()))
+        if self.sharding:
+            self.__logger.info('token sharding: {}'.format(self.sharding.stats()))
+
+    def run_job(self, entry: QueueEntry):
+        self.load_handler.handle_entry(entry)
+
+    def fire_job(self, entry: QueueEntry):
+        self.job_executor.submit(self.run_job, entry)
+
+    def prepare_job(self):
+        entries = self.queue.claim_due()
+        for entry in entries:
+            self.fire_job(entry)
+
+    def wake_fill(self, payloads):
+        self.scheduler.modify_job('fill_queue', next_run_time=datetime.now(get_localzone()))
+
+    def on_new_issues(self, payloads):
+        self.queue.rewind_fill(payloads)
+        self.wake_fill(payloads)
+
+    def on_notify_state(self, connected: bool):
+        if connected:
+            fill_secs = self.__config.sched_notify_fill_secs if self.__config.sched_notify_fill_secs \
+                else NOTIFY_FILL_SECS
+        else:
+            fill_secs = self.__config.sched_fill_secs if self.__config.sched_fill_secs else FILL_SECS
+        self.scheduler.reschedule_job('fill_queue', trigger='interval', seconds=fill_secs)
+        if self.dispatcher:
+            self.dispatcher.set_event_driven(connected)
+
+    def stop(self, *args):
+        try:
+            self.scheduler.shutdown(wait=False)
+        except Exception:
+            # not started yet
+            pass
+
+    def run(self, prepare: bool = False):
+        if current_thread() is main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        try:
+            if prepare:
+                prepare_database(self.__config)
+            if self.sharding:
+                self.refresh_tokens()
+            if self.notify_listener:
+                self.notify_listener.start()
+            self.job_executor.start()
+            if self.dispatcher:
+                self.dispatcher.start()
+            if self.async_engine:
+                self.async_engine.start()
+            self.scheduler.start()
+        except Exception as e:
+            print(str(e))
+        finally:
+            if self.notify_listener:
+                self.notify_listener.stop()
+            if self.dispatcher:
+                self.dispatcher.stop()
+            if self.async_engine:
+                self.async_engine.stop()
+            self.job_executor.shutdown()
+            self.load_handler.close()
+            if self.sharding and (self.__leader_lock.is_leader if self.__leader_lock else True):
+                # other nodes take the tokens over without waiting for lease expiry. A process which is
+                # not the node leader keeps them, its siblings may be running
+                self.sharding.leave()
+            if self.__leader_lock:
+                self.__leader_lock.release()
+            print('finally')
@@ -15,10 +15,66 @@ class Config(object):
         self.db_max_connections = None  # type: int
 
         self.gh_per_page = None  # type: int
+        self.gh_pool_size = None  # type: int
+        self.gh_connect_timeout = None  # type: float
+        self.gh_read_timeout = None  # type: float
+        self.gh_max_retries = None  # type: int
+        self.gh_default_interval = None  # type: float
+        self.gh_budget_reserve = None  # type: int
+        self.gh_cache_storage = None  # type: str
+        self.gh_cache_max_entries = None  # type: int
+        self.gh_cache_path = None  # type: str
+        self.gh_page_fanout_max = None  # type: int
+        self.gh_token_ttl_secs = None  # type: float
+
+        self.log_buffered = None  # type: bool
+        self.log_batch_size = None  # type: int
+        self.log_flush_ms = None  # type: int
+        self.log_buffer_size = None  # type: int
+        self.log_resp_text = None  # type: bool
+        self.logging_queued = None  # type: bool
+        self.logging_queue_size = None  # type: int
+        self.logging_json = None  # type: bool
+        self.logging_sample_rates = None  # type: dict
+        self.lanes = None  # type: dict
+        self.sink_enabled = None  # type: bool
+        self.sink_batch_size = None  # type: int
+        self.sink_flush_ms = None  # type: int
+        self.sink_buffer_size = None  # type: int
 
         self.sched_object_per_token = None  # type: int
         self.sched_queue_threshold = None  # type: int
         self.sched_mark_timestamp_delta = None  # type: int
+        self.sched_claim_limit = None  # type: int
+        self.sched_entry_max_age = None  # type: float
+        self.sched_engine = None  # type: str
+        self.sched_async_max_in_flight = None  # type: int
+        self.sched_dispatcher = None  # type: str
+        self.sched_workers = None  # type: int
+        self.sched_worker_queue_size = None  # type: int
+        self.sched_dispatch_lookahead = None  # type: float
+        self.sched_dispatch_refresh = None  # type: float
+        self.sched_group_commit = None  # type: bool
+        self.sched_group_commit_size = None  # type: int
+        self.sched_group_commit_latency_ms = None  # type: int
+        self.sched_group_commit_timeout_secs = None  # type: float
+        self.sched_notify = None  # type: bool
+        self.sched_drain_pages = None  # type: int
+        self.sched_drain_secs = None  # type: float
+        self.sched_fill_secs = None  # type: int
+        self.sched_notify_fill_secs = None  # type: int
+        self.sched_backoff_base_secs = None  # type: float
+        self.sched_backoff_max_secs = None  # type: float
+        self.sched_breaker_failures = None  # type: int
+        self.sched_breaker_open_secs = None  # type: float
+        self.sched_breaker_max_open_secs = None  # type: float
+        self.sched_processes = None  # type: int
+        self.sched_lease_secs = None  # type: float
+        self.sched_sharding = None  # type: bool
+        self.sched_node_id = None  # type: str
+        self.sched_heartbeat_secs = None  # type: float
+        self.sched_token_lease_secs = None  # type: float
+        self.sched_node_timeout_secs = None  # type: float
         self.sched_db = None  # type: Config.DbSettings
 
 
@@ -38,10 +94,70 @@ def get_config(file_name: str = 'config.yaml', encoding: str = 'utf-8') -> Confi
         conf.db_max_connections = y_conf['db_settings']['max_connections']
 
         conf.gh_per_page = y_conf['github_api']['per_page']
+        conf.gh_pool_size = y_conf['github_api'].get('pool_size')
+        conf.gh_connect_timeout = y_conf['github_api'].get('connect_timeout')
+        conf.gh_read_timeout = y_conf['github_api'].get('read_timeout')
+        conf.gh_max_retries = y_conf['github_api'].get('max_retries')
+        conf.gh_default_interval = y_conf['github_api'].get('default_interval')
+        conf.gh_budget_reserve = y_conf['github_api'].get('budget_reserve')
+        conf.gh_cache_storage = y_conf['github_api'].get('cache_storage')
+        conf.gh_cache_max_entries = y_conf['github_api'].get('cache_max_entries')
+        conf.gh_cache_path = y_conf['github_api'].get('cache_path')
+        conf.gh_page_fanout_max = y_conf['github_api'].get('page_fanout_max')
+        conf.gh_token_ttl_secs = y_conf['github_api'].get('token_ttl_secs')
+
+        loading_log = y_conf.get('loading_log', {})
+        conf.log_buffered = loading_log.get('buffered', False)
+        conf.log_batch_size = loading_log.get('batch_size')
+        conf.log_flush_ms = loading_log.get('flush_ms')
+        conf.log_buffer_size = loading_log.get('buffer_size')
+        conf.log_resp_text = loading_log.get('resp_text', True)
+        _logging = y_conf.get('logging', {})
+        conf.logging_queued = _logging.get('queued', False)
+        conf.logging_queue_size = _logging.get('queue_size')
+        conf.logging_json = _logging.get('json', False)
+        conf.logging_sample_rates = _logging.get('sample_rates')
+        conf.lanes = y_conf.get('lanes')
+
+        result_sink = y_conf.get('result_sink', {})
+        conf.sink_enabled = result_sink.get('enabled', False)
+        conf.sink_batch_size = result_sink.get('batch_size')
+        conf.sink_flush_ms = result_sink.get('flush_ms')
+        conf.sink_buffer_size = result_sink.get('buffer_size')
 
         conf.sched_mark_timestamp_delta = y_conf['scheduler']['sched_mark_timestamp_delta']
         conf.sched_queue_threshold = y_conf['scheduler']['sched_queue_threshold']
         conf.sched_object_per_token = y_conf['scheduler']['sched_object_per_token']
+        conf.sched_claim_limit = y_conf['scheduler'].get('sched_claim_limit')
+        conf.sched_entry_max_age = y_conf['scheduler'].get('sched_entry_max_age')
+        conf.sched_engine = y_conf['scheduler'].get('sched_engine', 'threads')
+        conf.sched_async_max_in_flight = y_conf['scheduler'].get('sched_async_max_in_flight')
+        conf.sched_dispatcher = y_conf['scheduler'].get('sched_dispatcher', 'polling')
+        conf.sched_dispatch_lookahead = y_conf['scheduler'].get('sched_dispatch_lookahead')
+        conf.sched_dispatch_refresh = y_conf['scheduler'].get('sched_dispatch_refresh')
+        conf.sched_workers = y_conf['scheduler'].get('sched_workers')
+        conf.sched_worker_queue_size = y_conf['scheduler'].get('sched_worker_queue_size')
+        conf.sched_group_commit = y_conf['scheduler'].get('sched_group_commit', False)
+        conf.sched_group_commit_size = y_conf['scheduler'].get('sched_group_commit_size')
+        conf.sched_group_commit_latency_ms = y_conf['scheduler'].get('sched_group_commit_latency_ms')
+        conf.sched_group_commit_timeout_secs = y_conf['scheduler'].get('sched_group_commit_timeout_secs')
+        conf.sched_notify = y_conf['scheduler'].get('sched_notify', False)
+        conf.sched_drain_pages = y_conf['scheduler'].get('sched_drain_pages')
+        conf.sched_drain_secs = y_conf['scheduler'].get('sched_drain_secs')
+        conf.sched_fill_secs = y_conf['scheduler'].get('sched_fill_secs')
+        conf.sched_notify_fill_secs = y_conf['scheduler'].get('sched_notify_fill_secs')
+        conf.sched_backoff_base_secs = y_conf['scheduler'].get('sched_backoff_base_secs')
+        conf.sched_backoff_max_secs = y_conf['scheduler'].get('sched_backoff_max_secs')
+        conf.sched_breaker_failures = y_conf['scheduler'].get('sched_breaker_failures')
+        conf.sched_breaker_open_secs = y_conf['scheduler'].get('sched_breaker_open_secs')
+        conf.sched_breaker_max_open_secs = y_conf['scheduler'].get('sched_breaker_max_open_secs')
+        conf.sched_processes = y_conf['scheduler'].get('sched_processes')
+        conf.sched_lease_secs = y_conf['scheduler'].get('sched_lease_secs')
+        conf.sched_sharding = y_conf['scheduler'].get('sched_sharding', False)
+        conf.sched_node_id = y_conf['scheduler'].get('sched_node_id')
+        conf.sched_heartbeat_secs = y_conf['scheduler'].get('sched_heartbeat_secs')
+        conf.sched_token_lease_secs = y_conf['scheduler'].get('sched_token_lease_secs')
+        conf.sched_node_timeout_secs = y_conf['scheduler'].get('sched_node_timeout_secs')
         conf.sched_db = Config.DbSettings(
             y_conf['scheduler']['db_host'],
             y_conf['scheduler']['db_database'],
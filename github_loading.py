@@ -1,5 +1,8 @@
 import logging
+from typing import Dict, Optional
+from urllib.parse import urlparse, parse_qs
 from requests.models import Response
+from requests.utils import parse_header_links
 
 from EntityLoader import LoadBehaviour
 
@@ -48,10 +51,28 @@ class GithubLoadBehaviour(LoadBehaviour):
             return cur_page
         return cur_page
 
+    def _get_links(self, resp: Response) -> Dict[str, str]:
+        # Link: <url>; rel="next", <url>; rel="last"
+        link = resp.headers.get('Link')
+        if not link:
+            return {}
+        return {item['rel']: item['url'] for item in parse_header_links(link) if item.get('rel') and item.get('url')}
+
+    def _get_last_page(self, resp: Response) -> Optional[int]:
+        last_url = self._get_links(resp).get('last')
+        if not last_url:
+            return None
+        page = parse_qs(urlparse(last_url).query).get('page')
+        return int(page[0]) if page else None
+
     def _is_last_page(self, return_object_count: int, resp: Response) -> bool:
         resp_status = int(resp.status_code)
-        if (return_object_count < self._per_page) and resp_status < 400:
-            return True
         if resp_status == 404:
             return True
-        return False
+        if resp_status >= 400:
+            return False
+        links = self._get_links(resp)
+        if links:
+            return 'next' not in links
+        # no Link header (single page, 304 of some responses)
+        return return_object_count < self._per_page
@@ -1,7 +1,16 @@
 import json
 import uuid
-from main import transaction
-from typing import Dict, Optional
+from threading import Lock
+from datetime import datetime
+from typing import Dict, Optional, List
+
+from tzlocal import get_localzone
+from psycopg2.extras import execute_values
+
+from main import transaction, join_transaction
+from BufferedWriter import BufferedWriter, BATCH_SIZE, FLUSH_MS, BUFFER_SIZE
+
+ID_BLOCK_SIZE = 1000
 
 
 def get_db_connection():
@@ -40,8 +49,9 @@ class Loading:
 def create_loading(
         url: str,
         params: Optional[Dict[str, str]],
-        headers: Optional[Dict[str, str]]) -> Loading:
-    with get_db_connection() as conn:
+        headers: Optional[Dict[str, str]],
+        conn=None) -> Loading:
+    with join_transaction(conn) as conn:
         with conn.cursor() as cur:
             insert_sql = '''
     INSERT INTO log.loading
@@ -52,7 +62,6 @@ def create_loading(
             obj = Loading()
             _guid = str(uuid.uuid4())
             cur.execute(insert_sql, (url, json.dumps(params), json.dumps(headers), _guid))
-            conn.commit()
             row = cur.fetchall()[0]
             obj.id = row[0]
             obj.begin_timestamp = row[1]
@@ -82,8 +91,8 @@ def update_request_info(obj: Loading):
             conn.commit()
 
 
-def finish_loading(obj: Loading) -> Loading:
-    with get_db_connection() as conn:
+def finish_loading(obj: Loading, conn=None) -> Loading:
+    with join_transaction(conn) as conn:
         with conn.cursor() as cur:
             update_script = '''
     update log.loading
@@ -107,7 +116,110 @@ def finish_loading(obj: Loading) -> Loading:
                 str(obj.id)
             ))
             obj.end_timestamp = cur.fetchone()[0]
-            conn.commit()
+    return obj
+
+
+_INSERT_LOADING_SQL = '''
+    INSERT INTO log.loading
+        (id, guid, url, req_params, req_headers, begin_timestamp,
+         resp_status, resp_headers, resp_text, resp_raw, end_timestamp, error)
+        VALUES %s
+'''
+
+
+def _loading_row(obj: Loading) -> tuple:
+    return (
+        obj.id,
+        obj.guid,
+        obj.url,
+        json.dumps(obj.req_params),
+        json.dumps(obj.req_headers),
+        obj.begin_timestamp,
+        obj.resp_status,
+        json.dumps(obj.resp_headers) if obj.resp_headers else None,
+        obj.resp_text if obj.resp_text else None,
+        json.dumps(obj.resp_raw) if obj.resp_raw else None,
+        obj.end_timestamp,
+        obj.error[:4096] if obj.error else None
+    )
+
+
+class LoadingIdAllocator(object):
+    # ids of log.loading are reserved from its sequence in blocks
+    def __init__(self, block_size: int = ID_BLOCK_SIZE):
+        self.__block_size = block_size
+        self.__ids = []  # type: List[int]
+        self.__lock = Lock()
+
+    def next_id(self) -> int:
+        with self.__lock:
+            if not self.__ids:
+                self.__ids = self.__reserve()
+            return self.__ids.pop()
+
+    def __reserve(self) -> List[int]:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "select nextval('log.loading_id_seq') from generate_series(1, %s)",
+                    (self.__block_size,)
+                )
+                ids = [row[0] for row in cur.fetchall()]
+                conn.commit()
+        ids.reverse()
+        return ids
+
+
+class LoadingWriter(BufferedWriter):
+    # replaces create_loading/finish_loading: a loading is written once, when finished
+    def __init__(self,
+                 batch_size: int = BATCH_SIZE,
+                 flush_ms: int = FLUSH_MS,
+                 buffer_size: int = BUFFER_SIZE):
+        super().__init__('loading-writer', batch_size, flush_ms, buffer_size)
+
+    def create(self,
+               url: str,
+               params: Optional[Dict[str, str]],
+               headers: Optional[Dict[str, str]]) -> Loading:
+        return new_loading(url, params, headers)
+
+    def finish(self, obj: Loading) -> Loading:
+        obj.end_timestamp = datetime.now(get_localzone())
+        self.put(obj)
+        return obj
+
+    def _flush(self, items: List[Loading]):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, _INSERT_LOADING_SQL, [_loading_row(obj) for obj in items], page_size=len(items))
+                conn.commit()
+
+
+_id_allocator = LoadingIdAllocator()
+
+
+def new_loading(
+        url: str,
+        params: Optional[Dict[str, str]],
+        headers: Optional[Dict[str, str]]) -> Loading:
+    # in memory only, written by insert_loading when finished
+    obj = Loading()
+    obj.id = _id_allocator.next_id()
+    obj.guid = str(uuid.uuid4())
+    obj.begin_timestamp = datetime.now(get_localzone())
+    obj.url = url
+    obj.req_params = params
+    obj.req_headers = headers
+    return obj
+
+
+def insert_loading(obj: Loading, conn=None) -> Loading:
+    if not obj.end_timestamp:
+        obj.end_timestamp = datetime.now(get_localzone())
+    with join_transaction(conn) as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, _INSERT_LOADING_SQL, [_loading_row(obj)])
     return obj
 
 
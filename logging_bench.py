@@ -0,0 +1,100 @@
+import os
+import logging
+import tempfile
+from time import perf_counter
+from uuid import uuid4
+from threading import Thread
+from logging.handlers import RotatingFileHandler
+
+from LogPipeline import start_pipeline, get_formatter, REQUEST, PAGE
+
+
+JOBS = 20000
+THREADS = 8
+
+_url = 'https://api.github.com/repos/o/r/issues/1/comments'
+
+
+def eager_job(logger: logging.Logger):
+    # logging of one job as it was done before: strings are built for filtered debug lines too
+    _uuid = uuid4()
+    logger.debug('LoadHandler.handle: start. uuid: {}'.format(_uuid))
+    logger.info('type: {}, token_id: {}, url: {}. uuid: {}'.format('comments', 7, _url, _uuid))
+    logger.info('token_id: {}, proc_uuid: {}, type: {}, state: {}, page: {}, count: {}, limit: {}, url: {}'.format(
+        7, _uuid, 'comments', 200, 1, 100, 4999, _url
+    ))
+    logger.debug('LoadHandler.handle: loaded. uuid: {}'.format(_uuid))
+    logger.debug('LoadHandler._handle_ok: start. uuid: {}'.format(_uuid))
+    logger.debug('LoadHandler._handle_ok: added next page. uuid: {}'.format(_uuid))
+    logger.debug('LoadHandler._handle_ok: enqueue done. uuid: {}'.format(_uuid))
+    logger.debug('LoadHandler.handle: end. uuid: {}'.format(_uuid))
+
+
+def lazy_job(logger: logging.Logger):
+    _uuid = uuid4()
+    logger.debug('LoadHandler.handle: start. uuid: %s', _uuid)
+    logger.info('type: %s, token_id: %s, url: %s. uuid: %s', 'comments', 7, _url, _uuid, extra=REQUEST)
+    logger.info('token_id: %s, proc_uuid: %s, type: %s, state: %s, page: %s, count: %s, limit: %s, url: %s',
+                7, _uuid, 'comments', 200, 1, 100, 4999, _url, extra=PAGE)
+    logger.debug('LoadHandler.handle: loaded. uuid: %s', _uuid)
+    logger.debug('LoadHandler._handle_ok: start. uuid: %s', _uuid)
+    logger.debug('LoadHandler._handle_ok: added next page. uuid: %s', _uuid)
+    logger.debug('LoadHandler._handle_ok: enqueue done. uuid: %s', _uuid)
+    logger.debug('LoadHandler.handle: end. uuid: %s', _uuid)
+
+
+def get_handlers(path: str, as_json: bool = False):
+    file_handler = RotatingFileHandler(os.path.join(path, 'bench.log'), mode='a', maxBytes=2e7, backupCount=10)
+    console_handler = logging.StreamHandler(open(os.devnull, 'w'))
+    for handler in (file_handler, console_handler):
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(get_formatter(as_json))
+    return [file_handler, console_handler]
+
+
+def new_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def run_threads(job, logger: logging.Logger, jobs: int, threads: int) -> float:
+    def worker():
+        for _ in range(jobs // threads):
+            job(logger)
+    started = perf_counter()
+    workers = [Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return perf_counter() - started
+
+
+def measure(name: str, job, logger: logging.Logger, jobs: int = JOBS, threads: int = THREADS):
+    elapsed = run_threads(job, logger, jobs, threads)
+    print('{:<36} {:>9.0f} jobs/s {:>8.2f} us/job'.format(name, jobs / elapsed, elapsed / jobs * 1e6))
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as path:
+        logger = new_logger('bench_direct')
+        for handler in get_handlers(path):
+            logger.addHandler(handler)
+        measure('direct handlers, eager format', eager_job, logger)
+        measure('direct handlers, lazy format', lazy_job, logger)
+
+        for name, as_json, rates in (
+            ('queue, lazy format', False, None),
+            ('queue, lazy format, json', True, None),
+            ('queue, lazy format, sampled 0.1', False, {'request': 0.1, 'page': 0.1})
+        ):
+            logger = new_logger('bench_{}'.format(name))
+            # queue holds all records of the run, nothing is dropped
+            listener = start_pipeline(logger, get_handlers(path, as_json), JOBS * 2, rates)
+            measure(name, lazy_job, logger)
+            # records left in the queue are written by the writer thread, not by workers
+            started = perf_counter()
+            listener.stop()
+            print('{:<36} {:>9.3f} s drain, {} dropped'.format('', perf_counter() - started, listener.dropped))
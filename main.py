@@ -6,6 +6,7 @@ from psycopg2.pool import ThreadedConnectionPool
 from logging.handlers import RotatingFileHandler
 
 from config import get_config
+from LogPipeline import start_pipeline, get_formatter, LOG_QUEUE_SIZE
 
 
 logger = None
@@ -46,6 +47,64 @@ def transaction(name="transaction", **kwargs):
         pool.putconn(conn)
 
 
+@contextmanager
+def join_transaction(conn=None, name="transaction"):
+    # work of a caller's unit of work is committed by its owner
+    if conn is not None:
+        yield conn
+        return
+    with transaction(name) as own_conn:
+        yield own_conn
+
+
+class UnitOfWork(object):
+    # one transaction on one pool connection for all database work of a job.
+    # The connection is checked out on first use, deferred writes run right before commit,
+    # after-commit actions once it is committed and the connection is back in the pool
+    def __init__(self, name="unit_of_work"):
+        self.__name = name
+        self.__conn = None
+        self.__deferred = []
+        self.__after_commit = []
+
+    @property
+    def conn(self):
+        if self.__conn is None:
+            self.__conn = pool.getconn()
+        return self.__conn
+
+    def defer(self, write):
+        self.__deferred.append(write)
+
+    def after_commit(self, action):
+        self.__after_commit.append(action)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                for write in self.__deferred:
+                    write(self.conn)
+                if self.__conn is not None:
+                    self.__conn.commit()
+        except Exception as e:
+            logger.error("{} error: {}".format(self.__name, e))
+            raise
+        finally:
+            conn, self.__conn = self.__conn, None
+            self.__deferred = []
+            after_commit, self.__after_commit = self.__after_commit, []
+            if conn is not None:
+                # not committed work is rolled back by the pool
+                pool.putconn(conn, close=bool(conn.closed))
+        if exc_type is None:
+            for action in after_commit:
+                action()
+        return False
+
+
 def get_logger(logger_file: str = None):
     global logger
     if logger:
@@ -59,12 +118,20 @@ def get_logger(logger_file: str = None):
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
 
-    _formatter = logging.Formatter('%(asctime)s - %(name)s:%(threadName)s - %(levelname)s - %(message)s')
+    _formatter = get_formatter(_config.logging_json)
     file_handler.setFormatter(_formatter)
     console_handler.setFormatter(_formatter)
 
     logger = logging.getLogger('repo_loading')
     logger.setLevel(logging.INFO)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if _config.logging_queued:
+        # file and console are written by the log writer thread
+        start_pipeline(
+            logger, [file_handler, console_handler],
+            _config.logging_queue_size if _config.logging_queue_size else LOG_QUEUE_SIZE,
+            _config.logging_sample_rates
+        )
+    else:
+        logger.addHandler(file_handler)
+        logger.addHandler(console_handler)
     return logger
@@ -0,0 +1,70 @@
+import sys
+import tracemalloc
+from time import perf_counter
+from copy import deepcopy
+from datetime import datetime, timezone
+
+from QueueEntry import QueueEntry
+
+
+ENTRIES = 100000
+
+_now = datetime.now(timezone.utc)
+_row = (
+    1, 7, 'https://api.github.com/repos/o/r/issues/1/comments', 'comments',
+    'https://api.github.com/repos/o/r/issues/1', 0, _now, _now, None, 'to_process',
+    '8b7f5f1a-3c2b-4f7e-9a51-1b2c3d4e5f60', _now, '{}', '{"per_page": 100, "page": 1}', 'token'
+)
+_columns = (
+    'id', 'token_id', 'url', 'object_type', 'base_object_url', 'retry_count', 'created_at', 'updated_at',
+    'closed_at', 'state', 'uuid', 'execute_at', 'headers', 'params', 'token'
+)
+_dict_row = dict(zip(_columns, _row))
+
+
+def from_dict_row(raw: dict) -> QueueEntry:
+    # field by field mapping of RealDictCursor rows, as it was done before
+    result = QueueEntry()
+    result.id = raw['id']
+    result.token_id = raw['token_id']
+    result.url = raw['url']
+    result.entry_type = raw['object_type']
+    result.base_url = raw['base_object_url']
+    result.retry_count = raw['retry_count']
+    result.created_at = raw['created_at']
+    result.updated_at = raw['updated_at']
+    result.closed_at = raw['closed_at']
+    result.state = raw['state']
+    result.uuid = raw['uuid']
+    result.execute_at = raw['execute_at']
+    result.headers = raw['headers']
+    result.params = raw['params']
+    result.token = raw['token']
+    return result
+
+
+def measure(name: str, fn, count: int = ENTRIES):
+    started = perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = perf_counter() - started
+    print('{:<28} {:>9.0f} entries/s {:>8.2f} us/entry'.format(name, count / elapsed, elapsed / count * 1e6))
+
+
+def measure_memory(count: int = ENTRIES):
+    tracemalloc.start()
+    entries = [QueueEntry.from_row(_row) for _ in range(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<28} {:>9.0f} bytes/entry (sys.getsizeof: {})'.format(
+        'allocation', current / count, sys.getsizeof(entries[0])
+    ))
+
+
+if __name__ == '__main__':
+    entry = QueueEntry.from_row(_row)
+    measure('from_row', lambda: QueueEntry.from_row(_row))
+    measure('dict row, field by field', lambda: from_dict_row(_dict_row))
+    measure('with_changes', lambda: entry.with_changes(params='{"per_page": 100, "page": 2}'))
+    measure('deepcopy', lambda: deepcopy(entry), ENTRIES // 10)
+    measure_memory()
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import psycopg2.pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules of the repository are imported by name, as in object_queue_debug.py
+sys.path.insert(0, ROOT)
+
+import config
+
+
+class NoDatabasePool(object):
+    # main creates the pool at import, tests don't reach the database
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def getconn(self, key=None):
+        raise psycopg2.pool.PoolError('no database in tests')
+
+    def putconn(self, conn, key=None, close=False):
+        pass
+
+
+def get_sample_config(file_name: str = 'config.yaml', encoding: str = 'utf-8') -> config.Config:
+    return _get_config(os.path.join(ROOT, 'config_sample.yaml'), encoding)
+
+
+# main reads config.yaml and connects at import, a clean checkout has neither
+_get_config = config.get_config
+config.get_config = get_sample_config
+psycopg2.pool.ThreadedConnectionPool = NoDatabasePool
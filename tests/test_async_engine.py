@@ -0,0 +1,187 @@
+import json
+import asyncio
+import logging
+from threading import current_thread
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from loading import Loading
+from RetryPolicy import ErrorClass, classify, classify_exception
+from TokenBudget import TokenBudgetTracker
+from ConditionalCache import ConditionalCache, CacheStorage, MemoryCacheStorage
+from AsyncEntityLoader import AsyncEntityLoader
+from AsyncSimplePageableBehaviour import AsyncSimplePageableBehaviour
+
+
+PER_PAGE = 2
+LAST_PAGE = 5
+ETAG = '"comments-v1"'
+READ_TIMEOUT = 0.2
+
+logger = logging.getLogger('test_async_engine')
+
+
+class MemoryLoadingWriter(object):
+    # LoadingWriter keeping finished loadings instead of writing log.loading
+    def __init__(self):
+        self.loadings = []
+
+    def create(self, url, params, headers) -> Loading:
+        loading = Loading()
+        loading.url = url
+        loading.req_params = params
+        loading.req_headers = headers
+        return loading
+
+    def finish(self, loading: Loading) -> Loading:
+        self.loadings.append(loading)
+        return loading
+
+
+class ThreadRecordingStorage(MemoryCacheStorage):
+    # blocking like disk and postgres storages, remembers threads it was called on
+    blocking = CacheStorage.blocking
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    def get(self, key):
+        self.threads.add(current_thread().name)
+        return super().get(key)
+
+    def put(self, key, entry):
+        self.threads.add(current_thread().name)
+        super().put(key, entry)
+
+
+async def paged(request):
+    page = int(request.query.get('page', 1))
+    # request.url of older aiohttp fails with newer yarl
+    url = 'http://{}{}'.format(request.host, request.path)
+    link = '<{0}?per_page={1}&page={2}>; rel="next", <{0}?per_page={1}&page={3}>; rel="last"'.format(
+        url, PER_PAGE, page + 1, LAST_PAGE
+    )
+    return web.json_response([{'id': page * 10 + i} for i in range(PER_PAGE)], headers={'Link': link})
+
+
+async def conditional(request):
+    if request.headers.get('If-None-Match') == ETAG:
+        return web.Response(status=304, headers={'ETag': ETAG})
+    return web.json_response([{'id': 1}], headers={'ETag': ETAG})
+
+
+async def limited(request):
+    return web.json_response({'message': 'API rate limit exceeded'}, status=int(request.match_info['status']), headers={
+        'X-RateLimit-Limit': '5000',
+        'X-RateLimit-Remaining': '0',
+        'Retry-After': '60'
+    })
+
+
+async def slow(request):
+    await asyncio.sleep(READ_TIMEOUT * 5)
+    return web.json_response([])
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def server(loop):
+    app = web.Application()
+    app.router.add_get('/repos/o/r/issues/1/comments', paged)
+    app.router.add_get('/repos/o/r/issues/2/comments', conditional)
+    app.router.add_get('/repos/o/r/issues/3/comments/{status}', limited)
+    app.router.add_get('/repos/o/r/issues/4/comments', slow)
+    server = TestServer(app)
+    loop.run_until_complete(server.start_server())
+    yield server
+    loop.run_until_complete(server.close())
+
+
+async def new_session() -> aiohttp.ClientSession:
+    # the session takes the running loop
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(sock_read=READ_TIMEOUT))
+
+
+@pytest.fixture
+def session(loop):
+    session = loop.run_until_complete(new_session())
+    yield session
+    loop.run_until_complete(session.close())
+
+
+def load(loop, session, url: str, cache: ConditionalCache = None, writer: MemoryLoadingWriter = None,
+         db_executor: ThreadPoolExecutor = None):
+    behaviour = AsyncSimplePageableBehaviour(
+        'token', PER_PAGE, logger, 'comments', str(url), '{}', json.dumps({'per_page': PER_PAGE, 'page': 1}),
+        1, 'uuid', session, cache, 50, db_executor
+    )
+    return loop.run_until_complete(
+        AsyncEntityLoader(behaviour, loading_writer=writer if writer else MemoryLoadingWriter()).load()
+    )
+
+
+def test_link_header_fans_out_remaining_pages(loop, server, session):
+    result = load(loop, session, server.make_url('/repos/o/r/issues/1/comments'))
+    assert result.resp_status == 200
+    assert result.result == [{'id': 10}, {'id': 11}]
+    assert not result.is_last_page
+    assert result.next_load_context is None
+    assert [c.params['page'] for c in result.fanout_load_contexts] == [2, 3, 4, 5]
+
+
+def test_not_modified_serves_cached_page(loop, server, session):
+    cache = ConditionalCache(MemoryCacheStorage())
+    url = server.make_url('/repos/o/r/issues/2/comments')
+    first = load(loop, session, url, cache)
+    second = load(loop, session, url, cache)
+    assert first.resp_status == 200
+    assert second.resp_status == 304
+    assert second.result == [{'id': 1}]
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_blocking_cache_storage_runs_off_event_loop(loop, server, session):
+    storage = ThreadRecordingStorage()
+    executor = ThreadPoolExecutor(1)
+    try:
+        load(loop, session, server.make_url('/repos/o/r/issues/2/comments'), ConditionalCache(storage),
+             db_executor=executor)
+    finally:
+        executor.shutdown()
+    assert storage.threads
+    assert current_thread().name not in storage.threads
+
+
+@pytest.mark.parametrize('status', [403, 429])
+def test_rate_limited_response_pauses_token(loop, server, session, status):
+    result = load(loop, session, server.make_url('/repos/o/r/issues/3/comments/{}'.format(status)))
+    assert result.resp_status == status
+    assert classify(result.resp_status) == ErrorClass.RATE_LIMIT
+    assert not result.is_last_page
+    # the same page is loaded again after the pause
+    assert result.next_load_context.params['page'] == 1
+    tracker = TokenBudgetTracker()
+    tracker.update(1, result.resp_status, result.resp_headers)
+    assert tracker.paused_until(1) > 0
+
+
+def test_timeout_is_raised_as_transient(loop, server, session):
+    writer = MemoryLoadingWriter()
+    with pytest.raises(asyncio.TimeoutError) as error:
+        load(loop, session, server.make_url('/repos/o/r/issues/4/comments'), writer=writer)
+    assert classify_exception(error.value) == ErrorClass.TRANSIENT
+    assert len(writer.loadings) == 1
+    assert writer.loadings[0].resp_status == 0
@@ -0,0 +1,28 @@
+from threading import Thread
+
+from ConditionalCache import ConditionalCache, MemoryCacheStorage
+
+
+URL = 'https://api.github.com/repos/o/r/issues/1/comments?page=1'
+
+
+def test_pages_are_not_shared_between_tokens():
+    cache = ConditionalCache(MemoryCacheStorage())
+    cache.store(1, URL, 200, {'ETag': '"v1"'}, '[]', None)
+    assert cache.get(1, URL).etag == '"v1"'
+    assert cache.get(2, URL) is None
+
+
+def test_counts_of_concurrent_jobs_are_exact():
+    cache = ConditionalCache(MemoryCacheStorage())
+
+    def load():
+        for _ in range(10000):
+            cache.store(1, URL, 304, {}, '', None)
+
+    threads = [Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats() == {'hits': 80000, 'misses': 0}
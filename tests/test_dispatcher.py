@@ -0,0 +1,36 @@
+import logging
+from datetime import datetime
+from threading import Event
+
+import Dispatcher
+from QueueEntry import QueueEntry
+from Dispatcher import TimingDispatcher
+
+
+class ClaimOnceQueue(object):
+    # the entries are claimed by the first refresh
+    def __init__(self, entries):
+        self.entries = entries
+        self.released = []
+        self.done = Event()
+
+    def claim_upcoming(self, horizon_secs):
+        entries, self.entries = self.entries, []
+        return entries
+
+    def release(self, entries):
+        self.released.extend(entries)
+        self.done.set()
+
+
+def test_entries_of_paused_token_are_released_not_fired(monkeypatch):
+    monkeypatch.setattr(Dispatcher, 'get_logger', lambda: logging.getLogger('test_dispatcher'))
+    now = datetime.now().astimezone()
+    queue = ClaimOnceQueue([QueueEntry(id=1, token_id=1, execute_at=now), QueueEntry(id=2, token_id=2, execute_at=now)])
+    fired = []
+    dispatcher = TimingDispatcher(queue, fired.append, 5.0, 0.01, lambda token_id: token_id == 2)
+    dispatcher.start()
+    assert queue.done.wait(5)
+    dispatcher.stop()
+    assert [e.id for e in fired] == [1]
+    assert [e.id for e in queue.released] == [2]
@@ -0,0 +1,22 @@
+import queue
+import logging
+from threading import Timer
+
+from LogPipeline import DroppingQueueHandler
+
+
+def record(level: int) -> logging.LogRecord:
+    return logging.LogRecord('test_log_pipeline', level, __file__, 1, 'message', None, None)
+
+
+def test_full_queue_drops_info_but_waits_for_error():
+    log_queue = queue.Queue(1)
+    handler = DroppingQueueHandler(log_queue, block_secs=5.0)
+    handler.handle(record(logging.INFO))
+    handler.handle(record(logging.INFO))
+    assert handler.dropped == 1
+    # the writer thread takes a record meanwhile
+    Timer(0.1, log_queue.get).start()
+    handler.handle(record(logging.ERROR))
+    assert handler.dropped == 1
+    assert log_queue.get_nowait().levelno == logging.ERROR
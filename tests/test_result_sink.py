@@ -0,0 +1,34 @@
+import logging
+
+import BufferedWriter
+from EntityLoader import LoadContext
+from ResultSink import CommentSink
+
+
+URL = 'https://api.github.com/repos/o/r/issues/1/comments'
+
+
+class RecordingSink(CommentSink):
+    # the database is not reachable, every flush fails
+    def __init__(self):
+        super().__init__(batch_size=2, flush_ms=10)
+        self.flushes = 0
+        self.reloaded = []
+
+    def _flush(self, items):
+        self.flushes += 1
+        super()._flush(items)
+
+    def _reload(self, base_urls):
+        self.reloaded.append(base_urls)
+
+
+def test_failed_batch_is_retried_then_loaded_again(monkeypatch):
+    monkeypatch.setattr(BufferedWriter, 'FLUSH_RETRY_SECS', 0)
+    monkeypatch.setattr(BufferedWriter, 'get_logger', lambda: logging.getLogger('test_result_sink'))
+    sink = RecordingSink()
+    sink.start()
+    sink.put_result(URL, LoadContext(URL, None, None).get_load_result([{'id': 1}, {'id': 2}], 200))
+    sink.close()
+    assert sink.flushes == 1 + BufferedWriter.FLUSH_RETRIES
+    assert sink.reloaded == [[URL]]
@@ -0,0 +1,105 @@
+import json
+import asyncio
+import logging
+
+import pytest
+from requests.exceptions import ReadTimeout, ConnectionError
+
+from loading import Loading
+from EntityLoader import EntityLoader
+from SimplePageableBehaviour import SimplePageableBehaviour
+from RetryPolicy import ErrorClass, CircuitBreaker, classify, classify_exception
+
+
+URL = 'https://api.github.com/repos/o/r/issues/1/comments'
+
+logger = logging.getLogger('test_retry_policy')
+
+
+class MemoryLoadingWriter(object):
+    def __init__(self):
+        self.loadings = []
+
+    def create(self, url, params, headers) -> Loading:
+        loading = Loading()
+        loading.url = url
+        return loading
+
+    def finish(self, loading: Loading) -> Loading:
+        self.loadings.append(loading)
+        return loading
+
+
+class TextResponse(object):
+    def __init__(self, text: str):
+        self.status_code = 200
+        self.headers = {}
+        self.text = text
+
+
+class FakeSession(object):
+    # answers every request with the response, or raises the exception
+    def __init__(self, answer):
+        self.answer = answer
+
+    def get(self, url: str, headers=None, timeout=None):
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+def load(answer):
+    writer = MemoryLoadingWriter()
+    behaviour = SimplePageableBehaviour(
+        'token', 100, logger, 'comments', URL, '{}', json.dumps({'per_page': 100, 'page': 1}), 1, 'uuid',
+        FakeSession(answer)
+    )
+    with pytest.raises(Exception) as error:
+        EntityLoader(behaviour, writer).load()
+    assert len(writer.loadings) == 1
+    assert writer.loadings[0].error == str(error.value)
+    return error.value
+
+
+@pytest.mark.parametrize('status, error_class', [
+    (None, ErrorClass.TRANSIENT),
+    (404, ErrorClass.PERMANENT),
+    (410, ErrorClass.PERMANENT),
+    (403, ErrorClass.RATE_LIMIT),
+    (429, ErrorClass.RATE_LIMIT),
+    (502, ErrorClass.TRANSIENT),
+    (422, ErrorClass.OTHER)
+])
+def test_classify_status(status, error_class):
+    assert classify(status) == error_class
+
+
+@pytest.mark.parametrize('ex', [ReadTimeout('read timeout'), ConnectionError('reset'), asyncio.TimeoutError()])
+def test_request_failures_are_transient(ex):
+    assert classify_exception(ex) == ErrorClass.TRANSIENT
+
+
+def test_local_faults_are_not_transient():
+    with pytest.raises(ValueError) as decode_error:
+        json.loads('not json')
+    assert classify_exception(decode_error.value) == ErrorClass.OTHER
+    assert classify_exception(RuntimeError('database is gone')) == ErrorClass.OTHER
+
+
+def test_invalid_body_of_ok_response_is_not_transient():
+    error = load(TextResponse('not json'))
+    assert isinstance(error, ValueError)
+    assert classify_exception(error) == ErrorClass.OTHER
+
+
+def test_timeout_of_loader_is_transient():
+    error = load(ReadTimeout('read timeout'))
+    assert classify_exception(error) == ErrorClass.TRANSIENT
+
+
+def test_breaker_opens_at_threshold_and_closes_on_success():
+    breaker = CircuitBreaker(failures=2, open_secs=60)
+    assert breaker.record_failure(1) is None
+    assert breaker.record_failure(1)
+    breaker.record_success(1)
+    assert breaker.record_failure(1) is None
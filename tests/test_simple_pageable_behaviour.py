@@ -0,0 +1,85 @@
+import json
+import logging
+
+from loading import Loading
+from SimplePageableBehaviour import SimplePageableBehaviour, FANOUT_PARAM
+
+
+PER_PAGE = 100
+FANOUT_MAX = 50
+LAST_PAGE = 120
+URL = 'https://api.github.com/repos/o/r/issues/1/comments'
+
+logger = logging.getLogger('test_simple_pageable_behaviour')
+
+
+class PageResponse(object):
+    # the part of requests.Response used by the behaviour
+    def __init__(self, page: int):
+        self.status_code = 200
+        self.headers = {'Link': '<{0}?per_page={1}&page={2}>; rel="next", <{0}?per_page={1}&page={3}>; rel="last"'
+                        .format(URL, PER_PAGE, page + 1, LAST_PAGE)}
+        self.text = json.dumps([{'id': page}] * PER_PAGE)
+
+
+class PageSession(object):
+    def __init__(self):
+        self.pages = []
+
+    def get(self, url: str, headers=None, timeout=None):
+        page = int(url.split('page=')[-1])
+        self.pages.append(page)
+        return PageResponse(page)
+
+
+def load(params: dict):
+    session = PageSession()
+    behaviour = SimplePageableBehaviour(
+        'token', PER_PAGE, logger, 'comments', URL, '{}', json.dumps(params), 1, 'uuid', session,
+        _fanout_max=FANOUT_MAX
+    )
+    context = behaviour.get_load_context()
+    loading = Loading()
+    loading.url = URL
+    return behaviour.load(context, loading), session.pages
+
+
+def fanout(result):
+    return [(c.params['page'], c.params.get(FANOUT_PARAM)) for c in result.fanout_load_contexts]
+
+
+def test_first_page_fans_out_up_to_cap():
+    result, pages = load({'per_page': PER_PAGE, 'page': 1})
+    assert pages == [1]
+    assert fanout(result) == [(page, 1) for page in range(2, 51)] + [(51, None)]
+
+
+def test_last_page_of_capped_fanout_continues_after_it():
+    result, pages = load({'per_page': PER_PAGE, 'page': 51})
+    assert pages == [51]
+    assert result.next_load_context is None
+    assert fanout(result) == [(page, 1) for page in range(52, 101)] + [(101, None)]
+
+
+def test_fanout_ends_at_last_page():
+    result, _ = load({'per_page': PER_PAGE, 'page': 101})
+    assert fanout(result) == [(page, 1) for page in range(102, LAST_PAGE + 1)]
+
+
+def test_fanned_out_page_enqueues_nothing():
+    result, pages = load({'per_page': PER_PAGE, 'page': 60, FANOUT_PARAM: 1})
+    assert pages == [60]
+    assert result.next_load_context is None
+    assert result.fanout_load_contexts == []
+
+
+def test_next_page_without_fanout():
+    session = PageSession()
+    behaviour = SimplePageableBehaviour(
+        'token', PER_PAGE, logger, 'comments', URL, '{}', json.dumps({'per_page': PER_PAGE, 'page': 7}), 1,
+        'uuid', session
+    )
+    loading = Loading()
+    loading.url = URL
+    result = behaviour.load(behaviour.get_load_context(), loading)
+    assert result.next_load_context.params['page'] == 8